@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+from base64 import urlsafe_b64encode
+from enum import Enum
+
+from aiogram.filters.callback_data import CallbackData
+from cachetools import TTLCache
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+# Сколько поисковых запросов помнить для кнопок пагинации и как долго (секунды)
+QUERY_TOKEN_CACHE_SIZE = int(os.getenv('QUERY_TOKEN_CACHE_SIZE', 10000))
+QUERY_TOKEN_TTL = int(os.getenv('QUERY_TOKEN_TTL', 24 * 3600))
+
+
+class SearchIn(str, Enum):
+    """
+    Категория поиска; имя совпадает с search_in в запросах к базе, значение - код в callback-данных.
+    """
+
+    on_hand = "h"
+    to_order = "o"
+
+
+class ListContext(str, Enum):
+    """
+    Источник списка жидкостей в пагинации; имя совпадает с контекстом в событиях и префиксах.
+    """
+
+    brand = "b"
+    tag = "t"
+    flavor = "q"
+    flt = "f"
+    sim = "s"
+    mtags = "m"
+
+
+class PageCallback(CallbackData, prefix="pg"):
+    """
+    Переход на страницу списка: pg:<страница>:<контекст>:<значение>:<категория>:<сортировка>.
+
+    Значение - ID бренда или тега, токен ключа вейпа для похожих, закодированные фильтры
+    или маски тегов, а для поиска по вкусу - токен запроса (см. QueryTokens).
+    """
+
+    page: int
+    context: ListContext
+    value: str
+    search_in: SearchIn
+    sort: str | None = None
+
+
+class BrandCallback(CallbackData, prefix="br"):
+    """
+    Список жидкостей бренда: br:<ID бренда>:<категория>.
+    """
+
+    brand_id: int
+    search_in: SearchIn
+
+
+class TagCallback(CallbackData, prefix="tg"):
+    """
+    Список жидкостей с тегом: tg:<ID тега>:<категория>.
+    """
+
+    tag_id: int
+    search_in: SearchIn
+
+
+class SimilarCallback(CallbackData, prefix="sm"):
+    """
+    Похожие вкусы: sm:<токен вейпа>:<категория>.
+    Токен стабильного ключа вейпа вместо ID, как в SubscribeCallback.
+    """
+
+    vape: str
+    search_in: SearchIn
+
+
+class SubscribeCallback(CallbackData, prefix="sb"):
+    """
+    Подписка на вейп, бренд или тег: sb:<вид>:<токен>.
+
+    Вместо ID записывается токен стабильного ключа цели (см. key_token в app/database/catalog.py):
+    ID назначаются заново при каждом обновлении каталога.
+    """
+
+    kind: str
+    target: str
+
+
+class SearchMenuCallback(CallbackData, prefix="sr"):
+    """
+    Начало поиска из меню категории: sr:<вид поиска>:<категория>.
+    Вид поиска - brand, tag или flavor из ListContext.
+    """
+
+    kind: ListContext
+    search_in: SearchIn
+
+
+class TagMaskCallback(CallbackData, prefix="mt"):
+    """
+    Мультивыбор тегов: mt:<маски>:<категория>.
+
+    Маски тегов И / ИЛИ / НЕ записаны в hex через точку (см. encode_tag_masks в app/core/keyboards.py):
+    в десятичной записи три 64-битные маски не помещаются в 64 байта callback-данных.
+    """
+
+    masks: str
+    search_in: SearchIn
+
+
+class FilterCallback(CallbackData, prefix="fl"):
+    """
+    Фильтры по цене, крепости, бренду и тегу: fl:<мин>:<макс>:<крепость>:<бренд>:<тег>:<категория>.
+    Ноль означает отсутствие ограничения.
+    """
+
+    price_min: int
+    price_max: int
+    strength: int
+    brand_id: int
+    tag_id: int
+    search_in: SearchIn
+
+
+class UnsubscribeCallback(CallbackData, prefix="us"):
+    """
+    Отмена подписки из списка /subscriptions: us:<ID подписки>.
+    """
+
+    subscription_id: int
+
+
+class QueryTokens:
+    """
+    Поисковые запросы пользователей для кнопок пагинации.
+
+    Текст запроса может быть длиннее 64 байт (ограничение Telegram на callback-данные)
+    и содержать любые символы, поэтому в кнопку записывается короткий токен - хеш запроса,
+    а сам запрос хранится в памяти в кэше с ограниченным размером и временем жизни.
+    Токен одного и того же запроса всегда одинаковый.
+    """
+
+    def __init__(self, maxsize: int = QUERY_TOKEN_CACHE_SIZE, ttl: int = QUERY_TOKEN_TTL):
+        self.queries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def token(query: str) -> str:
+        digest = hashlib.blake2b(query.encode(), digest_size=9).digest()
+        return urlsafe_b64encode(digest).decode()
+
+    def put(self, query: str) -> str:
+        """
+        Запоминает запрос и возвращает его токен (время жизни продлевается).
+        """
+
+        token = self.token(query)
+        self.queries[token] = query
+        return token
+
+    def get(self, token: str) -> str | None:
+        """
+        Запрос по токену или None, если он устарел или неизвестен.
+        """
+
+        return self.queries.get(token)
+
+
+query_tokens = QueryTokens()
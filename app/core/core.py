@@ -2,7 +2,15 @@ from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 import os
 
+from app.core.storage import create_storage
+
 load_dotenv()
 
-bot = Bot(token=os.getenv("TOKEN"))
-dp = Dispatcher()
+session = None
+if os.getenv("BOT_FAKE_API"):
+    # Локальная проверка без Telegram: исходящие вызовы Bot API только запоминаются
+    from app.utils.replay import FakeSession
+    session = FakeSession()
+
+bot = Bot(token=os.getenv("TOKEN"), session=session)
+dp = Dispatcher(storage=create_storage())  # Состояния FSM переживают перезапуск (FSM_STORAGE)
@@ -2,16 +2,27 @@ import logging
 
 from aiogram import F, Router
 from aiogram.types import (Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, 
-                           FSInputFile)
+                           FSInputFile, InlineQuery)
 from aiogram.filters import CommandStart, Command
 
 import app.core.keyboards as kb
 import app.database.requests as rq
-from app.utils.statistics import export_users_to_excel
-from app.utils.logger import log_user_action
+from app.core.callbacks import (BrandCallback, FilterCallback, ListContext, PageCallback, SearchMenuCallback,
+                                SimilarCallback, SubscribeCallback, TagCallback, TagMaskCallback,
+                                UnsubscribeCallback, query_tokens)
+from app.core.inline import INLINE_CACHE_TIME, inline_search
+from app.core.navigation import navigator
+from app.core.workers import request_catalog_update
+from app.utils.statistics import export_users_to_excel, get_activity_summary, get_cached_file_id, remember_file_id
+from app.utils.logger import log_event, log_user_action
+from app.utils.search_stats import normalize_query, search_stats
+from app.utils.notifications import subscription_target, subscription_title, subscriptions
 from app.utils.texts import (WELCOME_TEXT, SEARCH_MENU_TEXT, SEARCH_BY_TAG_TEXT, 
                              NO_VAPES_FOUND_TEXT, WRITE_TO_MANAGER_TEXT, VAPES_CATEGORY_TEXT, 
-                             CANCEL_BUTTON_TEXT, VAPES_PRODUCT_SELECTION_TEXT)
+                             CANCEL_BUTTON_TEXT, VAPES_PRODUCT_SELECTION_TEXT, MULTI_TAG_SEARCH_TEXT,
+                             FILTERS_TEXT, STATISTICS_SUMMARY_TEXT, SEARCH_STATS_TEXT,
+                             NO_SIMILAR_VAPES_TEXT, SUBSCRIPTIONS_TEXT, NO_SUBSCRIPTIONS_TEXT,
+                             SEARCH_EXPIRED_TEXT)
 
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -20,14 +31,14 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 
 router = Router()
 
-@router.message(CommandStart())
-@router.callback_query(F.data == "menu")
+@router.message(CommandStart(), flags={"catalog": False})
+@router.callback_query(F.data == "menu", flags={"catalog": False})
 async def cmd_start(update: Message | CallbackQuery):
     """
     Обработчик команды /start и нажатия кнопки 'Меню'.
     
-    Проверяет, существует ли пользователь в базе данных, добавляет его, если нет,
-    и логирует действия пользователя. Затем отправляет приветственное сообщение с кнопками.
+    Логирует действие пользователя и отправляет приветственное сообщение с кнопками.
+    Учёт новых пользователей ведёт UserTrackingMiddleware.
 
     :param update: Сообщение или запрос с нажатием кнопки.
     :type update: Message | CallbackQuery
@@ -36,25 +47,13 @@ async def cmd_start(update: Message | CallbackQuery):
     
     try:
         user_id = update.from_user.id
-        username = update.from_user.username
-
-        if not await rq.is_exists(user_id):
-            await rq.add_user(user_id, username)
-            
-            action_type = "add_user"
-            action_details = f"User: id={user_id}, username={username} added to database"
-            await log_user_action(user_id, action_type, action_details)
         
         action_type = "command_start"
         action_details = "User started the bot or pressed the menu button"
         await log_user_action(user_id, action_type, action_details)
 
-        await rq.increment_command_count(user_id)
-
-        if isinstance(update, Message):
-            await update.answer(WELCOME_TEXT, reply_markup=kb.main_menu)
-        elif isinstance(update, CallbackQuery):
-            await update.message.answer(WELCOME_TEXT, reply_markup=kb.main_menu)
+        await navigator.show(update, WELCOME_TEXT, reply_markup=kb.main_menu)
+        if isinstance(update, CallbackQuery):
             await update.answer()
 
     except Exception as e:
@@ -64,13 +63,14 @@ async def cmd_start(update: Message | CallbackQuery):
         else:
             await update.answer("Произошла ошибка при обработке вашего запроса.")
 
-@router.message(Command('update_data'))
+@router.message(Command('update_data'), flags={"catalog": False})
 async def update_data(message: Message):
     """
     Обработчик команды /update_data.
 
-    Выполняет обновление данных в базе данных, логирует действие пользователя,
-    и отправляет сообщение об успешном обновлении данных.
+    Выполняет обновление данных в базе данных, логирует действие пользователя
+    и отправляет сообщение о результате. В режиме BOT_WORKERS обновление только
+    запускается в процессе приёма обновлений, поэтому пользователь получает сообщение о запуске.
 
     :param message: Сообщение от пользователя.
     :type message: Message
@@ -78,20 +78,29 @@ async def update_data(message: Message):
     """
     
     try:
-        await rq.populate_database_from_parsing()
-
         user_id = message.from_user.id
         action_type = "update_data"
-        action_details = "Data was successfully updated by the user"
-        await log_user_action(user_id, action_type, action_details)
+
+        # В режиме BOT_WORKERS каталог обновляет процесс приёма обновлений
+        if request_catalog_update():
+            await log_user_action(user_id, action_type, "Data update was requested by the user")
+            await message.answer('Обновление данных запущено, каталог обновится в течение нескольких минут')
+            return
+
+        if not await rq.populate_database_from_parsing():
+            await log_user_action(user_id, action_type, "Data update requested by the user failed")
+            await message.answer("Произошла ошибка при обновлении данных. Пожалуйста, попробуйте снова позже.")
+            return
+
+        await log_user_action(user_id, action_type, "Data was successfully updated by the user")
         await message.answer('Данные успешно добавлены')
 
     except Exception as e:
         logging.error(f"Error in update_data: {str(e)}")
         await message.answer("Произошла ошибка при обновлении данных. Пожалуйста, попробуйте снова позже.")
   
-@router.message(Command('manager'))    
-@router.callback_query(F.data == 'write to the manager')
+@router.message(Command('manager'), flags={"catalog": False})    
+@router.callback_query(F.data == 'write to the manager', flags={"catalog": False})
 async def write_to_the_manager(update: CallbackQuery | Message):
     """
     Обработчик команды /manager и кнопки 'write to the manager'.
@@ -109,17 +118,14 @@ async def write_to_the_manager(update: CallbackQuery | Message):
         ])
 
         user_id = update.from_user.id
-        await rq.increment_command_count(user_id)
 
         action_type = "write_to_manager"
         action_details = f"User with id={user_id} initiated 'write to the manager'"
         await log_user_action(user_id, action_type, action_details)
 
-        if isinstance(update, Message):
-            await update.answer(WRITE_TO_MANAGER_TEXT, reply_markup=keyboard)
-        elif isinstance(update, CallbackQuery):
+        if isinstance(update, CallbackQuery):
             await update.answer('')  # Пустой ответ на callback-запрос
-            await update.message.answer(WRITE_TO_MANAGER_TEXT, reply_markup=keyboard)
+        await navigator.show(update, WRITE_TO_MANAGER_TEXT, reply_markup=keyboard)
 
     except Exception as e:
         logging.error(f"Error in write_to_the_manager: {str(e)}")
@@ -128,8 +134,8 @@ async def write_to_the_manager(update: CallbackQuery | Message):
 
 
 
-@router.callback_query(F.data.startswith("page_"))
-async def handle_pagination(callback: CallbackQuery):
+@router.callback_query(PageCallback.filter())
+async def handle_pagination(callback: CallbackQuery, callback_data: PageCallback):
     """
     Обработчик переходов по страницам пагинации.
 
@@ -137,60 +143,56 @@ async def handle_pagination(callback: CallbackQuery):
     в зависимости от выбранной страницы.
 
     :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки пагинации.
     :type callback: CallbackQuery
+    :type callback_data: PageCallback
     :return: None
     """
     
     try:
         user_id = callback.from_user.id
 
-        action_type = "pagination"
-        action_details = f"User navigated to page: {callback.data}"
-        await log_user_action(user_id, action_type, action_details)
-
-        await rq.increment_command_count(user_id)
-
-        search_in = None
-        if 'statistics' in callback.data:
-            search_in = 'statistics'
-        elif 'on_hand' in callback.data:
-            search_in = 'on_hand'
-        elif 'to_order' in callback.data:
-            search_in = 'to_order'
-
-        if not search_in:
-            await callback.answer("Ошибка: неизвестный контекст для поиска!")
-            return
-
-        data_parts = callback.data.split('_')
-        if len(data_parts) < 4:
-            await callback.answer("Ошибка: некорректные данные для пагинации!")
-            return
-
-        page = int(data_parts[1])
-        context_type = data_parts[2]
-        context_value = data_parts[3]
+        page = callback_data.page
+        context_type = callback_data.context.name
+        context_value = callback_data.value
+        search_in = callback_data.search_in.name
+        sort = callback_data.sort if callback_data.sort in kb.SORT_BUTTONS else None
+        context_id = int(context_value) if context_value.isdigit() else context_value
 
         if context_type == "brand":
-            data = await rq.get_vapes_by_brand(int(context_value), search_in)
-            callback_prefix = f"brand_{context_value}"
+            data = await rq.get_vapes_by_brand(int(context_value), search_in, sort)
         elif context_type == "tag":
-            data = await rq.get_vapes_by_tag(int(context_value), search_in)
-            callback_prefix = f"tag_{context_value}"
+            data = await rq.get_vapes_by_tag(int(context_value), search_in, sort)
         elif context_type == 'flavor':
-            data = await rq.get_vapes_by_flavor(context_value, search_in)
-            callback_prefix = f"flavor_{context_value}"
-        elif context_type == 'statistics':
-            data = await rq.get_users()
-            callback_prefix = 'statistics'
+            flavor = query_tokens.get(context_value)
+            if flavor is None:
+                await callback.answer(SEARCH_EXPIRED_TEXT, show_alert=True)
+                return
+            # Найденные в наличии, затем те, которых нет (на них можно только подписаться)
+            data = (await rq.get_vapes_by_flavor(flavor, search_in, sort)
+                    + await rq.get_sold_out_vapes_by_flavor(flavor, search_in, sort))
+            context_id = normalize_query(flavor)
+        elif context_type == 'flt':
+            filters = kb.decode_filters(context_value)
+            data = await rq.get_vapes_by_filters(search_in, sort, **kb.filters_to_kwargs(*filters))
+        elif context_type == 'sim':
+            vape_id = await rq.get_vape_id_by_token(context_value)
+            data = await rq.get_similar_vapes(vape_id, search_in, sort) if vape_id is not None else []
+            context_id = vape_id
         else:
-            await callback.answer("Ошибка: неизвестный контекст для пагинации!")
-            return
+            all_mask, any_mask, none_mask = kb.decode_tag_masks(context_value)
+            data = await rq.get_vapes_by_tags(search_in, all_mask, any_mask, none_mask, sort)
 
         page_size = 5
-        text, keyboard = await kb.generate_pagination(data, page, page_size, callback_prefix, search_in)
+        await log_event(user_id, "pagination", data=callback.data, page=page, context=context_type,
+                        context_id=context_id, search_in=search_in, sort=sort,
+                        vape_ids=[vape.id for vape in data[(page - 1) * page_size:page * page_size]])
+
+        text, keyboard = await kb.generate_pagination(data, page, page_size, context_type, context_value,
+                                                      search_in, sort=sort)
 
-        await callback.message.edit_text(text=text, reply_markup=keyboard)
+        await navigator.show(callback, text, reply_markup=keyboard)
+        await callback.answer()
 
     except Exception as e:
         logging.error(f"Error in handle_pagination: {str(e)}")
@@ -217,14 +219,10 @@ async def all_brands(update: Message | CallbackQuery):
         action_details = "User opened the vapes menu"
         await log_user_action(user_id, action_type, action_details)
 
-        await rq.increment_command_count(user_id)
-
         keyboard = kb.product_selection
 
-        if isinstance(update, Message):
-            await update.answer(VAPES_PRODUCT_SELECTION_TEXT, reply_markup=keyboard)
-        elif isinstance(update, CallbackQuery):
-            await update.message.answer(VAPES_PRODUCT_SELECTION_TEXT, reply_markup=keyboard)
+        await navigator.show(update, VAPES_PRODUCT_SELECTION_TEXT, reply_markup=keyboard)
+        if isinstance(update, CallbackQuery):
             await update.answer()
 
     except Exception as e:
@@ -251,14 +249,12 @@ async def search_to_order(callback: CallbackQuery):
         action_details = f"User searched by category: {callback.data}"
         await log_user_action(user_id, action_type, action_details)
 
-        await rq.increment_command_count(user_id)
-
-        product_selection = callback.data[1:]
+        product_selection = callback.data.removeprefix('vapes_')
 
         keyboard = await kb.get_search_menu_keyboard(product_selection)
 
         await callback.answer('')  # Ожидание ответа
-        await callback.message.answer(SEARCH_MENU_TEXT, reply_markup=keyboard)
+        await navigator.show(callback, SEARCH_MENU_TEXT, reply_markup=keyboard)
 
     except Exception as e:
         logging.error(f"Error in search_to_order handler: {str(e)}")
@@ -268,14 +264,16 @@ async def search_to_order(callback: CallbackQuery):
 
     
     
-@router.callback_query(F.data.startswith('search_by_tag_'))
-async def search(callback: CallbackQuery):
+@router.callback_query(SearchMenuCallback.filter(F.kind == ListContext.tag))
+async def search_by_tag(callback: CallbackQuery, callback_data: SearchMenuCallback):
     """
     Обработчик поиска жидкостей по тегу. Когда пользователь инициирует поиск по тегу, бот отправляет 
     список всех тегов с доступными продуктами в зависимости от категории (в наличии или под заказ).
     
     :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки.
     :type callback: CallbackQuery
+    :type callback_data: SearchMenuCallback
     :return: None
     """
     
@@ -286,71 +284,190 @@ async def search(callback: CallbackQuery):
         action_details = f"User initiated search by tag: {callback.data}"
         await log_user_action(user_id, action_type, action_details)
 
-        await rq.increment_command_count(user_id)
-
-        search_in = 'on_hand' if 'on_hand' in callback.data else 'to_order'
+        search_in = callback_data.search_in.name
 
         tags = await rq.get_all_tags_with_vapes(search_in)
 
         keyboard = await kb.get_tags_keyboard(tags, search_in)
 
         await callback.answer('')
-        await callback.message.answer(SEARCH_BY_TAG_TEXT, reply_markup=keyboard)
+        await navigator.show(callback, SEARCH_BY_TAG_TEXT, reply_markup=keyboard)
 
     except Exception as e:
         logging.error(f"Error in search handler: {str(e)}")
 
         await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
 
-@router.callback_query(F.data.startswith('tag_'))
-async def all_vapes_by_tag(callback: CallbackQuery):
+@router.callback_query(TagCallback.filter())
+async def all_vapes_by_tag(callback: CallbackQuery, callback_data: TagCallback):
     """
     Обработчик просмотра всех жидкостей по выбранному тегу. Отправляет пользователю список продуктов, 
     относящихся к выбранному тегу, с пагинацией.
     
     :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки.
     :type callback: CallbackQuery
+    :type callback_data: TagCallback
     :return: None
     """
     
     try:
         user_id = callback.from_user.id
 
-        action_type = "view_vapes_by_tag"
-        action_details = f"User viewed vapes by tag: {callback.data}"
-        await log_user_action(user_id, action_type, action_details)
+        search_in = callback_data.search_in.name
 
-        await rq.increment_command_count(user_id)
+        tag_id = callback_data.tag_id
 
-        search_in = 'on_hand' if 'on_hand' in callback.data else 'to_order'
+        vapes = await rq.get_vapes_by_tag(tag_id, search_in)
 
-        tag_id = int(callback.data.split('_')[1])
+        page = 1
+        page_size = 5
+        await log_event(user_id, "view_vapes_by_tag", data=callback.data, tag_id=tag_id,
+                        search_in=search_in, vape_ids=[vape.id for vape in vapes[:page_size]])
+        text, keyboard = await kb.generate_pagination(vapes, page, page_size, "tag", tag_id, search_in)
 
-        vapes = await rq.get_vapes_by_tag(tag_id, search_in)
+        await callback.answer('')
+        await navigator.show(callback, text, reply_markup=keyboard)
+
+    except Exception as e:
+        logging.error(f"Error in all_vapes_by_tag handler: {str(e)}")
+
+        await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
+
+@router.callback_query(SimilarCallback.filter())
+async def similar_vapes(callback: CallbackQuery, callback_data: SimilarCallback):
+    """
+    Обработчик кнопки "Похожие". Отправляет пользователю список вейпов, похожих
+    на выбранный по тегам и бренду, в той же категории наличия.
+
+    :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки.
+    :type callback: CallbackQuery
+    :type callback_data: SimilarCallback
+    :return: None
+    """
+    
+    try:
+        user_id = callback.from_user.id
+
+        search_in = callback_data.search_in.name
+
+        vape_id = await rq.get_vape_id_by_token(callback_data.vape)
+        if vape_id is None:
+            await callback.answer("Товар не найден в каталоге.", show_alert=True)
+            return
+
+        vapes = await rq.get_similar_vapes(vape_id, search_in)
 
         page = 1
         page_size = 5
-        callback_prefix = f"tag_{tag_id}"
+        await log_event(user_id, "view_similar_vapes", data=callback.data, vape_id=vape_id,
+                        search_in=search_in, vape_ids=[vape.id for vape in vapes[:page_size]])
 
-        text, keyboard = await kb.generate_pagination(vapes, page, page_size, callback_prefix, search_in)
+        if not vapes:
+            await callback.answer(NO_SIMILAR_VAPES_TEXT, show_alert=True)
+            return
+
+        text, keyboard = await kb.generate_pagination(vapes, page, page_size, "sim", callback_data.vape, search_in)
 
         await callback.answer('')
-        await callback.message.answer(text=text, reply_markup=keyboard)
+        await navigator.show(callback, text, reply_markup=keyboard)
 
     except Exception as e:
-        logging.error(f"Error in all_vapes_by_tag handler: {str(e)}")
+        logging.error(f"Error in similar_vapes handler: {str(e)}")
+
+        await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
+
+@router.callback_query(TagMaskCallback.filter())
+async def multi_tag_search(callback: CallbackQuery, callback_data: TagMaskCallback):
+    """
+    Обработчик мультивыбора тегов. Показывает клавиатуру тегов с текущим выбором
+    (И / ИЛИ / НЕ) и количеством подходящих жидкостей.
+    
+    :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки с масками выбранных тегов.
+    :type callback: CallbackQuery
+    :type callback_data: TagMaskCallback
+    :return: None
+    """
+    
+    try:
+        user_id = callback.from_user.id
+
+        action_type = "search_multi_tag"
+        action_details = f"User changed multi-tag selection: {callback.data}"
+        await log_user_action(user_id, action_type, action_details)
+
+        search_in = callback_data.search_in.name
+
+        all_mask, any_mask, none_mask = kb.decode_tag_masks(callback_data.masks)
+
+        tags = await rq.get_tags_in_stock(search_in)
+        found_count = await rq.count_vapes_by_tags(search_in, all_mask, any_mask, none_mask)
+
+        keyboard = await kb.get_multi_tags_keyboard(tags, search_in, all_mask, any_mask, none_mask, found_count)
+
+        await callback.answer('')
+        await navigator.show(callback, MULTI_TAG_SEARCH_TEXT, reply_markup=keyboard)
+
+    except Exception as e:
+        logging.error(f"Error in multi_tag_search handler: {str(e)}")
+
+        await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
+
+@router.callback_query(FilterCallback.filter())
+async def filter_search(callback: CallbackQuery, callback_data: FilterCallback):
+    """
+    Обработчик фильтров по цене, крепости, бренду и тегу. Показывает текущие фильтры,
+    количество подходящих жидкостей и кнопки для их изменения.
+    
+    :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки, ноль означает отсутствие ограничения.
+    :type callback: CallbackQuery
+    :type callback_data: FilterCallback
+    :return: None
+    """
+    
+    try:
+        user_id = callback.from_user.id
+
+        action_type = "search_filters"
+        action_details = f"User changed filters: {callback.data}"
+        await log_user_action(user_id, action_type, action_details)
+
+        search_in = callback_data.search_in.name
+
+        filters = (callback_data.price_min, callback_data.price_max, callback_data.strength,
+                   callback_data.brand_id, callback_data.tag_id)
+        brand_id, tag_id = callback_data.brand_id, callback_data.tag_id
+
+        found_count = await rq.count_vapes_by_filters(search_in, **kb.filters_to_kwargs(*filters))
+        price_steps = await rq.get_price_steps(search_in)
+        brand_name = await rq.get_brand_name(brand_id) if brand_id else None
+        tag_name = await rq.get_tag_name(tag_id) if tag_id else None
+
+        keyboard = await kb.get_filters_keyboard(search_in, filters, price_steps, found_count,
+                                                 brand_name=brand_name, tag_name=tag_name)
+
+        await callback.answer('')
+        await navigator.show(callback, FILTERS_TEXT, reply_markup=keyboard)
+
+    except Exception as e:
+        logging.error(f"Error in filter_search handler: {str(e)}")
 
         await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
 
 
-@router.callback_query(F.data.startswith('search_by_brand_'))
-async def search(callback: CallbackQuery):
+@router.callback_query(SearchMenuCallback.filter(F.kind == ListContext.brand))
+async def search_by_brand(callback: CallbackQuery, callback_data: SearchMenuCallback):
     """
     Обработчик поиска вейпов по бренду. Когда пользователь инициирует поиск по бренду, бот отправляет 
     список всех брендов с доступными продуктами в зависимости от категории (в наличии или под заказ).
     
     :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки.
     :type callback: CallbackQuery
+    :type callback_data: SearchMenuCallback
     :return: None
     """
     
@@ -361,16 +478,14 @@ async def search(callback: CallbackQuery):
         action_details = f"User initiated search by brand: {callback.data}"
         await log_user_action(user_id, action_type, action_details)
 
-        await rq.increment_command_count(user_id)
-
-        search_in = 'on_hand' if 'on_hand' in callback.data else 'to_order'
+        search_in = callback_data.search_in.name
 
         brands = await rq.get_brands(search_in)
 
         keyboard = await kb.get_brands_keyboard(brands, search_in)
 
         await callback.answer('')
-        await callback.message.answer(VAPES_CATEGORY_TEXT, reply_markup=keyboard)
+        await navigator.show(callback, VAPES_CATEGORY_TEXT, reply_markup=keyboard)
 
     except Exception as e:
         logging.error(f"Error in search by brand handler: {str(e)}")
@@ -378,40 +493,36 @@ async def search(callback: CallbackQuery):
         await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
 
 
-@router.callback_query(F.data.startswith('brand_'))
-async def all_vapes_by_brand(callback: CallbackQuery):
+@router.callback_query(BrandCallback.filter())
+async def all_vapes_by_brand(callback: CallbackQuery, callback_data: BrandCallback):
     """
     Обработчик просмотра всех жидкостей по выбранному бренду. Отправляет пользователю список продуктов, 
     относящихся к выбранному бренду, с пагинацией.
     
     :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки.
     :type callback: CallbackQuery
+    :type callback_data: BrandCallback
     :return: None
     """
     
     try:
         user_id = callback.from_user.id
 
-        action_type = "view_vapes_by_brand"
-        action_details = f"User viewed vapes by brand: {callback.data}"
-        await log_user_action(user_id, action_type, action_details)
-
-        await rq.increment_command_count(user_id)
-
-        search_in = 'on_hand' if 'on_hand' in callback.data else 'to_order'
+        search_in = callback_data.search_in.name
 
-        brand_id = int(callback.data.split('_')[1])
+        brand_id = callback_data.brand_id
 
         vapes = await rq.get_vapes_by_brand(brand_id, search_in)
 
         page = 1
         page_size = 5
-        callback_prefix = f"brand_{brand_id}"
-
-        text, keyboard = await kb.generate_pagination(vapes, page, page_size, callback_prefix, search_in)
+        await log_event(user_id, "view_vapes_by_brand", data=callback.data, brand_id=brand_id,
+                        search_in=search_in, vape_ids=[vape.id for vape in vapes[:page_size]])
+        text, keyboard = await kb.generate_pagination(vapes, page, page_size, "brand", brand_id, search_in)
 
         await callback.answer('')
-        await callback.message.answer(text=text, reply_markup=keyboard)
+        await navigator.show(callback, text, reply_markup=keyboard)
 
     except Exception as e:
         logging.error(f"Error in all_vapes_by_brand handler: {str(e)}")
@@ -422,15 +533,17 @@ async def all_vapes_by_brand(callback: CallbackQuery):
 class SearchState(StatesGroup):
     waiting_for_flavor = State()
 
-@router.callback_query(F.data.startswith('search_by_flavor_'))
-async def start_flavor_search(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(SearchMenuCallback.filter(F.kind == ListContext.flavor))
+async def start_flavor_search(callback: CallbackQuery, callback_data: SearchMenuCallback, state: FSMContext):
     """
     Обработчик начала поиска по вкусу. Запрашивает ввод вкуса от пользователя
     и сохраняет информацию о категории поиска (в наличии или под заказ).
 
     :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки.
     :param state: Состояние машины состояний для хранения данных.
     :type callback: CallbackQuery
+    :type callback_data: SearchMenuCallback
     :type state: FSMContext
     :return: None
     """
@@ -441,14 +554,13 @@ async def start_flavor_search(callback: CallbackQuery, state: FSMContext):
         action_details = f"User started searching for flavor: {callback.data}"
 
         await log_user_action(user_id, action_type, action_details)
-        await rq.increment_command_count(user_id)
 
-        search_in = 'on_hand' if 'on_hand' in callback.data else 'to_order'
+        search_in = callback_data.search_in.name
 
         await state.update_data(search_in=search_in)
         await state.set_state(SearchState.waiting_for_flavor)
 
-        await callback.message.answer("Введите название вкуса для поиска:")
+        await navigator.show(callback, "Введите название вкуса для поиска:")
         await callback.answer('')
 
     except Exception as e:
@@ -460,7 +572,8 @@ async def start_flavor_search(callback: CallbackQuery, state: FSMContext):
 async def process_flavor_search(message: Message, state: FSMContext):
     """
     Обработчик, который выполняет поиск по вкусу. Показывает результаты поиска 
-    и предоставляет пагинацию, если результаты есть.
+    и предоставляет пагинацию, если результаты есть. Вейпы со вкусом, которых нет в наличии,
+    показываются в конце списка с кнопкой подписки на их появление.
 
     :param message: Сообщение от пользователя с названием вкуса.
     :param state: Состояние машины состояний для получения данных.
@@ -471,11 +584,6 @@ async def process_flavor_search(message: Message, state: FSMContext):
     
     try:
         user_id = message.from_user.id
-        action_type = "search_flavor_result"
-        action_details = f"User searched for flavor: {message.text}"
-
-        await log_user_action(user_id, action_type, action_details)
-        await rq.increment_command_count(user_id)
 
         flavor = message.text.strip() 
         data = await state.get_data()
@@ -483,17 +591,21 @@ async def process_flavor_search(message: Message, state: FSMContext):
 
         vapes = await rq.get_vapes_by_flavor(flavor, search_in)
 
+        await log_event(user_id, "search_flavor_result", query=normalize_query(flavor),
+                        search_in=search_in, results=len(vapes))
+
         page = 1
         page_size = 5
-        callback_prefix = f"flavor_{flavor}"
 
-        if not vapes:
+        sold_out = await rq.get_sold_out_vapes_by_flavor(flavor, search_in)
+        if not vapes and not sold_out:
             await message.answer(NO_VAPES_FOUND_TEXT)
             return
 
-        text, keyboard = await kb.generate_pagination(vapes, page, page_size, callback_prefix, search_in)
+        text, keyboard = await kb.generate_pagination(vapes + sold_out, page, page_size, "flavor",
+                                                      query_tokens.put(flavor), search_in)
 
-        await message.answer(text, reply_markup=keyboard)
+        await navigator.show(message, text, reply_markup=keyboard)
         await state.clear()
 
     except Exception as e:
@@ -502,42 +614,69 @@ async def process_flavor_search(message: Message, state: FSMContext):
         await message.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
 
 
+@router.inline_query()
+async def inline_flavor_search(inline_query: InlineQuery):
+    """
+    Inline-поиск товаров в наличии: @бот <вкус или бренд> в любом чате.
+
+    Результаты берутся из кэша inline-поиска (app/core/inline.py), листание - через offset.
+
+    :param inline_query: Inline-запрос от пользователя.
+    :type inline_query: InlineQuery
+    :return: None
+    """
+    
+    try:
+        results, next_offset = inline_search.page(inline_query.query, inline_query.offset)
+        # Пока каталог загружается, пустой ответ не должен кэшироваться в Telegram
+        cache_time = INLINE_CACHE_TIME if inline_search.ready else 0
+        await inline_query.answer(results, cache_time=cache_time, is_personal=False, next_offset=next_offset)
+
+    except Exception as e:
+        logging.error(f"Error in inline_flavor_search handler: {str(e)}")
+
+        await inline_query.answer([], cache_time=0)
 
-@router.message(Command('statistics'))
+
+
+@router.message(Command('statistics'), flags={"catalog": False})
 async def show_statistics(message: Message):
     """
-    Отображает статистику пользователей с пагинацией.
+    Отображает сводку активности пользователей: DAU / WAU / MAU, количество действий
+    за день, неделю и месяц, новых пользователей за неделю.
     """
         
     try:
-        page = 1
-        page_size = 5
-        search_in = "statistics"
-        callback_prefix = f"statistics"
-        
-        users = await rq.get_users()
-
-        text, keyboard = await kb.generate_pagination(users, page, page_size, callback_prefix, search_in)
+        summary = await get_activity_summary()
+        if summary is None:
+            await message.answer("Произошла ошибка при загрузке статистики.")
+            return
 
-        await message.answer(text=text, reply_markup=keyboard)
+        await message.answer(STATISTICS_SUMMARY_TEXT.format(**summary))
 
     except Exception as e:
         logging.error(f"Error in show_statistics handler: {str(e)}")
         
         await message.answer("Произошла ошибка при загрузке статистики.")
 
-@router.message(Command('create_file_statistics'))
+@router.message(Command('create_file_statistics'), flags={"catalog": False})
 async def create_statistics_file(message: Message):
     """
     Экспортирует данные статистики в файл и отправляет его пользователю.
+
+    Если файл не изменился с прошлой отправки, повторно используется его file_id
+    в Telegram, и файл не загружается заново.
     """
     
     try:
         file_name = await export_users_to_excel()
         
         if file_name:
-            document = FSInputFile(file_name)
-            await message.answer_document(document, caption="📊 Статистика посещений пользователей за неделю")
+            file_id = get_cached_file_id(file_name)
+            document = file_id or FSInputFile(file_name)
+            sent = await message.answer_document(document, caption="📊 Статистика посещений пользователей за неделю")
+            if not file_id and sent.document:
+                remember_file_id(file_name, sent.document.file_id)
         else:
             await message.answer("Нет данных для экспорта.")
     
@@ -545,3 +684,114 @@ async def create_statistics_file(message: Message):
         logging.error(f"Error in create_statistics_file handler: {str(e)}")
         
         await message.answer("Произошла ошибка при экспорте данных.")
+
+@router.message(Command('search_stats'), flags={"catalog": False})
+async def show_search_stats(message: Message):
+    """
+    Отображает самые частые поисковые запросы по вкусу и самые частые запросы
+    без результатов. Данные берутся из счётчиков в памяти, без обращения к логам.
+    """
+    
+    try:
+        def format_top(top):
+            if not top:
+                return "—"
+            return "\n".join(f"{i}. {query} — {count}" for i, (query, count, _) in enumerate(top, start=1))
+
+        await message.answer(SEARCH_STATS_TEXT.format(
+            top_queries=format_top(search_stats.top_queries()),
+            top_zero_results=format_top(search_stats.top_zero_results()),
+        ))
+
+    except Exception as e:
+        logging.error(f"Error in show_search_stats handler: {str(e)}")
+        
+        await message.answer("Произошла ошибка при загрузке статистики поиска.")
+
+@router.callback_query(SubscribeCallback.filter())
+async def toggle_subscription(callback: CallbackQuery, callback_data: SubscribeCallback):
+    """
+    Обработчик кнопки подписки под списком жидкостей: подписывает пользователя
+    на уведомления о появлении в наличии и изменении цены вейпа, бренда или тега
+    либо отменяет подписку, если она уже есть.
+
+    :param callback: Callback-запрос от пользователя.
+    :param callback_data: Разобранные данные кнопки подписки.
+    :type callback: CallbackQuery
+    :type callback_data: SubscribeCallback
+    :return: None
+    """
+    
+    try:
+        user_id = callback.from_user.id
+
+        kind = callback_data.kind
+        target = subscription_target(kind, callback_data.target)
+        if target is None:
+            await callback.answer("Товар не найден в каталоге.", show_alert=True)
+            return
+
+        subscribed = await subscriptions.toggle(user_id, kind, target)
+        await log_event(user_id, "subscription", kind=kind, target=target, subscribed=subscribed)
+
+        title = subscription_title(kind, target)
+        if subscribed:
+            await callback.answer(f"🔔 Вы подписаны: {title}. Сообщим о появлении в наличии и изменении цены.",
+                                  show_alert=True)
+        else:
+            await callback.answer(f"🔕 Подписка отменена: {title}", show_alert=True)
+
+    except Exception as e:
+        logging.error(f"Error in toggle_subscription handler: {str(e)}")
+
+        await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
+
+async def _subscriptions_view(user_id: int):
+    """
+    Текст и клавиатура списка подписок пользователя.
+    """
+
+    user_subscriptions = await subscriptions.get_user_subscriptions(user_id)
+    if not user_subscriptions:
+        return NO_SUBSCRIPTIONS_TEXT, kb.get_subscriptions_keyboard([])
+    keyboard = kb.get_subscriptions_keyboard(
+        [(subscription_id, subscription_title(kind, target)) for subscription_id, kind, target in user_subscriptions]
+    )
+    return SUBSCRIPTIONS_TEXT, keyboard
+
+@router.message(Command('subscriptions'))
+async def show_subscriptions(message: Message):
+    """
+    Показывает подписки пользователя с кнопками отмены.
+    """
+    
+    try:
+        text, keyboard = await _subscriptions_view(message.from_user.id)
+        await navigator.show(message, text, reply_markup=keyboard)
+
+    except Exception as e:
+        logging.error(f"Error in show_subscriptions handler: {str(e)}")
+        
+        await message.answer("Произошла ошибка при загрузке подписок.")
+
+@router.callback_query(UnsubscribeCallback.filter())
+async def remove_subscription(callback: CallbackQuery, callback_data: UnsubscribeCallback):
+    """
+    Отменяет подписку из списка /subscriptions и обновляет список.
+    """
+    
+    try:
+        user_id = callback.from_user.id
+        subscription_id = callback_data.subscription_id
+
+        await subscriptions.remove(user_id, subscription_id)
+        await log_event(user_id, "unsubscription", subscription_id=subscription_id)
+
+        text, keyboard = await _subscriptions_view(user_id)
+        await navigator.show(callback, text, reply_markup=keyboard)
+        await callback.answer("🔕 Подписка отменена")
+
+    except Exception as e:
+        logging.error(f"Error in remove_subscription handler: {str(e)}")
+
+        await callback.answer("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова.")
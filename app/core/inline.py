@@ -0,0 +1,92 @@
+import logging
+import os
+
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+from cachetools import TTLCache
+
+from app.database.catalog import get_catalog
+from app.database.rows import VapeRow
+from app.utils.search_stats import normalize_query
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+INLINE_PAGE_SIZE = int(os.getenv('INLINE_PAGE_SIZE', 20))  # Telegram принимает до 50 результатов
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))  # сколько секунд Telegram хранит ответ у себя
+INLINE_CACHE_TTL = int(os.getenv('INLINE_CACHE_TTL', 300))
+INLINE_CACHE_SIZE = int(os.getenv('INLINE_CACHE_SIZE', 1000))
+
+
+class InlineSearch:
+    """
+    Inline-поиск товаров в наличии (@bot манго).
+
+    Поиск идёт по префиксному индексу снимка каталога, без запросов к базе. Найденные списки
+    хранятся в кэше с ограниченным временем жизни по ключу (нормализованный запрос, версия
+    снимка), поэтому повторные запросы при наборе текста и листание (offset) не повторяют поиск,
+    а после обновления каталога старые результаты не используются.
+    """
+
+    def __init__(self, page_size: int = INLINE_PAGE_SIZE, cache_size: int = INLINE_CACHE_SIZE,
+                 ttl: int = INLINE_CACHE_TTL):
+        self.page_size = page_size
+        self.cache: TTLCache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.metrics = {"queries": 0, "cache_hits": 0}
+
+    @property
+    def ready(self) -> bool:
+        return get_catalog() is not None
+
+    def search(self, query: str) -> list[VapeRow] | None:
+        """
+        Товары в наличии по запросу, популярные сначала. None, если каталог ещё не загружен.
+        """
+
+        catalog = get_catalog()
+        if catalog is None:
+            return None
+
+        self.metrics["queries"] += 1
+        key = (normalize_query(query), catalog.version)
+        vapes = self.cache.get(key)
+        if vapes is None:
+            vapes = self.cache[key] = catalog.search_by_prefix(key[0], 'on_hand')
+        else:
+            self.metrics["cache_hits"] += 1
+        return vapes
+
+    def page(self, query: str, offset: str) -> tuple[list[InlineQueryResultArticle], str]:
+        """
+        Страница результатов и next_offset для answerInlineQuery.
+
+        :param query: Текст inline-запроса.
+        :param offset: Смещение из предыдущего ответа (пустая строка - первая страница).
+        :return: Кортеж (результаты, next_offset); пустой next_offset - результатов больше нет.
+        """
+
+        vapes = self.search(query) or []
+        start = int(offset) if offset.isdigit() else 0
+        end = start + self.page_size
+        catalog = get_catalog()
+        results = [self.article(vape, catalog.brand_names.get(vape.brand_id, '')) for vape in vapes[start:end]]
+        return results, str(end) if end < len(vapes) else ""
+
+    @staticmethod
+    def article(vape: VapeRow, brand_name: str) -> InlineQueryResultArticle:
+        availability = []
+        if vape.availability_20 in (1, -1):
+            availability.append("20 MG")
+        if vape.availability_45_50_60 in (1, -1):
+            availability.append("45, 50, 60 MG")
+        description = f"💰 {vape.price} руб. · 📏 {', '.join(availability)}"
+
+        return InlineQueryResultArticle(
+            id=str(vape.id),
+            title=f"{vape.name} ({brand_name})",
+            description=description,
+            input_message_content=InputTextMessageContent(
+                message_text=f"💨 {vape.name} ({brand_name})\n{description}"
+            ),
+        )
+
+
+inline_search = InlineSearch()
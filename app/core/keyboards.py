@@ -2,6 +2,10 @@ import random
 import logging
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import (InlineKeyboardMarkup, InlineKeyboardButton)
+from app.core.callbacks import (BrandCallback, FilterCallback, ListContext, PageCallback, SearchIn,
+                                SearchMenuCallback, SimilarCallback, SubscribeCallback, TagCallback,
+                                TagMaskCallback, UnsubscribeCallback)
+from app.database.catalog import get_catalog
 from app.utils.texts import EMOJIS
 
 
@@ -10,6 +14,19 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 BRANDS_PER_PAGE = 3
 TAGS_PER_PAGE = 3
 
+# Варианты фильтра по крепости (коды совпадают с STRENGTH_* в app/database/catalog.py)
+STRENGTH_OPTIONS = {0: "Любая", 1: "20 MG", 2: "45, 50, 60 MG"}
+
+# Кнопки сортировки списков (коды совпадают с SORT_ORDERS в app/database/catalog.py)
+SORT_BUTTONS = {"a": "💰⬆️", "d": "💰⬇️", "n": "🔤", "r": "🆕", "p": "🔥"}
+
+# Вид подписки для списка: бренд, тег или вейп, для которого показаны похожие (его токен в значении списка).
+# В результатах поиска по вкусу подписка оформляется на каждый товар отдельно (кнопки 🔔 с номерами).
+SUBSCRIPTION_KINDS = {"brand": "brand", "tag": "tag", "sim": "vape"}
+
+# Состояния тега в мультивыборе: не выбран -> И -> ИЛИ -> НЕ -> не выбран
+TAG_MARKS = {"all": "✅", "any": "➕", "none": "🚫"}
+
 main_menu = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text='💨 Жидкости', callback_data='vapes')],
     [InlineKeyboardButton(text='✉️ Написать менеджеру', callback_data='write to the manager')],
@@ -32,10 +49,15 @@ async def get_search_menu_keyboard(product_selection: str):
     """
     
     try:
+        search_in = SearchIn[product_selection]
         return InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text='🔍 Поиск по тегу', callback_data=f'search_by_tag_{product_selection}')],
-            [InlineKeyboardButton(text='🔍 Поиск по названию', callback_data=f'search_by_flavor_{product_selection}')],
-            [InlineKeyboardButton(text='🔍 Поиск по бренду', callback_data=f'search_by_brand_{product_selection}')],
+            [InlineKeyboardButton(text='🔍 Поиск по тегу',
+                                  callback_data=SearchMenuCallback(kind=ListContext.tag, search_in=search_in).pack())],
+            [InlineKeyboardButton(text='🔍 Поиск по названию',
+                                  callback_data=SearchMenuCallback(kind=ListContext.flavor, search_in=search_in).pack())],
+            [InlineKeyboardButton(text='🔍 Поиск по бренду',
+                                  callback_data=SearchMenuCallback(kind=ListContext.brand, search_in=search_in).pack())],
+            [InlineKeyboardButton(text='⚙️ Фильтры', callback_data=filter_callback(product_selection).pack())],
             [InlineKeyboardButton(text='🏠 Главное меню', callback_data='menu')]
         ])
     except Exception as e:
@@ -56,7 +78,7 @@ async def get_brands_keyboard(brands, search_in):
 
         for brand in brands:
             emoji = random.choice(EMOJIS["brand"])
-            builder.button(text=f'{emoji} {brand.name}', callback_data=f"brand_{brand.id}_{search_in}")
+            builder.button(text=f'{emoji} {brand.name}', callback_data=BrandCallback(brand_id=brand.id, search_in=SearchIn[search_in]))
 
         builder.adjust(BRANDS_PER_PAGE)
 
@@ -82,9 +104,11 @@ async def get_tags_keyboard(tags, search_in):
         builder = InlineKeyboardBuilder()
 
         for tag in tags:
-            builder.button(text=f'{tag.name}', callback_data=f"tag_{tag.id}_{search_in}")
+            builder.button(text=f'{tag.name}', callback_data=TagCallback(tag_id=tag.id, search_in=SearchIn[search_in]))
 
         builder.adjust(TAGS_PER_PAGE)
+        builder.row(InlineKeyboardButton(text="🧩 Несколько тегов",
+                                         callback_data=tag_mask_callback(search_in).pack()))
         builder.row(InlineKeyboardButton(text=EMOJIS["search_by_tag"] + "Назад к поиску", callback_data=f"vapes_{search_in}"))
         builder.row(InlineKeyboardButton(text=EMOJIS["home"] + " Главное меню", callback_data="menu"))
 
@@ -94,35 +118,232 @@ async def get_tags_keyboard(tags, search_in):
         logging.error(f"Ошибка при создании клавиатуры тегов: {e}")
         return InlineKeyboardMarkup(inline_keyboard=[])
 
-async def generate_pagination(data, page, page_size, callback_prefix, search_in):
+def encode_tag_masks(all_mask: int, any_mask: int, none_mask: int) -> str:
+    """
+    Компактная запись набора выбранных тегов для callback-данных: три маски в hex через точку.
+
+    :return: Строка вида 'a.o.n', например '3.0.10'.
+    """
+    
+    return f"{all_mask:x}.{any_mask:x}.{none_mask:x}"
+
+def decode_tag_masks(value: str) -> tuple[int, int, int]:
+    """
+    Разбор строки, созданной encode_tag_masks.
+
+    :return: Кортеж (all_mask, any_mask, none_mask).
+    """
+    
+    all_mask, any_mask, none_mask = (int(part, 16) for part in value.split('.'))
+    return all_mask, any_mask, none_mask
+
+def tag_mask_callback(search_in: str, all_mask: int = 0, any_mask: int = 0, none_mask: int = 0) -> TagMaskCallback:
+    """
+    Данные кнопки мультивыбора тегов с заданным выбором (по умолчанию - ничего не выбрано).
+    """
+    
+    return TagMaskCallback(masks=encode_tag_masks(all_mask, any_mask, none_mask), search_in=SearchIn[search_in])
+
+async def get_multi_tags_keyboard(tags, search_in, all_mask, any_mask, none_mask, found_count):
+    """
+    Создание клавиатуры мультивыбора тегов. Нажатие на тег переключает его состояние
+    по кругу: не выбран -> И (✅) -> ИЛИ (➕) -> НЕ (🚫) -> не выбран.
+
+    :param tags: Список тегов.
+    :param search_in: Категория поиска ('on_hand' или 'to_order').
+    :param all_mask: Маска тегов, которые должны быть все.
+    :param any_mask: Маска тегов, из которых нужен хотя бы один.
+    :param none_mask: Маска исключённых тегов.
+    :param found_count: Количество вейпов, подходящих под текущий выбор.
+    :return: Объект InlineKeyboardMarkup с кнопками тегов.
+    """
+    
+    try:
+        builder = InlineKeyboardBuilder()
+
+        for tag in tags:
+            bit = 1 << (tag.id - 1)
+            all_next, any_next, none_next = all_mask, any_mask, none_mask
+
+            if all_mask & bit:
+                mark = TAG_MARKS["all"]
+                all_next, any_next = all_mask & ~bit, any_mask | bit
+            elif any_mask & bit:
+                mark = TAG_MARKS["any"]
+                any_next, none_next = any_mask & ~bit, none_mask | bit
+            elif none_mask & bit:
+                mark = TAG_MARKS["none"]
+                none_next = none_mask & ~bit
+            else:
+                mark = ''
+                all_next = all_mask | bit
+
+            builder.button(
+                text=f'{mark} {tag.name}'.strip(),
+                callback_data=tag_mask_callback(search_in, all_next, any_next, none_next),
+            )
+
+        builder.adjust(TAGS_PER_PAGE)
+
+        if all_mask or any_mask or none_mask:
+            builder.row(InlineKeyboardButton(
+                text=f"{EMOJIS['search_by_flavor']} Показать ({found_count})",
+                callback_data=PageCallback(page=1, context=ListContext.mtags, value=encode_tag_masks(all_mask, any_mask, none_mask),
+                                           search_in=SearchIn[search_in]).pack(),
+            ))
+            builder.row(InlineKeyboardButton(text="♻️ Сбросить", callback_data=tag_mask_callback(search_in).pack()))
+
+        builder.row(InlineKeyboardButton(
+            text=EMOJIS["search_by_tag"] + "Назад к тегам",
+            callback_data=SearchMenuCallback(kind=ListContext.tag, search_in=SearchIn[search_in]).pack(),
+        ))
+        builder.row(InlineKeyboardButton(text=EMOJIS["home"] + " Главное меню", callback_data="menu"))
+
+        return builder.as_markup()
+
+    except Exception as e:
+        logging.error(f"Ошибка при создании клавиатуры мультивыбора тегов: {e}")
+        return InlineKeyboardMarkup(inline_keyboard=[])
+
+def encode_filters(price_min: int, price_max: int, strength: int, brand_id: int, tag_id: int) -> str:
+    """
+    Компактная запись набора фильтров для callback-данных. Ноль означает «без ограничения».
+
+    :return: Строка вида 'мин.макс.крепость.бренд.тег', например '10.25.1.3.0'.
+    """
+    
+    return f"{price_min}.{price_max}.{strength}.{brand_id}.{tag_id}"
+
+def decode_filters(value: str) -> tuple[int, int, int, int, int]:
+    """
+    Разбор строки, созданной encode_filters.
+
+    :return: Кортеж (price_min, price_max, strength, brand_id, tag_id).
+    """
+    
+    price_min, price_max, strength, brand_id, tag_id = (int(part) for part in value.split('.'))
+    return price_min, price_max, strength, brand_id, tag_id
+
+def filter_callback(search_in: str, price_min: int = 0, price_max: int = 0, strength: int = 0,
+                    brand_id: int = 0, tag_id: int = 0) -> FilterCallback:
+    """
+    Данные кнопки фильтров с заданными значениями (по умолчанию - без ограничений).
+    """
+    
+    return FilterCallback(price_min=price_min, price_max=price_max, strength=strength,
+                          brand_id=brand_id, tag_id=tag_id, search_in=SearchIn[search_in])
+
+def filters_to_kwargs(price_min: int, price_max: int, strength: int, brand_id: int, tag_id: int) -> dict:
+    """
+    Преобразование закодированных фильтров в аргументы rq.get_vapes_by_filters.
+    """
+    
+    return {
+        "price_min": price_min or None,
+        "price_max": price_max or None,
+        "strength": strength,
+        "brand_id": brand_id or None,
+        "tag_id": tag_id or None,
+    }
+
+async def get_filters_keyboard(search_in, filters, price_steps, found_count, brand_name=None, tag_name=None):
+    """
+    Создание клавиатуры фильтров по цене, крепости, бренду и тегу.
+
+    :param search_in: Категория поиска ('on_hand' или 'to_order').
+    :param filters: Кортеж (price_min, price_max, strength, brand_id, tag_id), ноль - без ограничения.
+    :param price_steps: Границы ценовых диапазонов.
+    :param found_count: Количество вейпов, подходящих под текущие фильтры.
+    :param brand_name: Название выбранного бренда (если есть).
+    :param tag_name: Название выбранного тега (если есть).
+    :return: Объект InlineKeyboardMarkup с кнопками фильтров.
+    """
+    
+    try:
+        price_min, price_max, strength, brand_id, tag_id = filters
+        builder = InlineKeyboardBuilder()
+
+        def callback(**changes):
+            values = dict(zip(("price_min", "price_max", "strength", "brand_id", "tag_id"), filters))
+            values.update(changes)
+            return filter_callback(search_in, **values).pack()
+
+        bounds = [0] + price_steps + [0] if price_steps else []
+        price_buttons = []
+        for low, high in zip(bounds, bounds[1:]):
+            if low and high:
+                text_button = f"{low}–{high}"
+            elif high:
+                text_button = f"до {high}"
+            else:
+                text_button = f"от {low}"
+            selected = (low, high) == (price_min, price_max)
+            # Повторное нажатие на выбранный диапазон снимает ограничение
+            price_buttons.append(InlineKeyboardButton(
+                text=f"✅ {text_button}" if selected else f"💰 {text_button}",
+                callback_data=callback(price_min=0, price_max=0) if selected else callback(price_min=low, price_max=high),
+            ))
+        if price_buttons:
+            builder.row(*price_buttons)
+
+        builder.row(*(
+            InlineKeyboardButton(
+                text=f"✅ {text_button}" if code == strength else f"📏 {text_button}",
+                callback_data=callback(strength=0 if code == strength else code),
+            )
+            for code, text_button in STRENGTH_OPTIONS.items() if code
+        ))
+
+        if brand_name:
+            builder.row(InlineKeyboardButton(text=f"✖️ Бренд: {brand_name}", callback_data=callback(brand_id=0)))
+        if tag_name:
+            builder.row(InlineKeyboardButton(text=f"✖️ Тег: {tag_name}", callback_data=callback(tag_id=0)))
+
+        builder.row(InlineKeyboardButton(
+            text=f"{EMOJIS['search_by_flavor']} Показать ({found_count})",
+            callback_data=PageCallback(page=1, context=ListContext.flt, value=encode_filters(*filters),
+                                       search_in=SearchIn[search_in]).pack(),
+        ))
+        builder.row(InlineKeyboardButton(text="♻️ Сбросить", callback_data=filter_callback(search_in).pack()))
+        builder.row(InlineKeyboardButton(text=EMOJIS["search_by_tag"] + "Назад к поиску", callback_data=f"vapes_{search_in}"))
+        builder.row(InlineKeyboardButton(text=EMOJIS["home"] + " Главное меню", callback_data="menu"))
+
+        return builder.as_markup()
+
+    except Exception as e:
+        logging.error(f"Ошибка при создании клавиатуры фильтров: {e}")
+        return InlineKeyboardMarkup(inline_keyboard=[])
+
+async def generate_pagination(data, page, page_size, context, context_value, search_in, sort=None):
     """
     Генерация текста и клавиатуры для пагинации.
 
+    Кнопки переходов и сортировки содержат PageCallback (см. app/core/callbacks.py),
+    для списков жидкостей добавляется ряд кнопок сортировки.
+    Под списком — ряд кнопок "Похожие" с номерами товаров на странице (SimilarCallback), а в результатах
+    поиска по вкусу ещё и ряд кнопок подписки на каждый товар, включая те, которых нет в наличии.
+
     :param data: Список объектов для отображения.
     :param page: Текущая страница.
     :param page_size: Количество элементов на странице.
-    :param callback_prefix: Префикс для callback-данных.
-    :param search_in: Категория поиска ('on_hand', 'to_order', 'statistics').
+    :param context: Источник списка: 'brand', 'tag', 'flavor', 'flt', 'sim' или 'mtags'.
+    :param context_value: ID бренда или тега, токен ключа вейпа, закодированные фильтры или маски тегов, токен запроса.
+    :param search_in: Категория поиска ('on_hand', 'to_order').
+    :param sort: Текущий код сортировки ('a', 'd', 'n', 'r', 'p') или None.
     :return: Кортеж (текст, клавиатура).
     """
     try:
         total_pages = (len(data) + page_size - 1) // page_size
         page = max(1, min(page, total_pages))
-        
+
         start_index = (page - 1) * page_size
         end_index = start_index + page_size
         current_page_data = data[start_index:end_index]
         
         text = f"📚 Страница {page} из {total_pages}\n\n"
-        for item in current_page_data:
-            if search_in == 'statistics':
-                text += (f"🆔 User ID: {item.id}\n"
-                        f"👤 Username: {item.username}\n"
-                        f"📅 First seen: {item.first_seen}\n"
-                        f"🕒 Last seen: {item.last_seen}\n"
-                        f"📊 Command count: {item.command_count}\n"
-                        "──────────────────────────\n")
-            elif search_in in ('on_hand', 'to_order'):
+        sold_out = set()
+        for number, item in enumerate(current_page_data, start=1):
+            if search_in in ('on_hand', 'to_order'):
                 availability_set = set()
 
                 availability_20_check = (-1 if search_in == 'on_hand' else 0)
@@ -134,22 +355,62 @@ async def generate_pagination(data, page, page_size, callback_prefix, search_in)
                     availability_set.add("45, 50, 60 MG")
 
                 availability = f"📏 {', '.join(availability_set)}" if availability_set else "📏 Нет в наличии"
+                if not availability_set:
+                    sold_out.add(number)
 
-                text += f"✨ {item.name}\n💰 {item.price} руб.\n {availability}\n\n"
+                text += f"✨ {number}. {item.name}\n💰 {item.price} руб.\n {availability}\n\n"
 
 
         builder = InlineKeyboardBuilder()
+
+        def page_callback(page_number, page_sort):
+            return PageCallback(page=page_number, context=ListContext[context], value=str(context_value),
+                                search_in=SearchIn[search_in], sort=page_sort)
         
         if total_pages > 1:
             builder.button(
                 text=EMOJIS["pagination_back"] + " Назад",
-                callback_data=f"page_{total_pages if page == 1 else (page - 1)}_{callback_prefix}_{search_in}",
+                callback_data=page_callback(total_pages if page == 1 else (page - 1), sort),
             )
             builder.button(
                 text="Вперёд " + EMOJIS["pagination_forward"],
-                callback_data=f"page_{1 if page == total_pages else (page + 1)}_{callback_prefix}_{search_in}",
+                callback_data=page_callback(1 if page == total_pages else (page + 1), sort),
             )
 
+        # В кнопки похожих и подписки записывается токен стабильного ключа, а не ID из текущего снимка
+        catalog = get_catalog()
+
+        similar_buttons = []
+        if (search_in in ('on_hand', 'to_order') and len(sold_out) < len(current_page_data)
+                and catalog is not None):
+            text += f"{EMOJIS['similar']} — похожие вкусы на товар с этим номером\n"
+            # Для товаров, которых нет в наличии, остаётся только подписка
+            similar_buttons = [
+                InlineKeyboardButton(text=f"{EMOJIS['similar']} {number}",
+                                     callback_data=SimilarCallback(vape=token, search_in=SearchIn[search_in]).pack())
+                for number, item in enumerate(current_page_data, start=1)
+                if number not in sold_out and (token := catalog.target_token("vape", item.id)) is not None
+            ]
+
+        subscribe_buttons = []
+        if context == "flavor" and current_page_data and catalog is not None:
+            text += f"{EMOJIS['subscribe']} — следить за наличием и ценой товара с этим номером\n"
+            subscribe_buttons = [
+                InlineKeyboardButton(text=f"{EMOJIS['subscribe']} {number}",
+                                     callback_data=SubscribeCallback(kind="vape", target=token).pack())
+                for number, item in enumerate(current_page_data, start=1)
+                if (token := catalog.target_token("vape", item.id)) is not None
+            ]
+
+        sort_buttons = []
+        if search_in in ('on_hand', 'to_order') and len(data) > 1:
+            for code, text_button in SORT_BUTTONS.items():
+                # Повторное нажатие на выбранную сортировку возвращает порядок каталога
+                sort_buttons.append(InlineKeyboardButton(
+                    text=f"✅{text_button}" if code == sort else text_button,
+                    callback_data=page_callback(1, None if code == sort else code).pack(),
+                ))
+
         # Кнопки возврата
         return_buttons = {
             "brand": "🔍 Вернуться к брендам",
@@ -157,17 +418,65 @@ async def generate_pagination(data, page, page_size, callback_prefix, search_in)
             "flavor": "🔍 Вернуться к поиску",
         }
 
-        for key, text_button in return_buttons.items():
-            if key in callback_prefix:
-                builder.button(text=text_button, callback_data=f"search_by_{key}_{search_in}")
-                break
+        if context == "mtags":
+            builder.button(text="🔍 Изменить теги",
+                           callback_data=tag_mask_callback(search_in, *decode_tag_masks(str(context_value))))
+        elif context == "flt":
+            builder.button(text="⚙️ Изменить фильтры",
+                           callback_data=filter_callback(search_in, *decode_filters(str(context_value))))
+        else:
+            if context in ("brand", "tag"):
+                brand_id = int(context_value) if context == "brand" else 0
+                tag_id = int(context_value) if context == "tag" else 0
+                builder.button(text="⚙️ Фильтры",
+                               callback_data=filter_callback(search_in, brand_id=brand_id, tag_id=tag_id))
+
+            if context == "sim":
+                target = str(context_value)
+            elif context in SUBSCRIPTION_KINDS and catalog is not None:
+                target = catalog.target_token(SUBSCRIPTION_KINDS[context], int(context_value))
+            else:
+                target = None
+            if target is not None:
+                builder.button(text=f"{EMOJIS['subscribe']} Следить за наличием и ценой",
+                               callback_data=SubscribeCallback(kind=SUBSCRIPTION_KINDS[context], target=target))
+
+            if context in return_buttons:
+                builder.button(text=return_buttons[context],
+                               callback_data=SearchMenuCallback(kind=ListContext[context], search_in=SearchIn[search_in]))
 
         builder.button(text=EMOJIS["home"] + " Главное меню", callback_data="menu")
 
         builder.adjust(2, 1, 1) if total_pages > 1 else builder.adjust(1, 1)
+        if sort_buttons or similar_buttons or subscribe_buttons:
+            rows = builder.export()
+            position = 1 if total_pages > 1 else 0
+            for extra_row in (sort_buttons, subscribe_buttons, similar_buttons):
+                if extra_row:
+                    rows.insert(position, extra_row)
+            return text, InlineKeyboardMarkup(inline_keyboard=rows)
         
         return text, builder.as_markup()
     
     except Exception as e:
         logging.error(f"Ошибка при генерации пагинации: {e}")
         return "⚠ Ошибка при загрузке данных.", InlineKeyboardMarkup(inline_keyboard=[])
+
+
+def get_subscriptions_keyboard(subscriptions: list[tuple[int, str]]):
+    """
+    Клавиатура со списком подписок пользователя: нажатие отменяет подписку.
+
+    :param subscriptions: Список (ID подписки, название цели).
+    :return: Объект InlineKeyboardMarkup.
+    """
+    try:
+        builder = InlineKeyboardBuilder()
+        for subscription_id, title in subscriptions:
+            builder.button(text=f"❌ {title}", callback_data=UnsubscribeCallback(subscription_id=subscription_id))
+        builder.button(text=EMOJIS["home"] + " Главное меню", callback_data="menu")
+        builder.adjust(1)
+        return builder.as_markup()
+    except Exception as e:
+        logging.error(f"Ошибка при создании клавиатуры подписок: {e}")
+        return InlineKeyboardMarkup(inline_keyboard=[])
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject, Update
+from cachetools import TTLCache
+
+import app.database.requests as rq
+from app.database.querylog import query_scope
+from app.utils.logger import log_user_action
+from app.utils.metrics import HANDLER_DURATION, HANDLER_ERRORS, registry
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+USER_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('USER_ACTIVITY_FLUSH_INTERVAL', 5))
+# Ограничение частоты нажатий кнопок одного пользователя: THROTTLE_RATE в секунду, подряд - до THROTTLE_BURST
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 2))
+THROTTLE_BURST = float(os.getenv('THROTTLE_BURST', 5))
+THROTTLE_CACHE_SIZE = int(os.getenv('THROTTLE_CACHE_SIZE', 10000))
+
+
+class UserActivityTracker:
+    """
+    Учёт активности пользователей в памяти.
+
+    Хранит множество уже известных пользователей и копит приращения command_count
+    и last_seen, которые периодически записываются в базу одним INSERT ... ON CONFLICT.
+    """
+
+    def __init__(self, flush_interval: float = USER_ACTIVITY_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.known_users: set[int] = set()
+        self.pending: dict[int, dict] = {}
+        self._task: asyncio.Task | None = None
+
+    async def load_known_users(self):
+        """
+        Загружает ID существующих пользователей из базы данных.
+        """
+
+        self.known_users = await rq.get_user_ids()
+        logging.info(f"Loaded {len(self.known_users)} known users.")
+
+    def track(self, user_id: int, username: str | None) -> bool:
+        """
+        Учитывает одно действие пользователя.
+
+        :return: True, если пользователь встречается впервые.
+        """
+
+        now = datetime.now(timezone.utc)
+        username = username or ""  # Колонка username не допускает NULL, а имя пользователя в Telegram необязательно
+        row = self.pending.get(user_id)
+        if row is None:
+            self.pending[user_id] = {
+                "id": user_id,
+                "username": username,
+                "first_seen": now,
+                "last_seen": now,
+                "command_count": 1,
+            }
+        else:
+            row["username"] = username
+            row["last_seen"] = now
+            row["command_count"] += 1
+
+        if user_id in self.known_users:
+            return False
+        self.known_users.add(user_id)
+        return True
+
+    async def flush(self):
+        """
+        Записывает накопленную активность в базу данных.
+        """
+
+        if not self.pending:
+            return
+        rows, self.pending = list(self.pending.values()), {}
+        if not await rq.upsert_users_activity(rows):
+            # Активность не потеряна: вернём её в накопленное и повторим при следующей записи
+            self._restore(rows)
+
+    def _restore(self, rows: list[dict]):
+        """
+        Возвращает незаписанные строки в pending, объединяя их с активностью,
+        накопленной во время неудачной записи.
+        """
+
+        for row in rows:
+            newer = self.pending.get(row["id"])
+            if newer is None:
+                self.pending[row["id"]] = row
+            else:
+                newer["first_seen"] = row["first_seen"]
+                newer["command_count"] += row["command_count"]
+
+    def start(self):
+        """
+        Запускает периодическую запись накопленной активности.
+        """
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает периодическую запись и сбрасывает оставшуюся активность.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+user_tracker = UserActivityTracker()
+
+
+class UserTrackingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для сообщений и callback-запросов, который ведёт учёт пользователей.
+
+    Вся работа выполняется после того, как обработчик ответил пользователю, и не обращается
+    к базе данных: новые пользователи и счётчики команд накапливаются в user_tracker.
+    """
+
+    def __init__(self, tracker: UserActivityTracker = user_tracker):
+        self.tracker = tracker
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            user = data.get("event_from_user")
+            if user is not None:
+                if self.tracker.track(user.id, user.username):
+                    action_type = "add_user"
+                    action_details = f"User: id={user.id}, username={user.username} added to database"
+                    await log_user_action(user.id, action_type, action_details)
+
+
+class UpdateThrottle:
+    """
+    Ограничение частоты нажатий кнопок пользователя и склейка повторных нажатий.
+
+    У каждого пользователя своё ведро токенов: нажатие забирает токен, токены пополняются
+    со скоростью rate в секунду, но не больше burst. Если токенов нет, нажатие пропускается.
+    Нажатие кнопки с теми же callback-данными, пока предыдущее такое же нажатие этого
+    пользователя ещё обрабатывается, склеивается с ним и не обрабатывается повторно.
+    Ведра хранятся в памяти; ведро пользователя, который долго не писал, удаляется
+    (к этому времени оно всё равно было бы полным).
+    """
+
+    def __init__(self, rate: float = THROTTLE_RATE, burst: float = THROTTLE_BURST,
+                 cache_size: int = THROTTLE_CACHE_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: TTLCache = TTLCache(maxsize=cache_size, ttl=max(burst / rate, 1) if rate > 0 else 3600)
+        self.in_flight: set[tuple[int, str]] = set()
+        self.metrics = {"passed": 0, "throttled": 0, "coalesced": 0}
+
+    @staticmethod
+    def key(user_id: int, update: Update) -> tuple[int, str] | None:
+        """
+        Ключ повторного нажатия: (пользователь, callback-данные) или None, если это не нажатие кнопки.
+        """
+
+        if update.callback_query is None or update.callback_query.data is None:
+            return None
+        return user_id, update.callback_query.data
+
+    def admit(self, user_id: int, update: Update) -> str | None:
+        """
+        Решает, обрабатывать ли обновление. Пропущенное нажатие регистрируется как обрабатываемое:
+        после обработки нужно вызвать release.
+
+        :return: None - обрабатывать, 'coalesced' - повтор обрабатываемого нажатия,
+            'throttled' - превышена частота.
+        """
+
+        key = self.key(user_id, update)
+        if key is not None and key in self.in_flight:
+            self.metrics["coalesced"] += 1
+            return "coalesced"
+
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self.buckets[user_id] = (tokens, now)
+            self.metrics["throttled"] += 1
+            return "throttled"
+        self.buckets[user_id] = (tokens - 1, now)
+
+        if key is not None:
+            self.in_flight.add(key)
+        self.metrics["passed"] += 1
+        return None
+
+    def release(self, user_id: int, update: Update):
+        key = self.key(user_id, update)
+        if key is not None:
+            self.in_flight.discard(key)
+
+    @staticmethod
+    async def reject(update: Update):
+        """
+        Отвечает на пропущенное нажатие кнопки, чтобы у пользователя не висели «часики».
+        """
+
+        if isinstance(update.callback_query, CallbackQuery):
+            try:
+                await update.callback_query.answer()
+            except Exception as e:
+                logging.warning(f"Failed to answer a skipped callback query: {e}")
+
+
+update_throttle = UpdateThrottle()
+registry.callback("bot_updates_throttled_total", "Обновлений, пропущенных из-за лимита частоты", "counter",
+                  lambda: update_throttle.metrics["throttled"])
+registry.callback("bot_updates_coalesced_total", "Повторных нажатий, склеенных с обрабатываемым", "counter",
+                  lambda: update_throttle.metrics["coalesced"])
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений, который пропускает нажатия кнопок сверх лимита частоты
+    и склеивает повторные нажатия (см. UpdateThrottle).
+
+    Регистрируется первым, поэтому пропущенные нажатия не доходят ни до обработчиков,
+    ни до учёта пользователей и логов. Сообщения не ограничиваются: это может быть текст,
+    которого ждёт состояние FSM, или /start, и молча терять их нельзя.
+    """
+
+    def __init__(self, throttle: UpdateThrottle = update_throttle):
+        self.throttle = throttle
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        # Inline-запросы не ограничиваются: их результаты кэшируются, а Telegram сам их прореживает
+        if user is None or not isinstance(event, Update) or event.callback_query is None:
+            return await handler(event, data)
+
+        if self.throttle.admit(user.id, event) is not None:
+            await self.throttle.reject(event)
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self.throttle.release(user.id, event)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware роутера: записывает длительность каждого обработчика (имя функции
+    обработчика - метка handler) и считает исключения в нём. Исключение пробрасывается дальше.
+    SQL-запросы обработчика считаются в query_scope: если их больше QUERY_BUDGET,
+    в лог пишется предупреждение о возможной проблеме N+1.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+        start = time.perf_counter()
+        try:
+            with query_scope(name):
+                return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_DURATION.observe(time.perf_counter() - start, name)
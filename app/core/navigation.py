@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+# Режим навигации по меню: 'edit' - все экраны показываются в одном сообщении,
+# 'send' - каждый экран отправляется новым сообщением
+NAVIGATION_MODE = os.getenv('NAVIGATION_MODE', 'edit')
+# Для скольких сообщений помнить хеш содержимого
+NAVIGATION_CACHE_SIZE = int(os.getenv('NAVIGATION_CACHE_SIZE', 10000))
+
+
+def _hash(value: str) -> bytes:
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def content_hash(text: str | None, reply_markup: InlineKeyboardMarkup | None) -> tuple[bytes, bytes]:
+    """
+    Хеши текста и клавиатуры сообщения. Текст сравнивается без пробелов по краям,
+    так как Telegram их обрезает.
+    """
+
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else ""
+    return _hash((text or "").strip()), _hash(markup)
+
+
+class Navigator:
+    """
+    Показ экранов меню в одном сообщении.
+
+    Для нажатия кнопки экран показывается правкой сообщения с этой кнопкой: если изменилась
+    только клавиатура - editMessageReplyMarkup, иначе editMessageText. Правка не отправляется,
+    если хеш нового содержимого совпадает с текущим (повторное нажатие той же кнопки).
+    Хеши последних показанных экранов хранятся по (chat_id, message_id) в LRU-кэше,
+    для остальных сообщений вычисляются по содержимому из callback-запроса.
+    Новое сообщение отправляется только на команды и если сообщение нельзя отредактировать
+    (слишком старое, удалено, это документ и т.п.).
+    """
+
+    def __init__(self, mode: str = NAVIGATION_MODE, cache_size: int = NAVIGATION_CACHE_SIZE):
+        self.mode = mode
+        self.cache_size = cache_size
+        self.hashes: OrderedDict[tuple[int, int], tuple[bytes, bytes]] = OrderedDict()
+        self.metrics = {"edited": 0, "skipped": 0, "sent": 0}
+
+    def _remember(self, message: Message, digest: tuple[bytes, bytes]):
+        key = (message.chat.id, message.message_id)
+        self.hashes[key] = digest
+        self.hashes.move_to_end(key)
+        while len(self.hashes) > self.cache_size:
+            self.hashes.popitem(last=False)
+
+    def _current(self, message: Message) -> tuple[bytes, bytes]:
+        digest = self.hashes.get((message.chat.id, message.message_id))
+        if digest is None:
+            digest = content_hash(message.text, message.reply_markup)
+        return digest
+
+    async def _send(self, message: Message, text: str, reply_markup: InlineKeyboardMarkup | None,
+                    digest: tuple[bytes, bytes]):
+        sent = await message.answer(text, reply_markup=reply_markup)
+        self.metrics["sent"] += 1
+        if isinstance(sent, Message):
+            self._remember(sent, digest)
+
+    async def show(self, update: Message | CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup | None = None):
+        """
+        Показывает экран в ответ на команду или нажатие кнопки.
+
+        :param update: Сообщение с командой или callback-запрос.
+        :param text: Текст экрана.
+        :param reply_markup: Клавиатура экрана.
+        :return: None
+        """
+
+        digest = content_hash(text, reply_markup)
+
+        if isinstance(update, Message):
+            await self._send(update, text, reply_markup, digest)
+            return
+
+        message = update.message
+        if not isinstance(message, Message):
+            # Сообщение недоступно (слишком старое): отвечаем в чат пользователя
+            sent = await update.bot.send_message(update.from_user.id, text, reply_markup=reply_markup)
+            self.metrics["sent"] += 1
+            self._remember(sent, digest)
+            return
+
+        if self.mode != 'edit' or not message.text:
+            await self._send(message, text, reply_markup, digest)
+            return
+
+        current = self._current(message)
+        if current == digest:
+            self.metrics["skipped"] += 1
+            return
+
+        try:
+            if current[0] == digest[0]:
+                await message.edit_reply_markup(reply_markup=reply_markup)
+            else:
+                await message.edit_text(text, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message:
+                self.metrics["skipped"] += 1
+                self._remember(message, digest)
+                return
+            logging.info(f"Message {message.message_id} in chat {message.chat.id} can't be edited, "
+                         f"sending a new one: {e.message}")
+            await self._send(message, text, reply_markup, digest)
+            return
+
+        self.metrics["edited"] += 1
+        self._remember(message, digest)
+
+
+navigator = Navigator()
@@ -0,0 +1,75 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.database.catalog import get_catalog
+from app.utils.texts import CATALOG_LOADING_TEXT
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+
+class Readiness:
+    """
+    Готовность бота после запуска.
+
+    Бот принимает обновления сразу после запуска, а каталог загружается в фоне: готовым он
+    считается, когда появился первый снимок (из базы каталога, сохранённой при прошлом запуске,
+    или из Google Таблиц). Время от запуска процесса до приёма обновлений, готовности каталога
+    и первого ответа пользователю записывается в лог один раз.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.marks: dict[str, float] = {}
+
+    @property
+    def catalog_ready(self) -> bool:
+        return get_catalog() is not None
+
+    def mark(self, event: str):
+        """
+        Записывает в лог время от запуска до события (только первый раз).
+
+        :param event: Название события ('serving', 'catalog', 'first_response').
+        """
+
+        if event in self.marks:
+            return
+        self.marks[event] = round(time.monotonic() - self.started_at, 3)
+        logging.info(f"Startup: {event} in {self.marks[event]} s")
+
+
+readiness = Readiness()
+
+
+class CatalogReadinessMiddleware(BaseMiddleware):
+    """
+    Inner middleware сообщений и callback-запросов: пока каталог не загружен, вместо обработчика
+    отвечает коротким сообщением о загрузке. Обработчики, которым каталог не нужен (/start,
+    связь с менеджером, статистика), помечаются флагом catalog=False и работают сразу.
+    """
+
+    def __init__(self, state: Readiness = readiness):
+        self.state = state
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        try:
+            if self.state.catalog_ready or get_flag(data, "catalog", default=True) is False:
+                return await handler(event, data)
+
+            if isinstance(event, CallbackQuery):
+                await event.answer(CATALOG_LOADING_TEXT)
+            elif isinstance(event, Message):
+                await event.answer(CATALOG_LOADING_TEXT)
+            return None
+        finally:
+            self.state.mark("first_response")
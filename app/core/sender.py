@@ -0,0 +1,349 @@
+import asyncio
+import itertools
+import logging
+import os
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+
+from app.utils.metrics import BOT_API_DURATION, BOT_API_QUEUE_LATENCY, registry
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+SENDER_GLOBAL_RATE = float(os.getenv('SENDER_GLOBAL_RATE', 30))  # сообщений в секунду на бота
+SENDER_CHAT_RATE = float(os.getenv('SENDER_CHAT_RATE', 1))  # сообщений в секунду на чат
+SENDER_CHAT_BURST = int(os.getenv('SENDER_CHAT_BURST', 3))  # сколько сообщений в чат можно отправить подряд
+SENDER_MAX_RETRIES = int(os.getenv('SENDER_MAX_RETRIES', 3))
+SENDER_STATS_INTERVAL = float(os.getenv('SENDER_STATS_INTERVAL', 60))
+SENDER_DRAIN_TIMEOUT = float(os.getenv('SENDER_DRAIN_TIMEOUT', 10))
+
+# Приоритеты отправки: меньше - раньше. Ответы на действия пользователя обгоняют рассылки.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+send_priority: ContextVar[int] = ContextVar('send_priority', default=PRIORITY_INTERACTIVE)
+
+# Методы, которые редактируют сообщение: повторные правки одного сообщения в очереди объединяются
+EDIT_METHODS = {"editMessageText", "editMessageReplyMarkup", "editMessageCaption", "editMessageMedia"}
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate токенов в секунду, не больше capacity в запасе.
+    """
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Через сколько секунд будет доступен один токен.
+        """
+
+        self._refill(now)
+        blocked = max(0.0, self.blocked_until - now)
+        return max(blocked, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float):
+        """
+        Запрещает отправку до момента until (ответ 429 с retry_after).
+        """
+
+        self.blocked_until = max(self.blocked_until, until)
+        self.tokens = min(self.tokens, 0)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+@dataclass
+class OutboundRequest:
+    """
+    Запрос к Bot API в очереди отправки.
+    """
+
+    chat_id: Any
+    method: TelegramMethod
+    make_request: Any
+    bot: Bot
+    future: asyncio.Future
+    enqueued_at: float
+    edit_key: tuple | None = None
+    attempts: int = 0
+    priority: int = PRIORITY_INTERACTIVE
+
+
+class OutboundSender(BaseRequestMiddleware):
+    """
+    Слой исходящих сообщений: middleware сессии бота, через который проходят все вызовы Bot API.
+
+    Вызовы, адресованные чату (отправка и редактирование сообщений), ставятся в очередь
+    с приоритетом (send_priority) и отправляются с учётом общего ограничения частоты
+    и ограничения на каждый чат (token bucket). Ответ 429 повторяется после retry_after,
+    а повторные правки одного и того же сообщения, ещё не ушедшие из очереди, объединяются
+    в одну (отправляется последняя). Правка, получившая 429, не повторяется, если за это время
+    пришла более новая правка того же сообщения: иначе повтор перезаписал бы её.
+    Остальные вызовы (getUpdates, answerCallbackQuery и т.п.) выполняются сразу.
+
+    Метрики: глубина очереди, количество отправленных, объединённых и повторённых запросов,
+    задержка от постановки в очередь до ответа (среднее и максимум).
+    """
+
+    def __init__(self, global_rate: float = SENDER_GLOBAL_RATE, chat_rate: float = SENDER_CHAT_RATE,
+                 chat_burst: int = SENDER_CHAT_BURST, max_retries: int = SENDER_MAX_RETRIES):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self.queue: asyncio.PriorityQueue | None = None
+        self.global_bucket: TokenBucket | None = None
+        self.chat_buckets: dict[Any, TokenBucket] = {}
+        self.pending_edits: dict[tuple, OutboundRequest] = {}
+        # Последняя правка каждого сообщения, которая ещё не завершилась (в очереди, отправляется или ждёт повтора)
+        self.latest_edits: dict[tuple, OutboundRequest] = {}
+        self.in_flight: set[asyncio.Task] = set()
+        self.deferred = 0
+        self._seq = itertools.count()
+        self._tasks: list[asyncio.Task] = []
+
+        self.metrics = {"sent": 0, "coalesced": 0, "retried": 0, "failed": 0, "latency_sum": 0.0, "latency_max": 0.0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and not self._tasks[0].done()
+
+    def start(self):
+        """
+        Запускает цикл отправки и периодический вывод метрик.
+        """
+
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.PriorityQueue()
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate, loop.time())
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._report())]
+
+    async def stop(self, timeout: float = SENDER_DRAIN_TIMEOUT):
+        """
+        Дожидается отправки оставшихся сообщений (не дольше timeout секунд) и останавливает цикл.
+        """
+
+        if not self.running:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self.queue.qsize() or self.deferred or self.in_flight) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logging.info(f"Outbound sender stopped: {self.stats()}")
+
+    async def __call__(self, make_request, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not self.running:
+            return await self._request(make_request, bot, method)
+
+        loop = asyncio.get_running_loop()
+        edit_key = None
+        if method.__api_method__ in EDIT_METHODS:
+            edit_key = (method.__api_method__, chat_id, getattr(method, "message_id", None))
+            pending = self.pending_edits.get(edit_key)
+            if pending is not None:
+                # Сообщение ещё не отправлено: достаточно отправить последнюю правку
+                pending.method = method
+                self.metrics["coalesced"] += 1
+                return await asyncio.shield(pending.future)
+
+        request = OutboundRequest(
+            chat_id=chat_id, method=method, make_request=make_request, bot=bot,
+            future=loop.create_future(), enqueued_at=loop.time(), edit_key=edit_key,
+            priority=send_priority.get(),
+        )
+        if edit_key is not None:
+            self.pending_edits[edit_key] = request
+            self.latest_edits[edit_key] = request
+        self._put(request)
+        return await asyncio.shield(request.future)
+
+    @staticmethod
+    async def _request(make_request, bot: Bot, method: TelegramMethod):
+        with BOT_API_DURATION.time(method.__api_method__):
+            return await make_request(bot, method)
+
+    def _put(self, request: OutboundRequest):
+        self.queue.put_nowait((request.priority, next(self._seq), request))
+
+    def _defer(self, request: OutboundRequest, delay: float):
+        """
+        Возвращает запрос в очередь через delay секунд.
+        """
+
+        def requeue():
+            self.deferred -= 1
+            self._put(request)
+
+        self.deferred += 1
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    async def _run(self):
+        """
+        Цикл отправки: берёт запрос с наивысшим приоритетом; если его чат исчерпал лимит,
+        откладывает запрос, не задерживая запросы в другие чаты; общий лимит ждёт на месте.
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, request = await self.queue.get()
+            now = loop.time()
+
+            chat_bucket = self._chat_bucket(request.chat_id, now)
+            chat_wait = chat_bucket.wait_time(now)
+            if chat_wait > 0:
+                self._defer(request, chat_wait)
+                continue
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                now = loop.time()
+
+            self.global_bucket.take(now)
+            chat_bucket.take(now)
+            if request.edit_key is not None and self.pending_edits.get(request.edit_key) is request:
+                del self.pending_edits[request.edit_key]
+
+            task = asyncio.create_task(self._send(request))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _send(self, request: OutboundRequest):
+        await self._attempt(request)
+        if request.future.done() and self.latest_edits.get(request.edit_key) is request:
+            del self.latest_edits[request.edit_key]
+
+    async def _attempt(self, request: OutboundRequest):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await self._request(request.make_request, request.bot, request.method)
+        except TelegramRetryAfter as e:
+            request.attempts += 1
+            self.metrics["retried"] += 1
+            now = loop.time()
+            self._chat_bucket(request.chat_id, now).block(now + e.retry_after)
+            if request.edit_key is not None:
+                newer = self.latest_edits.get(request.edit_key)
+                if newer is not request:
+                    # В очереди уже более новая правка этого сообщения: старую не повторяем,
+                    # иначе она перезапишет новую
+                    self.metrics["coalesced"] += 1
+                    newer.future.add_done_callback(lambda done: _copy_result(done, request.future))
+                    return
+                if request.attempts <= self.max_retries:
+                    # Правки, пришедшие до повтора, объединяются с ним
+                    self.pending_edits[request.edit_key] = request
+            if request.attempts <= self.max_retries:
+                logging.warning(f"Flood control for chat {request.chat_id}: retry in {e.retry_after} s")
+                self._defer(request, e.retry_after)
+                return
+            self.metrics["failed"] += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+        except Exception as e:
+            self.metrics["failed"] += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+
+        latency = loop.time() - request.enqueued_at
+        self.metrics["sent"] += 1
+        self.metrics["latency_sum"] += latency
+        self.metrics["latency_max"] = max(self.metrics["latency_max"], latency)
+        BOT_API_QUEUE_LATENCY.observe(latency)
+        if not request.future.done():
+            request.future.set_result(result)
+
+    def stats(self) -> dict:
+        """
+        Текущие метрики очереди отправки.
+        """
+
+        sent = self.metrics["sent"]
+        return {
+            "queue_depth": (self.queue.qsize() if self.queue is not None else 0) + self.deferred,
+            "in_flight": len(self.in_flight),
+            "sent": sent,
+            "coalesced": self.metrics["coalesced"],
+            "retried": self.metrics["retried"],
+            "failed": self.metrics["failed"],
+            "latency_avg_ms": round(self.metrics["latency_sum"] / sent * 1000, 1) if sent else 0,
+            "latency_max_ms": round(self.metrics["latency_max"] * 1000, 1),
+        }
+
+    async def _report(self):
+        """
+        Периодически пишет метрики в лог и удаляет ограничители неактивных чатов.
+        """
+
+        loop = asyncio.get_running_loop()
+        last_sent = 0
+        while True:
+            await asyncio.sleep(SENDER_STATS_INTERVAL)
+            now = loop.time()
+            self.chat_buckets = {chat_id: bucket for chat_id, bucket in self.chat_buckets.items() if not bucket.idle(now)}
+            if self.metrics["sent"] != last_sent:
+                last_sent = self.metrics["sent"]
+                logging.info(f"Outbound sender: {self.stats()}")
+
+
+def _copy_result(source: asyncio.Future, target: asyncio.Future):
+    """
+    Завершает target так же, как завершился source.
+    """
+
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+outbound_sender = OutboundSender()
+registry.callback("bot_outbound_queue_depth", "Сообщений в очереди отправки", "gauge",
+                  lambda: outbound_sender.queue.qsize() + outbound_sender.deferred if outbound_sender.queue else 0)
+registry.callback("bot_outbound_coalesced_total", "Правок сообщений, объединённых в очереди отправки", "counter",
+                  lambda: outbound_sender.metrics["coalesced"])
+registry.callback("bot_outbound_failed_total", "Запросов к Bot API, завершившихся ошибкой", "counter",
+                  lambda: outbound_sender.metrics["failed"])
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.models import async_session, FsmRecord
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+# Хранилище состояний FSM: 'sqlite' (по умолчанию), 'redis' (нужны пакет redis и REDIS_URL) или 'memory'
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+REDIS_URL = os.getenv('REDIS_URL')
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', 24 * 3600))  # через сколько секунд брошенный диалог забывается
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', 1))
+FSM_PURGE_INTERVAL = float(os.getenv('FSM_PURGE_INTERVAL', 600))
+
+
+@dataclass
+class FsmEntry:
+    """
+    Состояние и данные одного диалога в кэше хранилища.
+    """
+
+    state: str | None = None
+    data: dict[str, Any] = field(default_factory=dict)
+    updated_at: float = 0.0
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в основной базе данных с отложенной записью.
+
+    Чтение и запись идут через кэш в памяти: при первом обращении к диалогу запись читается
+    из таблицы fsm_records, а изменения копятся в кэше и раз в flush_interval секунд
+    записываются одной транзакцией (пустые записи удаляются). Поэтому обработчик не ждёт базу,
+    а состояние поиска переживает перезапуск. Диалоги, которые не менялись дольше ttl секунд,
+    считаются брошенными: при чтении возвращаются пустыми и периодически удаляются из базы.
+    """
+
+    def __init__(self, key_builder: KeyBuilder | None = None, ttl: int = FSM_STATE_TTL,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, purge_interval: float = FSM_PURGE_INTERVAL):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        self.entries: dict[str, FsmEntry] = {}
+        self.dirty: set[str] = set()
+        self.metrics = {"loaded": 0, "written": 0, "deleted": 0, "expired": 0}
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        Запускает фоновую запись изменений и удаление брошенных диалогов.
+        """
+
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Останавливает фоновую задачу и записывает оставшиеся изменения.
+        """
+
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+    def _expired(self, entry: FsmEntry, now: float) -> bool:
+        return not entry.empty and now - entry.updated_at > self.ttl
+
+    async def _entry(self, key: StorageKey) -> tuple[str, FsmEntry]:
+        record_key = self.key_builder.build(key)
+        entry = self.entries.get(record_key)
+        if entry is None:
+            entry = await self._load(record_key)
+            # Пока шла загрузка, запись могла появиться в кэше: она новее
+            entry = self.entries.setdefault(record_key, entry)
+
+        now = time.time()
+        if self._expired(entry, now):
+            self.metrics["expired"] += 1
+            entry.state, entry.data, entry.updated_at = None, {}, now
+            self.dirty.add(record_key)
+        return record_key, entry
+
+    async def _load(self, record_key: str) -> FsmEntry:
+        try:
+            async with async_session() as session:
+                record = await session.scalar(select(FsmRecord).where(FsmRecord.key == record_key))
+            self.metrics["loaded"] += 1
+            if record is None:
+                return FsmEntry()
+            return FsmEntry(state=record.state, data=json.loads(record.data), updated_at=record.updated_at)
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке состояния FSM {record_key}: {e}")
+            return FsmEntry()
+
+    def _touch(self, record_key: str, entry: FsmEntry):
+        entry.updated_at = time.time()
+        self.dirty.add(record_key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record_key, entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(record_key, entry)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, entry = await self._entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, got {type(data).__name__}")
+        record_key, entry = await self._entry(key)
+        entry.data = data.copy()
+        self._touch(record_key, entry)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, entry = await self._entry(key)
+        return entry.data.copy()
+
+    async def flush(self):
+        """
+        Записывает изменённые диалоги в базу одной транзакцией.
+        """
+
+        if not self.dirty:
+            return
+        keys, self.dirty = self.dirty, set()
+
+        upserts, deletes = [], []
+        for record_key in keys:
+            entry = self.entries.get(record_key)
+            if entry is None or entry.empty:
+                deletes.append(record_key)
+            else:
+                upserts.append({"key": record_key, "state": entry.state, "data": json.dumps(entry.data),
+                                "updated_at": int(entry.updated_at)})
+
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    if deletes:
+                        await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(deletes)))
+                    if upserts:
+                        statement = sqlite_insert(FsmRecord)
+                        await session.execute(statement.on_conflict_do_update(
+                            index_elements=["key"],
+                            set_={"state": statement.excluded.state, "data": statement.excluded.data,
+                                  "updated_at": statement.excluded.updated_at},
+                        ), upserts)
+            self.metrics["written"] += len(upserts)
+            self.metrics["deleted"] += len(deletes)
+        except Exception as e:
+            # Изменения не потеряны: повторим при следующей записи
+            self.dirty |= keys
+            logging.error(f"Ошибка при записи состояний FSM: {e}")
+
+    async def purge(self):
+        """
+        Удаляет брошенные диалоги из базы и из кэша, а пустые записи - из кэша.
+        """
+
+        now = time.time()
+        self.entries = {
+            record_key: entry for record_key, entry in self.entries.items()
+            if record_key in self.dirty or not (entry.empty or self._expired(entry, now))
+        }
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    result = await session.execute(delete(FsmRecord).where(FsmRecord.updated_at < int(now - self.ttl)))
+            if result.rowcount:
+                logging.info(f"Удалено брошенных состояний FSM: {result.rowcount}")
+        except Exception as e:
+            logging.error(f"Ошибка при удалении старых состояний FSM: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_purge = loop.time()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if loop.time() >= next_purge:
+                next_purge = loop.time() + self.purge_interval
+                await self.purge()
+
+
+def create_storage(kind: str = FSM_STORAGE) -> BaseStorage:
+    """
+    Создаёт хранилище FSM по настройке FSM_STORAGE.
+
+    Для 'redis' состояния хранит Redis с временем жизни FSM_STATE_TTL (пакет redis
+    не входит в обязательные зависимости); если он недоступен, используется SQLite.
+    """
+
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'redis':
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+
+            return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_STATE_TTL, data_ttl=FSM_STATE_TTL)
+        except Exception as e:
+            logging.error(f"Не удалось подключить Redis для FSM, используется SQLite: {e}")
+    return SQLiteStorage()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+# Режим получения обновлений: 'polling' (по умолчанию) или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес сервера, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', 32))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', 10))
+# Файл, в который записываются входящие обновления (JSON Lines) для воспроизведения app/utils/replay.py
+WEBHOOK_RECORD_FILE = os.getenv('WEBHOOK_RECORD_FILE')
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с ограничением числа одновременно обрабатываемых обновлений.
+
+    Telegram получает ответ сразу, а обновление обрабатывается в фоне. Если заняты все
+    max_concurrency слотов, ответ на запрос задерживается до освобождения слота, поэтому
+    при всплеске нагрузки Telegram притормаживает доставку, а не копит задачи в памяти.
+    Проверка секретного токена (заголовок X-Telegram-Bot-Api-Secret-Token) выполняется
+    базовым классом.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY,
+                 shutdown_timeout: float = WEBHOOK_SHUTDOWN_TIMEOUT, record_file: str | None = WEBHOOK_RECORD_FILE,
+                 **kwargs):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.shutdown_timeout = shutdown_timeout
+        self.record_file = record_file
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if self.record_file:
+            self._record(update)
+
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._bounded_feed_update(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _bounded_feed_update(self, bot: Bot, update: dict):
+        try:
+            await self._background_feed_update(bot, update)
+        except Exception as e:
+            logging.error(f"Ошибка при обработке обновления из вебхука: {e}")
+        finally:
+            self.semaphore.release()
+
+    def _record(self, update: dict):
+        try:
+            with open(self.record_file, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(update, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logging.error(f"Ошибка при записи обновления в {self.record_file}: {e}")
+
+    async def close(self):
+        """
+        Дожидается обработки уже принятых обновлений (не дольше shutdown_timeout секунд)
+        и закрывает сессию бота.
+        """
+
+        pending = list(self._background_feed_update_tasks)
+        if pending:
+            logging.info(f"Ожидание обработки {len(pending)} обновлений перед остановкой.")
+            done, not_done = await asyncio.wait(pending, timeout=self.shutdown_timeout)
+            for task in not_done:
+                task.cancel()
+        await super().close()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Запускает приём обновлений через вебхук на встроенном сервере aiohttp
+    и работает до сигнала остановки (SIGINT / SIGTERM) или отмены задачи.
+
+    При запуске регистрирует вебхук в Telegram с секретным токеном и только теми типами
+    обновлений, которые есть в обработчиках. При остановке сервер перестаёт принимать
+    запросы, дожидается обработки принятых обновлений и закрывает сессию бота.
+    Вебхук при остановке не удаляется: Telegram копит обновления до следующего запуска.
+    """
+
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook необходимо задать WEBHOOK_URL")
+
+    async def on_startup(bot: Bot):
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONCURRENCY,
+        )
+        logging.info(f"Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+    dp.startup.register(on_startup)
+
+    app = web.Application()
+    BoundedRequestHandler(dp, bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logging.info(f"Webhook server is listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка по KeyboardInterrupt
+
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Webhook server is shutting down.")
+        await runner.cleanup()
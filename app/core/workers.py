@@ -0,0 +1,404 @@
+"""
+workers.py
+
+Режим нескольких процессов (BOT_WORKERS > 0).
+
+Процесс приёма (main.py) получает обновления через polling или вебхук и ничего не обрабатывает
+сам: ShardingMiddleware раскладывает их по очередям BOT_WORKERS процессов-обработчиков
+по user_id (user_id % BOT_WORKERS). Обновления одного пользователя всегда попадают в один
+процесс и обрабатываются в нём по порядку, поэтому состояние FSM и порядок ответов
+сохраняются, а рендеринг, поиск и запись логов распределяются по ядрам.
+
+Каталог из Google Таблиц загружает только процесс приёма (по расписанию и по /update_data);
+после каждого обновления обработчики перечитывают снимок из базы каталога и держат свою копию.
+Статистику поиска и оценки популярности ведёт тоже только процесс приёма: обработчики
+передают ему события (log_event) пачками вместе с пульсом, а он рассылает им порядок
+"популярные сначала" вместе с обновлением каталога и после каждого пересчёта.
+Обработчики раз в WORKER_HEARTBEAT_INTERVAL секунд сообщают о себе; упавший или зависший
+процесс перезапускается. При остановке процесс приёма перестаёт получать обновления,
+обработчики дорабатывают свои очереди (не дольше WORKER_DRAIN_TIMEOUT секунд) и сохраняют данные.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 0))
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 16))  # одновременно обрабатываемых обновлений в процессе
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', 5))
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT', 30))
+WORKER_START_TIMEOUT = float(os.getenv('WORKER_START_TIMEOUT', 120))  # на запуск процесса до первого пульса
+WORKER_DRAIN_TIMEOUT = float(os.getenv('WORKER_DRAIN_TIMEOUT', 15))
+
+# Очередь сообщений процессу приёма: задаётся в процессе-обработчике
+_status_queue = None
+
+
+def shard_for(user_id: int | None, workers: int) -> int:
+    """
+    Номер процесса-обработчика для пользователя.
+    """
+
+    return (user_id or 0) % workers
+
+
+def request_catalog_update() -> bool:
+    """
+    В процессе-обработчике просит процесс приёма обновить каталог.
+
+    :return: True, если запрос отправлен, False - если это не процесс-обработчик.
+    """
+
+    if _status_queue is None:
+        return False
+    _status_queue.put(("populate", None, None))
+    return True
+
+
+class ShardingMiddleware(BaseMiddleware):
+    """
+    Outer middleware обновлений в процессе приёма: передаёт обновление в очередь процесса-обработчика
+    пользователя вместо обработки.
+    """
+
+    def __init__(self, pool: "WorkerPool"):
+        self.pool = pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        self.pool.dispatch(event, user.id if user else None)
+        return None
+
+
+class WorkerPool:
+    """
+    Процессы-обработчики с очередью обновлений у каждого и общей очередью сообщений
+    (пульс, события для статистики, запросы обновления каталога, остановка).
+    """
+
+    def __init__(self, workers: int = BOT_WORKERS):
+        self.workers = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue() for _ in range(workers)]
+        self.status = self.context.Queue()
+        self.processes: list[multiprocessing.Process | None] = [None] * workers
+        self.heartbeats: dict[int, tuple[float, dict]] = {}
+        self.ready: set[int] = set()
+        self.dispatched = [0] * workers
+        self.restarts = 0
+        self.popularity: dict[str, float] = {}  # последние разосланные оценки популярности
+        self.stopping = False
+        self._monitor: asyncio.Task | None = None
+
+    def _spawn(self, shard: int):
+        process = self.context.Process(
+            target=run_worker, args=(shard, self.workers, self.queues[shard], self.status),
+            name=f"bot-worker-{shard}",
+        )
+        process.start()
+        if self.popularity:
+            # Обработчик прочитает их после загрузки каталога
+            self.queues[shard].put(("popularity", None, self.popularity))
+        self.processes[shard] = process
+        self.heartbeats[shard] = (time.monotonic(), {})
+        self.ready.discard(shard)
+        logging.info(f"Worker {shard} started (pid {process.pid})")
+
+    def start(self):
+        """
+        Запускает процессы-обработчики и наблюдение за ними.
+        """
+
+        for shard in range(self.workers):
+            self._spawn(shard)
+        self._monitor = asyncio.create_task(self._run_monitor())
+
+    def dispatch(self, update: Update, user_id: int | None):
+        shard = shard_for(user_id, self.workers)
+        self.queues[shard].put(("update", user_id, update.model_dump_json(exclude_unset=True)))
+        self.dispatched[shard] += 1
+
+    def broadcast_catalog(self, popularity: dict[str, float] | None = None):
+        """
+        Просит все процессы-обработчики перечитать снимок каталога из базы.
+
+        :param popularity: Оценки популярности вейпов для нового снимка {ключ вейпа: оценка}.
+        """
+
+        if popularity:
+            self.popularity = popularity
+        for worker_queue in self.queues:
+            worker_queue.put(("catalog", None, popularity))
+
+    def broadcast_popularity(self, popularity: dict[str, float]):
+        """
+        Рассылает процессам-обработчикам пересчитанные оценки популярности вейпов.
+        """
+
+        self.popularity = popularity
+        for worker_queue in self.queues:
+            worker_queue.put(("popularity", None, popularity))
+
+    def health(self) -> dict:
+        """
+        Состояние процессов: жив ли процесс, давность пульса, переданные и обработанные обновления.
+        """
+
+        now = time.monotonic()
+        return {
+            shard: {
+                "alive": process is not None and process.is_alive(),
+                "ready": shard in self.ready,
+                "heartbeat_age": round(now - self.heartbeats.get(shard, (now, {}))[0], 1),
+                "dispatched": self.dispatched[shard],
+                **self.heartbeats.get(shard, (now, {}))[1],
+            }
+            for shard, process in enumerate(self.processes)
+        }
+
+    def _read_status(self):
+        """
+        Разбирает накопившиеся сообщения процессов-обработчиков.
+        """
+
+        from app.utils.logger import notify_event_listeners
+        from app.utils.schedule import populate_database_task
+
+        while True:
+            try:
+                kind, shard, payload = self.status.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "heartbeat":
+                self.heartbeats[shard] = (time.monotonic(), payload)
+                self.ready.add(shard)
+            elif kind == "events":
+                for user_id, action_type, fields in payload:
+                    notify_event_listeners(user_id, action_type, fields)
+            elif kind == "populate" and not self.stopping:
+                asyncio.create_task(populate_database_task())
+
+    async def _run_monitor(self):
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            self._read_status()
+
+            if self.stopping:
+                continue
+            now = time.monotonic()
+            for shard, process in enumerate(self.processes):
+                timeout = WORKER_HEARTBEAT_TIMEOUT if shard in self.ready else WORKER_START_TIMEOUT
+                stale = now - self.heartbeats.get(shard, (now, {}))[0] > timeout
+                if process.is_alive() and not stale:
+                    continue
+                logging.error(f"Worker {shard} is {'not responding' if process.is_alive() else 'dead'} "
+                              f"(exit code {process.exitcode}), restarting")
+                if process.is_alive():
+                    process.kill()
+                    process.join(1)
+                self.restarts += 1
+                self._spawn(shard)
+
+            if now - last_report >= 60:
+                last_report = now
+                logging.info(f"Workers: {self.health()}")
+
+    async def stop(self, timeout: float = WORKER_DRAIN_TIMEOUT):
+        """
+        Дожидается, пока процессы-обработчики доработают свои очереди, и останавливает их.
+        """
+
+        self.stopping = True
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for shard, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - loop.time()))
+            if process.is_alive():
+                logging.error(f"Worker {shard} did not stop in {timeout} s, terminating")
+                process.terminate()
+                await loop.run_in_executor(None, process.join, 5)
+
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+        self._read_status()  # События, переданные обработчиками перед остановкой
+        logging.info("All workers stopped.")
+
+
+def run_worker(shard: int, workers: int, updates, status):
+    """
+    Точка входа процесса-обработчика.
+    """
+
+    # Ctrl+C получает вся группа процессов: остановкой обработчиков управляет процесс приёма
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_shard(shard, workers, updates, status))
+
+
+async def _serve_shard(shard: int, workers: int, updates, status):
+    """
+    Обработка обновлений одного шарда: та же инициализация, что и в однопроцессном режиме,
+    но каталог читается из базы, а обновления - из очереди процесса приёма.
+    """
+
+    global _status_queue
+    _status_queue = status
+
+    from app.core.core import bot, dp
+    from app.core.handlers import router
+    from app.core.middlewares import HandlerMetricsMiddleware, UserTrackingMiddleware, update_throttle, user_tracker
+    from app.core.readiness import CatalogReadinessMiddleware
+    from app.core.sender import SENDER_GLOBAL_RATE, outbound_sender
+    from app.core.storage import SQLiteStorage
+    from app.database.catalog import get_catalog
+    from app.database.requests import load_catalog_from_database
+    from app.utils.logger import log_sink, set_event_listeners
+    from app.utils.metrics import METRICS_PORT, start_metrics_server
+    from app.utils.schedule import POPULARITY_REFRESH_MINUTES
+    from app.utils.search_stats import search_stats
+    from app.utils.notifications import subscriptions
+
+    # Статистику поиска и популярность ведёт процесс приёма по событиям всех шардов:
+    # здесь события только копятся и уходят ему с пульсом
+    events: list[tuple[int | None, str, dict]] = []
+    set_event_listeners([lambda user_id, action_type, fields: events.append((user_id, action_type, fields))])
+
+    def send_events():
+        if events:
+            status.put(("events", shard, events[:]))
+            events.clear()
+
+    def apply_popularity(scores: dict[str, float] | None):
+        catalog = get_catalog()
+        if scores and catalog is not None:
+            catalog.set_popularity(scores)
+
+    log_sink.start()
+    # У каждого процесса свои метрики и свой порт: METRICS_PORT + 1 + номер процесса
+    metrics_server = await start_metrics_server(METRICS_PORT + 1 + shard) if METRICS_PORT else None
+    # Общий лимит бота делится поровну между обработчиками и процессом приёма, который рассылает уведомления.
+    # Лимит на чат соблюдается только внутри процесса: уведомление и ответ обработчика в один чат считаются отдельно
+    outbound_sender.global_rate = SENDER_GLOBAL_RATE / (workers + 1)
+    bot.session.middleware(outbound_sender)
+    outbound_sender.start()
+    await user_tracker.load_known_users()
+    user_tracker.start()
+    if isinstance(dp.storage, SQLiteStorage):
+        dp.storage.start()
+    await search_stats.load()  # Для /search_stats; перечитывается каждые POPULARITY_REFRESH_MINUTES минут
+    await subscriptions.load()
+
+    dp.message.outer_middleware(UserTrackingMiddleware())
+    dp.callback_query.outer_middleware(UserTrackingMiddleware())
+    router.message.middleware(HandlerMetricsMiddleware())
+    router.callback_query.middleware(HandlerMetricsMiddleware())
+    router.inline_query.middleware(HandlerMetricsMiddleware())
+    router.message.middleware(CatalogReadinessMiddleware())
+    router.callback_query.middleware(CatalogReadinessMiddleware())
+    dp.include_router(router)
+
+    await load_catalog_from_database()
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    user_locks: dict[int | None, asyncio.Lock] = {}
+    user_pending: dict[int | None, int] = {}
+    tasks: set[asyncio.Task] = set()
+    processed = 0
+
+    async def process(user_id: int | None, update: Update):
+        nonlocal processed
+        # Лимит частоты и склейка повторных нажатий проверяются до очереди пользователя:
+        # повтор нажатия, которое ещё ждёт своей очереди или обрабатывается, не обрабатывается
+        throttled = user_id is not None and (update.message or update.callback_query) is not None
+        if throttled and update_throttle.admit(user_id, update) is not None:
+            await update_throttle.reject(update)
+            semaphore.release()
+            return
+
+        lock = user_locks.setdefault(user_id, asyncio.Lock())
+        user_pending[user_id] = user_pending.get(user_id, 0) + 1
+        try:
+            # Блокировка честная (FIFO): обновления пользователя обрабатываются в порядке получения
+            async with lock:
+                await dp.feed_update(bot, update)
+        except Exception as e:
+            logging.error(f"Worker {shard}: error while processing update {update.update_id}: {e}")
+        finally:
+            if throttled:
+                update_throttle.release(user_id, update)
+            processed += 1
+            user_pending[user_id] -= 1
+            if not user_pending[user_id]:
+                del user_pending[user_id]
+                del user_locks[user_id]
+            semaphore.release()
+
+    async def heartbeat():
+        next_refresh = loop.time() + POPULARITY_REFRESH_MINUTES * 60
+        while True:
+            send_events()
+            status.put(("heartbeat", shard, {"pid": os.getpid(), "processed": processed, "in_flight": len(tasks),
+                                             "throttled": update_throttle.metrics["throttled"],
+                                             "coalesced": update_throttle.metrics["coalesced"]}))
+            if loop.time() >= next_refresh:
+                next_refresh = loop.time() + POPULARITY_REFRESH_MINUTES * 60
+                await search_stats.load()
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    logging.info(f"Worker {shard} is ready.")
+
+    try:
+        while True:
+            message = await loop.run_in_executor(None, updates.get)
+            if message is None:
+                break
+            kind, user_id, payload = message
+            if kind == "catalog":
+                await load_catalog_from_database()
+                apply_popularity(payload)
+                continue
+            if kind == "popularity":
+                apply_popularity(payload)
+                continue
+
+            await semaphore.acquire()
+            update = Update.model_validate_json(payload, context={"bot": bot})
+            task = asyncio.create_task(process(user_id, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        logging.info(f"Worker {shard} is draining {len(tasks)} updates.")
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    finally:
+        heartbeat_task.cancel()
+        await outbound_sender.stop()
+        await user_tracker.stop()
+        await dp.storage.close()
+        send_events()
+        await log_sink.stop()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await bot.session.close()
+        logging.info(f"Worker {shard} stopped, processed {processed} updates.")
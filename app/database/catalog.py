@@ -0,0 +1,705 @@
+"""
+catalog.py
+
+Снимок каталога в памяти, который строится при каждом обновлении данных из Google Таблиц.
+Используется для запросов, которые неудобно или дорого выполнять через SQL, например
+комбинированного поиска по нескольким тегам.
+
+Теги каждого вейпа кодируются битовой маской (бит tag_id - 1), поэтому любая комбинация
+условий И / ИЛИ / НЕ вычисляется побитовыми операциями над одним массивом без join'ов
+по таблице vapes_tags.
+
+Цена, бренд и наличие хранятся в колоночном виде (массивы NumPy), поэтому любая
+комбинация фильтров — это векторная маска по всему каталогу.
+
+Порядки сортировки (цена, название, новизна) вычисляются один раз при сборке снимка:
+для брендов и тегов хранятся готовые перестановки, а для произвольной маски
+(поиск по вкусу, фильтры) берётся подпоследовательность глобальной перестановки.
+Поэтому смена сортировки или страницы никогда не сортирует данные во время запроса.
+
+Для каждого вейпа при сборке снимка вычисляются ближайшие соседи ("Похожие"): косинусная
+близость по тегам с весами IDF (редкий общий тег значит больше частого) плюс бонус за общий
+бренд. Близость считается матричным умножением матрицы вейп x тег блоками строк, поэтому
+выдача похожих — это чтение готового списка, без попарных сравнений во время запроса.
+
+Для inline-поиска при сборке снимка строится префиксный индекс слов названий и брендов:
+первые PREFIX_INDEX_LENGTH символов слова -> массив индексов вейпов, поэтому поиск по началу
+слов — это пересечение нескольких готовых массивов.
+
+Порядок "популярные сначала" строится по оценкам популярности (app/utils/popularity.py),
+которые пересчитываются в фоне и передаются в снимок через set_popularity.
+"""
+
+import hashlib
+import itertools
+import logging
+import re
+import time
+
+import numpy as np
+
+from base64 import urlsafe_b64encode
+from typing import Callable, NamedTuple
+
+from app.database.rows import VapeRow, TagRow
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+MAX_TAGS = 64
+
+# Биты наличия: (в наличии / под заказ) x (20 MG / 45, 50, 60 MG)
+ON_HAND_20 = 1
+ON_HAND_45 = 2
+TO_ORDER_20 = 4
+TO_ORDER_45 = 8
+
+# Коды крепости в фильтрах: 0 - любая, 1 - 20 MG, 2 - 45, 50, 60 MG
+STRENGTH_ANY = 0
+STRENGTH_20 = 1
+STRENGTH_45_50_60 = 2
+
+AVAILABILITY_BITS = {
+    ('on_hand', STRENGTH_ANY): ON_HAND_20 | ON_HAND_45,
+    ('on_hand', STRENGTH_20): ON_HAND_20,
+    ('on_hand', STRENGTH_45_50_60): ON_HAND_45,
+    ('to_order', STRENGTH_ANY): TO_ORDER_20 | TO_ORDER_45,
+    ('to_order', STRENGTH_20): TO_ORDER_20,
+    ('to_order', STRENGTH_45_50_60): TO_ORDER_45,
+}
+
+# Коды сортировки: a - цена по возрастанию, d - цена по убыванию, n - название, r - новые сначала,
+# p - популярные сначала. None - порядок каталога (как в таблице).
+SORT_ORDERS = ('a', 'd', 'n', 'r', 'p')
+
+# Похожие вейпы: сколько соседей хранить, бонус за общий бренд и размер блока строк
+SIMILAR_VAPES_COUNT = 5
+SIMILAR_BRAND_BONUS = 0.2
+SIMILARITY_BLOCK_SIZE = 512
+
+# Префиксный индекс для inline-поиска: длина префикса слова в индексе
+PREFIX_INDEX_LENGTH = 4
+WORD_PATTERN = re.compile(r"\w+")
+
+# Номер снимка: меняется при каждой сборке, используется как версия каталога в кэшах
+_snapshot_versions = itertools.count(1)
+
+
+def key_token(key: str) -> str:
+    """
+    Короткий токен стабильного ключа (вейпа, бренда или тега) для callback-данных.
+
+    ID вейпов, брендов и тегов назначаются по порядку строк при каждом парсинге, поэтому кнопка
+    со старым ID после обновления таблицы указала бы на другой товар. Ключ может не поместиться
+    в 64 байта, поэтому в кнопку записывается его хеш; токен одного ключа одинаков во всех
+    процессах и после перезапуска.
+    """
+
+    digest = hashlib.blake2b(key.encode(), digest_size=9).digest()
+    return urlsafe_b64encode(digest).decode()
+
+
+def search_words(text: str) -> list[str]:
+    """
+    Слова текста для префиксного поиска: нижний регистр, "ё" -> "е".
+    """
+
+    return WORD_PATTERN.findall(text.lower().replace("ё", "е"))
+
+
+class CatalogChange(NamedTuple):
+    """
+    Изменение вейпа между двумя снимками каталога.
+    """
+
+    vape: VapeRow
+    key: str
+    brand_name: str
+    tag_names: list[str]
+    restocked: bool
+    old_price: float | None
+    new_price: float
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога вейпов.
+
+    Строки вейпов хранятся в списке vapes, а все вычисляемые признаки — в массивах NumPy
+    той же длины (индекс в массиве совпадает с индексом в vapes).
+    """
+
+    def __init__(self, vapes: list[VapeRow], tags: list[TagRow], vape_tags: dict[int, list[int]],
+                 brand_names: dict[int, str], first_seen: dict[str, float] | None = None,
+                 popularity: dict[str, float] | None = None):
+        """
+        :param vapes: Список вейпов каталога.
+        :param tags: Список всех тегов.
+        :param vape_tags: Словарь {vape_id: [tag_id, ...]}.
+        :param brand_names: Словарь {brand_id: name}.
+        :param first_seen: Известное время первого появления вейпов {ключ вейпа: timestamp}.
+        :param popularity: Оценки популярности вейпов из предыдущего снимка {ключ вейпа: оценка}.
+        """
+
+        if len(tags) > MAX_TAGS:
+            raise ValueError(f"Слишком много тегов для битовой маски: {len(tags)} > {MAX_TAGS}")
+
+        self.version = next(_snapshot_versions)
+        self.vapes = vapes
+        self.tags = tags
+        self.tag_names = {tag.id: tag.name for tag in tags}
+        self.brand_names = brand_names
+        self.index_by_id = {vape.id: index for index, vape in enumerate(vapes)}
+
+        self.tag_bits = np.zeros(len(vapes), dtype=np.uint64)
+        for index, vape in enumerate(vapes):
+            mask = 0
+            for tag_id in vape_tags.get(vape.id, ()):
+                mask |= 1 << (tag_id - 1)
+            self.tag_bits[index] = mask
+
+        self.price = np.array([vape.price for vape in vapes], dtype=np.float64)
+        self.brand_id = np.array([vape.brand_id for vape in vapes], dtype=np.int32)
+        self.availability = np.array([_availability_bits(vape) for vape in vapes], dtype=np.uint8)
+
+        # Те же условия, что availability_condition_on_hand / _to_order в requests.py
+        self.in_stock = {
+            search_in: (self.availability & AVAILABILITY_BITS[(search_in, STRENGTH_ANY)]) != 0
+            for search_in in ('on_hand', 'to_order')
+        }
+
+        self.names_lower = [vape.name.lower() for vape in vapes]
+        self.keys = [self.vape_key(vape) for vape in vapes]
+        self.index_by_token = {key_token(key): index for index, key in enumerate(self.keys)}
+
+        # Время первого появления берётся из основной базы и предыдущего снимка, новые вейпы получают текущее
+        now = time.time()
+        previous_first_seen = first_seen or {}
+        self.first_seen = {key: previous_first_seen.get(key, now) for key in self.keys}
+        self.popularity = dict(popularity or {})
+
+        self._build_orders()
+        self._build_similar()
+        self._build_prefix_index()
+
+    def vape_key(self, vape: VapeRow) -> str:
+        """
+        Стабильный между обновлениями ключ вейпа: ID пересоздаются при каждом парсинге,
+        а пара (бренд, вкус) — нет.
+        """
+
+        return f"{self.brand_names.get(vape.brand_id, '')}|{vape.name}".upper()
+
+    def target_key(self, kind: str, target_id: int) -> str | None:
+        """
+        Стабильный ключ вейпа, бренда или тега по ID в этом снимке.
+
+        :param kind: 'vape', 'brand' или 'tag'.
+        :param target_id: ID вейпа, бренда или тега.
+        :return: Ключ вейпа, название бренда в верхнем регистре или название тега; None, если ID нет в снимке.
+        """
+
+        if kind == "vape":
+            index = self.index_by_id.get(target_id)
+            return self.keys[index] if index is not None else None
+        if kind == "brand":
+            name = self.brand_names.get(target_id)
+            return name.upper() if name else None
+        if kind == "tag":
+            return self.tag_names.get(target_id)
+        return None
+
+    def target_token(self, kind: str, target_id: int) -> str | None:
+        """
+        Токен стабильного ключа вейпа, бренда или тега по ID для callback-данных (см. key_token).
+        """
+
+        key = self.target_key(kind, target_id)
+        return key_token(key) if key is not None else None
+
+    def target_by_token(self, kind: str, token: str) -> str | None:
+        """
+        Стабильный ключ вейпа, бренда или тега по токену из callback-данных.
+
+        :param kind: 'vape', 'brand' или 'tag'.
+        :param token: Токен ключа (см. key_token).
+        :return: Ключ или None, если цели с таким ключом в снимке нет.
+        """
+
+        if kind == "vape":
+            index = self.index_by_token.get(token)
+            return self.keys[index] if index is not None else None
+        if kind == "brand":
+            names = (name.upper() for name in self.brand_names.values())
+        elif kind == "tag":
+            names = self.tag_names.values()
+        else:
+            return None
+        return next((name for name in names if key_token(name) == token), None)
+
+    def vape_id_by_token(self, token: str) -> int | None:
+        """
+        ID вейпа в этом снимке по токену его стабильного ключа (см. key_token).
+        """
+
+        index = self.index_by_token.get(token)
+        return self.vapes[index].id if index is not None else None
+
+    def _build_orders(self):
+        """
+        Предвычисление перестановок для всех порядков сортировки: глобальных
+        и для каждого бренда и тега в обеих категориях наличия.
+        """
+
+        ids = self._ids()
+        first_seen = np.array([self.first_seen[key] for key in self.keys], dtype=np.float64)
+        name_rank = np.empty(len(self.vapes), dtype=np.int64)
+        name_rank[sorted(range(len(self.vapes)), key=lambda index: self.names_lower[index])] = np.arange(len(self.vapes))
+
+        # np.lexsort сортирует по последнему ключу, остальные ключи разрешают равенство
+        self.sort_orders = {
+            None: np.argsort(ids, kind='stable'),
+            'a': np.lexsort((ids, self.price)),
+            'd': np.lexsort((ids, -self.price)),
+            'n': np.lexsort((ids, name_rank)),
+            'r': np.lexsort((ids, -first_seen)),
+            'p': self._popularity_order(),
+        }
+
+        self.context_orders = {}
+        for search_in, in_stock in self.in_stock.items():
+            for brand_id in self.brand_names:
+                self._add_context_orders(('brand', brand_id, search_in), in_stock & (self.brand_id == brand_id))
+            for tag in self.tags:
+                tag_bit = np.uint64(1 << (tag.id - 1))
+                self._add_context_orders(('tag', tag.id, search_in), in_stock & ((self.tag_bits & tag_bit) != 0))
+
+    def _add_context_orders(self, context: tuple, mask: np.ndarray):
+        """
+        Сохраняет отсортированные индексы вейпов контекста для каждого порядка сортировки.
+        """
+
+        for sort, order in self.sort_orders.items():
+            self.context_orders[context + (sort,)] = order[mask[order]]
+
+    def _build_similar(self, count: int = SIMILAR_VAPES_COUNT):
+        """
+        Предвычисление похожих вейпов для каждой категории наличия.
+
+        Строки матрицы вейп x тег взвешиваются по IDF и нормируются, поэтому произведение
+        блока строк на транспонированную матрицу даёт косинусную близость блока со всеми
+        вейпами. К ней добавляется бонус за общий бренд, и для каждой строки берутся count
+        лучших соседей в наличии (argpartition, без полной сортировки).
+        Результат: self.similar[search_in] — массив индексов размера len(vapes) x count,
+        недостающие соседи заполнены -1.
+        """
+
+        size = len(self.vapes)
+        self.similar = {search_in: np.full((size, count), -1, dtype=np.int32) for search_in in self.in_stock}
+        if size < 2:
+            return
+
+        bits = np.arange(MAX_TAGS, dtype=np.uint64)
+        matrix = ((self.tag_bits[:, None] >> bits) & np.uint64(1)).astype(np.float32)
+        frequency = matrix.sum(axis=0)
+        idf = np.where(frequency > 0, np.log((size + 1) / (frequency + 1)) + 1, 0).astype(np.float32)
+        weighted = matrix * idf
+        norms = np.linalg.norm(weighted, axis=1)
+        weighted /= np.where(norms > 0, norms, 1)[:, None]
+
+        top = min(count, size - 1)
+        for start in range(0, size, SIMILARITY_BLOCK_SIZE):
+            stop = min(start + SIMILARITY_BLOCK_SIZE, size)
+            scores = weighted[start:stop] @ weighted.T
+            scores += SIMILAR_BRAND_BONUS * (self.brand_id[start:stop, None] == self.brand_id[None, :])
+            scores[np.arange(stop - start), np.arange(start, stop)] = 0  # Сам вейп не сосед себе
+
+            for search_in, in_stock in self.in_stock.items():
+                candidates = np.where(in_stock[None, :], scores, 0)
+                best = np.argpartition(-candidates, top - 1, axis=1)[:, :top]
+                best_scores = np.take_along_axis(candidates, best, axis=1)
+                order = np.argsort(-best_scores, axis=1, kind='stable')
+                best = np.take_along_axis(best, order, axis=1)
+                best_scores = np.take_along_axis(best_scores, order, axis=1)
+                self.similar[search_in][start:stop, :top] = np.where(best_scores > 0, best, -1)
+
+    def search_similar(self, vape_id: int, search_in: str, sort: str | None = None) -> list[VapeRow]:
+        """
+        Похожие вейпы в заданной категории наличия.
+
+        :param vape_id: Идентификатор вейпа.
+        :param search_in: Где искать ('on_hand' - в наличии, 'to_order' - под заказ).
+        :param sort: Код сортировки из SORT_ORDERS или None - сначала самые похожие.
+        :return: Список вейпов (пустой, если вейпа нет в снимке).
+        """
+
+        index = self.index_by_id.get(vape_id)
+        if index is None:
+            return []
+        neighbors = self.similar[search_in][index]
+        neighbors = neighbors[neighbors >= 0]
+        if sort not in SORT_ORDERS:
+            return [self.vapes[neighbor] for neighbor in neighbors]
+
+        mask = np.zeros(len(self.vapes), dtype=bool)
+        mask[neighbors] = True
+        return self.ordered(mask, sort)
+
+    def diff(self, previous: "CatalogSnapshot") -> list[CatalogChange]:
+        """
+        Изменения относительно предыдущего снимка: вейпы, появившиеся в наличии
+        (включая новые), и вейпы с изменившейся ценой. Сравнение векторное, по ключам вейпов.
+
+        :param previous: Предыдущий снимок каталога.
+        :return: Список изменений.
+        """
+
+        previous_index = {key: index for index, key in enumerate(previous.keys)}
+        positions = np.array([previous_index.get(key, -1) for key in self.keys], dtype=np.int64)
+        existed = positions >= 0
+
+        was_on_hand = np.zeros(len(self.vapes), dtype=bool)
+        was_on_hand[existed] = previous.in_stock['on_hand'][positions[existed]]
+        restocked = self.in_stock['on_hand'] & ~was_on_hand
+
+        old_price = np.full(len(self.vapes), np.nan)
+        old_price[existed] = previous.price[positions[existed]]
+        available = self.in_stock['on_hand'] | self.in_stock['to_order']
+        repriced = existed & available & ~np.isclose(self.price, old_price)
+
+        changes = []
+        for index in np.flatnonzero(restocked | repriced):
+            vape = self.vapes[index]
+            bits = int(self.tag_bits[index])
+            changes.append(CatalogChange(
+                vape=vape,
+                key=self.keys[index],
+                brand_name=self.brand_names.get(vape.brand_id, ''),
+                tag_names=[tag.name for tag in self.tags if bits & (1 << (tag.id - 1))],
+                restocked=bool(restocked[index]),
+                old_price=float(old_price[index]) if existed[index] else None,
+                new_price=float(self.price[index]),
+            ))
+        return changes
+
+    def _ids(self) -> np.ndarray:
+        return np.array([vape.id for vape in self.vapes], dtype=np.int64)
+
+    def _popularity_order(self) -> np.ndarray:
+        """
+        Перестановка "популярные сначала"; при равных оценках - порядок каталога.
+        """
+
+        scores = np.array([self.popularity.get(key, 0.0) for key in self.keys], dtype=np.float64)
+        return np.lexsort((self._ids(), -scores))
+
+    def set_popularity(self, popularity: dict[str, float]):
+        """
+        Заменяет оценки популярности и пересчитывает порядок 'p' — глобальный и для каждого
+        бренда и тега. Состав контекстов берётся из уже готовых перестановок порядка каталога.
+
+        :param popularity: Оценки популярности {ключ вейпа: оценка}.
+        """
+
+        self.popularity = dict(popularity)
+        order = self._popularity_order()
+
+        context_orders = {}
+        for context, members in self.context_orders.items():
+            if context[-1] is not None:
+                continue
+            mask = np.zeros(len(self.vapes), dtype=bool)
+            mask[members] = True
+            context_orders[context[:-1] + ('p',)] = order[mask[order]]
+
+        # Обновляем готовыми объектами, чтобы запросы не видели наполовину пересчитанный порядок
+        self.context_orders.update(context_orders)
+        self.sort_orders['p'] = order
+
+    def ordered(self, mask: np.ndarray, sort: str | None = None) -> list[VapeRow]:
+        """
+        Вейпы по маске в заданном порядке: подпоследовательность предвычисленной
+        перестановки, без сортировки во время запроса.
+        """
+
+        order = self.sort_orders[sort if sort in SORT_ORDERS else None]
+        return [self.vapes[index] for index in order[mask[order]]]
+
+    def listing(self, context_type: str, context_id: int, search_in: str, sort: str | None = None) -> list[VapeRow]:
+        """
+        Готовый отсортированный список вейпов бренда или тега.
+
+        :param context_type: 'brand' или 'tag'.
+        :param context_id: Идентификатор бренда или тега.
+        :param search_in: Где искать ('on_hand' - в наличии, 'to_order' - под заказ).
+        :param sort: Код сортировки из SORT_ORDERS или None.
+        :return: Список вейпов.
+        """
+
+        order = self.context_orders.get((context_type, context_id, search_in, sort if sort in SORT_ORDERS else None))
+        if order is None:
+            return []
+        return [self.vapes[index] for index in order]
+
+    def flavor_mask(self, flavor: str) -> np.ndarray:
+        """
+        Маска вейпов, в названии которых встречается вкус (по первым 4 символам, без учёта регистра).
+        """
+
+        needle = flavor.lower()[:4]
+        return np.fromiter((needle in name for name in self.names_lower), dtype=bool, count=len(self.names_lower))
+
+    def search_by_flavor(self, flavor: str, search_in: str, sort: str | None = None) -> list[VapeRow]:
+        """
+        Поиск вейпов по вкусу с учётом наличия.
+        """
+
+        return self.ordered(self.flavor_mask(flavor) & self.in_stock[search_in], sort)
+
+    def sold_out_by_flavor(self, flavor: str, search_in: str, sort: str | None = None) -> list[VapeRow]:
+        """
+        Вейпы со вкусом, которых нет ни в наличии, ни в выбранной категории: на них можно
+        подписаться, чтобы узнать о появлении в наличии (см. diff).
+        """
+
+        available = self.in_stock['on_hand'] | self.in_stock[search_in]
+        return self.ordered(self.flavor_mask(flavor) & ~available, sort)
+
+    def _build_prefix_index(self):
+        """
+        Префиксный индекс: для каждого слова названия и бренда вейпа - все его префиксы
+        длиной до PREFIX_INDEX_LENGTH символов -> отсортированный массив индексов вейпов.
+        """
+
+        self.words = [
+            search_words(f"{vape.name} {self.brand_names.get(vape.brand_id, '')}") for vape in self.vapes
+        ]
+        postings: dict[str, set[int]] = {}
+        for index, words in enumerate(self.words):
+            for word in words:
+                for length in range(1, min(len(word), PREFIX_INDEX_LENGTH) + 1):
+                    postings.setdefault(word[:length], set()).add(index)
+        self.prefix_index = {
+            prefix: np.array(sorted(indices), dtype=np.int64) for prefix, indices in postings.items()
+        }
+
+    def prefix_mask(self, query: str) -> np.ndarray:
+        """
+        Маска вейпов, у которых каждое слово запроса - начало какого-либо слова названия или бренда.
+        Пустой запрос подходит ко всем вейпам.
+        """
+
+        mask = np.ones(len(self.vapes), dtype=bool)
+        for query_word in search_words(query):
+            candidates = self.prefix_index.get(query_word[:PREFIX_INDEX_LENGTH])
+            if candidates is None:
+                return np.zeros(len(self.vapes), dtype=bool)
+            if len(query_word) > PREFIX_INDEX_LENGTH:
+                candidates = np.array([
+                    index for index in candidates
+                    if any(word.startswith(query_word) for word in self.words[index])
+                ], dtype=np.int64)
+            word_mask = np.zeros(len(self.vapes), dtype=bool)
+            word_mask[candidates] = True
+            mask &= word_mask
+        return mask
+
+    def search_by_prefix(self, query: str, search_in: str = 'on_hand', sort: str | None = 'p') -> list[VapeRow]:
+        """
+        Поиск по началу слов названия и бренда с учётом наличия (для inline-режима),
+        по умолчанию популярные сначала.
+        """
+
+        return self.ordered(self.prefix_mask(query) & self.in_stock[search_in], sort)
+
+    def tags_mask(self, all_mask: int = 0, any_mask: int = 0, none_mask: int = 0) -> np.ndarray:
+        """
+        Булева маска вейпов, удовлетворяющих комбинации тегов.
+
+        :param all_mask: Теги, которые должны быть все (И).
+        :param any_mask: Теги, из которых нужен хотя бы один (ИЛИ).
+        :param none_mask: Теги, которых быть не должно (НЕ).
+        :return: Массив bool длины len(vapes).
+        """
+
+        bits = self.tag_bits
+        result = np.ones(len(bits), dtype=bool)
+        if all_mask:
+            required = np.uint64(all_mask)
+            result &= (bits & required) == required
+        if any_mask:
+            result &= (bits & np.uint64(any_mask)) != 0
+        if none_mask:
+            result &= (bits & np.uint64(none_mask)) == 0
+        return result
+
+    def search_by_tags(self, search_in: str, all_mask: int = 0, any_mask: int = 0,
+                       none_mask: int = 0, sort: str | None = None) -> list[VapeRow]:
+        """
+        Поиск вейпов по комбинации тегов с учётом наличия.
+
+        :param search_in: Где искать ('on_hand' - в наличии, 'to_order' - под заказ).
+        :param sort: Код сортировки из SORT_ORDERS или None.
+        :return: Список найденных вейпов.
+        """
+
+        mask = self.tags_mask(all_mask, any_mask, none_mask) & self.in_stock[search_in]
+        return self.ordered(mask, sort)
+
+    def count_by_tags(self, search_in: str, all_mask: int = 0, any_mask: int = 0, none_mask: int = 0) -> int:
+        """
+        Количество вейпов, подходящих под комбинацию тегов.
+        """
+
+        return int(np.count_nonzero(self.tags_mask(all_mask, any_mask, none_mask) & self.in_stock[search_in]))
+
+    def filter_mask(self, search_in: str, price_min: float | None = None, price_max: float | None = None,
+                    strength: int = STRENGTH_ANY, brand_id: int | None = None, tag_id: int | None = None) -> np.ndarray:
+        """
+        Булева маска вейпов, подходящих под комбинацию фильтров.
+
+        :param search_in: Где искать ('on_hand' - в наличии, 'to_order' - под заказ).
+        :param price_min: Минимальная цена включительно (None - без ограничения).
+        :param price_max: Верхняя граница цены, не включительно (None - без ограничения).
+        :param strength: Код крепости (STRENGTH_ANY, STRENGTH_20, STRENGTH_45_50_60).
+        :param brand_id: Идентификатор бренда (None - любой).
+        :param tag_id: Идентификатор тега (None - любой).
+        :return: Массив bool длины len(vapes).
+        """
+
+        mask = (self.availability & AVAILABILITY_BITS[(search_in, strength)]) != 0
+        if price_min is not None:
+            mask &= self.price >= price_min
+        if price_max is not None:
+            mask &= self.price < price_max
+        if brand_id is not None:
+            mask &= self.brand_id == brand_id
+        if tag_id is not None:
+            mask &= (self.tag_bits & np.uint64(1 << (tag_id - 1))) != 0
+        return mask
+
+    def search_by_filters(self, search_in: str, sort: str | None = None, **filters) -> list[VapeRow]:
+        """
+        Поиск вейпов по комбинации фильтров (см. filter_mask).
+        """
+
+        return self.ordered(self.filter_mask(search_in, **filters), sort)
+
+    def count_by_filters(self, search_in: str, **filters) -> int:
+        """
+        Количество вейпов, подходящих под комбинацию фильтров (см. filter_mask).
+        """
+
+        return int(np.count_nonzero(self.filter_mask(search_in, **filters)))
+
+    def price_steps(self, search_in: str, count: int = 3) -> list[int]:
+        """
+        Границы ценовых диапазонов для кнопок фильтра: квантили цен товаров
+        в заданной категории наличия, округлённые до целых.
+
+        :param count: Количество внутренних границ.
+        :return: Отсортированный список уникальных границ.
+        """
+
+        prices = self.price[self.in_stock[search_in]]
+        if prices.size == 0:
+            return []
+        quantiles = np.quantile(prices, np.linspace(0, 1, count + 2)[1:-1])
+        return sorted(set(int(round(value)) for value in quantiles))
+
+    def tags_in_stock(self, search_in: str) -> list[TagRow]:
+        """
+        Теги, у которых есть хотя бы один вейп в заданной категории наличия.
+        """
+
+        present = int(np.bitwise_or.reduce(self.tag_bits[self.in_stock[search_in]], initial=np.uint64(0)))
+        return [tag for tag in self.tags if present & (1 << (tag.id - 1))]
+
+
+def _availability_bits(vape: VapeRow) -> int:
+    """
+    Биты наличия вейпа. Коды из таблицы: -1 - только в наличии, 0 - только под заказ,
+    1 - и в наличии, и под заказ, None - нет.
+    """
+
+    bits = 0
+    if vape.availability_20 in (1, -1):
+        bits |= ON_HAND_20
+    if vape.availability_45_50_60 in (1, -1):
+        bits |= ON_HAND_45
+    if vape.availability_20 in (0, 1):
+        bits |= TO_ORDER_20
+    if vape.availability_45_50_60 in (0, 1):
+        bits |= TO_ORDER_45
+    return bits
+
+
+_catalog: CatalogSnapshot | None = None
+# Подписчики на замену снимка: вызываются как listener(previous, current)
+_catalog_listeners: list[Callable[[CatalogSnapshot | None, CatalogSnapshot], None]] = []
+
+
+def get_catalog() -> CatalogSnapshot | None:
+    """
+    Текущий снимок каталога или None, если каталог ещё не загружен.
+    """
+
+    return _catalog
+
+
+def set_catalog(snapshot: CatalogSnapshot, notify: bool = True):
+    """
+    Атомарно заменяет текущий снимок каталога и уведомляет подписчиков (add_catalog_listener).
+
+    :param notify: False - только заменить снимок (копия каталога в процессе-обработчике,
+        изменения которого уже обработал процесс, загрузивший данные).
+    """
+
+    global _catalog
+    previous, _catalog = _catalog, snapshot
+    if not notify:
+        return
+    for listener in _catalog_listeners:
+        try:
+            listener(previous, snapshot)
+        except Exception as e:
+            logging.error(f"Ошибка в обработчике обновления каталога: {e}")
+
+
+def add_catalog_listener(listener: Callable[[CatalogSnapshot | None, CatalogSnapshot], None]):
+    """
+    Подписывает функцию listener(previous, current) на замену снимка каталога.
+    """
+
+    _catalog_listeners.append(listener)
+
+
+def build_catalog(vapes_db, tags_db, vapes_tags_db, brands_db,
+                  previous: CatalogSnapshot | None = None,
+                  first_seen: dict[str, float] | None = None) -> CatalogSnapshot:
+    """
+    Строит снимок каталога из результатов парсинга.
+
+    :param vapes_db: Строки вейпов [id, name, brand_id, brand, availability_45_50_60, availability_20, price].
+    :param tags_db: Словарь {tag_id: name}.
+    :param vapes_tags_db: Пары [vape_id, tag_id].
+    :param brands_db: Словарь {brand_id: name}.
+    :param previous: Предыдущий снимок, из которого переносятся время появления вейпов и их популярность.
+    :param first_seen: Время первого появления вейпов из основной базы {ключ вейпа: timestamp};
+        имеет приоритет над значениями предыдущего снимка.
+    :return: Новый снимок каталога.
+    """
+
+    vapes = [
+        VapeRow(id=vape[0], name=vape[1], brand_id=vape[2], price=vape[6],
+                availability_45_50_60=vape[4], availability_20=vape[5])
+        for vape in vapes_db if vape[2] is not None
+    ]
+    tags = [TagRow(id=tag_id, name=name) for tag_id, name in tags_db.items()]
+
+    vape_tags = {}
+    for vape_id, tag_id in vapes_tags_db:
+        vape_tags.setdefault(vape_id, []).append(tag_id)
+
+    first_seen = {**(previous.first_seen if previous is not None else {}), **(first_seen or {})}
+    popularity = previous.popularity if previous is not None else None
+    return CatalogSnapshot(vapes, tags, vape_tags, dict(brands_db), first_seen=first_seen, popularity=popularity)
@@ -1,23 +1,82 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 import os
+import tempfile
 
-from sqlalchemy import DateTime, Integer, String, ForeignKey, Text
+from sqlalchemy import Date, DateTime, Float, Integer, String, ForeignKey, Text, UniqueConstraint, event
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 
-engine = create_async_engine(url=os.getenv('SQLALCHEMY_URL'))
+# Основная (долговременная) база: пользователи и логи их действий.
+SQLALCHEMY_URL = os.getenv('SQLALCHEMY_URL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+engine = create_async_engine(url=SQLALCHEMY_URL)
 
 async_session = async_sessionmaker(engine)
 
+@event.listens_for(engine.sync_engine, "connect")
+def _set_main_pragmas(dbapi_connection, connection_record):
+    """
+    Настройка соединений с основной базой. В режиме BOT_WORKERS в неё одновременно пишут
+    несколько процессов: WAL не блокирует читателей на время записи, а busy_timeout
+    заставляет писателя подождать освобождения блокировки вместо ошибки "database is locked".
+    """
+    
+    if engine.dialect.name != 'sqlite':
+        return
+    cursor = dbapi_connection.cursor()
+    # Действует только для новой базы (до создания таблиц и перехода в WAL):
+    # позволяет возвращать место после удаления старых логов
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    if ':memory:' not in str(SQLALCHEMY_URL):
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+# База каталога: вейпы, бренды, теги, испарители. Полностью пересобирается из
+# Google Таблиц при каждом обновлении, поэтому живёт в отдельном файле и не
+# конкурирует с записями пользователей за блокировку основной базы.
+CATALOG_SQLALCHEMY_URL = os.getenv(
+    'CATALOG_SQLALCHEMY_URL',
+    f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'glimmer_catalog.sqlite3')}"
+)
+
+catalog_engine = create_async_engine(url=CATALOG_SQLALCHEMY_URL)
+
+catalog_session = async_sessionmaker(catalog_engine)
+
+@event.listens_for(catalog_engine.sync_engine, "connect")
+def _set_catalog_pragmas(dbapi_connection, connection_record):
+    """
+    Настройка соединений с базой каталога. Каталог одноразовый, поэтому fsync
+    отключается, а WAL позволяет читать старый снимок, пока идёт пересборка.
+    """
+    
+    if not CATALOG_SQLALCHEMY_URL.startswith('sqlite'):
+        return
+    cursor = dbapi_connection.cursor()
+    if ':memory:' not in CATALOG_SQLALCHEMY_URL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.close()
+
 class Base(AsyncAttrs, DeclarativeBase):
     """
-    Базовый класс для всех моделей в базе данных.
+    Базовый класс для моделей основной базы данных (пользователи и логи).
     Используется для определения таблиц и их атрибутов.
     """
     
     pass
 
-class Vape(Base):
+class CatalogBase(AsyncAttrs, DeclarativeBase):
+    """
+    Базовый класс для моделей каталога (вейпы, бренды, теги, испарители).
+    Таблицы создаются в отдельной базе каталога.
+    """
+    
+    pass
+
+class Vape(CatalogBase):
     """
     Модель для таблицы вейпов (vapes).
     Хранит информацию о вейпах, их бренде, линейке и наличии.
@@ -33,7 +92,7 @@ class Vape(Base):
     availability_20: Mapped[int | None] = mapped_column(nullable=True)
     price: Mapped[float] = mapped_column()
 
-class Brand(Base):
+class Brand(CatalogBase):
     """
     Модель для таблицы брендов.
     Хранит информацию о брендах вейпов.
@@ -44,7 +103,7 @@ class Brand(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(40))
 
-class Vape_Tage(Base):
+class Vape_Tage(CatalogBase):
     """
     Модель для связи вейпов с тегами (many-to-many).
     Хранит информацию о вейпах и их тегах.
@@ -55,7 +114,7 @@ class Vape_Tage(Base):
     vape_id: Mapped[int] = mapped_column(ForeignKey('vapes.id'), primary_key=True)
     tag_id: Mapped[int] = mapped_column(ForeignKey('tags.id'), primary_key=True)
 
-class Tag(Base):
+class Tag(CatalogBase):
     """
     Модель для таблицы тегов.
     Хранит информацию о тегах, которые можно присваивать вейпам.
@@ -66,7 +125,7 @@ class Tag(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(30))
 
-class Vaporizer(Base):
+class Vaporizer(CatalogBase):
     """
     Модель для таблицы вейперов.
     Хранит информацию о различных моделях вейперов.
@@ -82,7 +141,7 @@ class Vaporizer(Base):
     brand: Mapped["VaporizerBrand"] = relationship(back_populates="vaporizers")
     resistance: Mapped["VaporizerResistance"] = relationship(back_populates="vaporizers")
 
-class VaporizerBrand(Base):
+class VaporizerBrand(CatalogBase):
     """
     Модель для таблицы брендов вейперов.
     Хранит информацию о брендах вейперов.
@@ -95,7 +154,7 @@ class VaporizerBrand(Base):
 
     vaporizers: Mapped[list["Vaporizer"]] = relationship(back_populates="brand", cascade="all, delete-orphan")
 
-class VaporizerResistance(Base):
+class VaporizerResistance(CatalogBase):
     """
     Модель для таблицы сопротивлений вейперов.
     Хранит информацию о сопротивлениях для вейперов.
@@ -125,6 +184,100 @@ class UserActionLog(Base):
     def __repr__(self):
         return f"<UserActionLog(id={self.id}, user_id={self.user_id}, action_type={self.action_type}, timestamp={self.timestamp})>"
 
+class UserActionDaily(Base):
+    """
+    Модель для таблицы дневных агрегатов логов действий.
+    Хранит количество действий каждого типа для каждого пользователя за день,
+    чтобы аналитика не сканировала сырые логи, которые удаляются по истечении срока хранения.
+    """
+    
+    __tablename__ = 'user_action_daily'
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    action_type: Mapped[str] = mapped_column(String(100), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+class MaintenanceState(Base):
+    """
+    Модель для таблицы состояния служебных задач.
+    Хранит пары ключ-значение, например ID последнего свёрнутого лога.
+    """
+    
+    __tablename__ = 'maintenance_state'
+
+    key: Mapped[str] = mapped_column(String(50), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, default=0)
+
+class SearchQueryStat(Base):
+    """
+    Модель для таблицы популярных поисковых запросов.
+    Хранит сохранённое состояние счётчиков Space-Saving (см. app/utils/search_stats.py):
+    запрос, его оценку частоты и максимальную погрешность оценки.
+    """
+    
+    __tablename__ = 'search_query_stats'
+
+    kind: Mapped[str] = mapped_column(String(20), primary_key=True)
+    query: Mapped[str] = mapped_column(String(100), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[int] = mapped_column(Integer, default=0)
+
+class PopularityScore(Base):
+    """
+    Модель для таблицы оценок популярности.
+    Хранит оценки вейпов, брендов и тегов с экспоненциальным затуханием
+    (см. app/utils/popularity.py) на момент сохранения.
+    """
+    
+    __tablename__ = 'popularity_scores'
+
+    kind: Mapped[str] = mapped_column(String(10), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    score: Mapped[float] = mapped_column(Float, default=0.0)
+
+class VapeFirstSeen(Base):
+    """
+    Модель для таблицы времени первого появления вейпов в каталоге.
+    Ключ — стабильная между обновлениями пара бренд и вкус (см. CatalogSnapshot.vape_key),
+    поэтому порядок «сначала новые» сохраняется после перезапуска бота.
+    """
+    
+    __tablename__ = 'vape_first_seen'
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    first_seen: Mapped[float] = mapped_column(Float, nullable=False)  # Unix-время первого появления
+
+class Subscription(Base):
+    """
+    Модель для таблицы подписок пользователей на уведомления о появлении в наличии
+    и изменении цены. Цель подписки задаётся стабильным между обновлениями каталога ключом:
+    для вейпа — бренд и вкус, для бренда и тега — название.
+    """
+    
+    __tablename__ = 'subscriptions'
+    __table_args__ = (UniqueConstraint('user_id', 'kind', 'target'),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[str] = mapped_column(String(10), nullable=False)
+    target: Mapped[str] = mapped_column(String(255), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class FsmRecord(Base):
+    """
+    Модель для таблицы состояний FSM (см. app/core/storage.py).
+    Хранит состояние и данные диалога пользователя, чтобы поиск по вкусу
+    переживал перезапуск бота и был доступен всем процессам.
+    """
+    
+    __tablename__ = 'fsm_records'
+
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    data: Mapped[str] = mapped_column(Text, default='{}')
+    updated_at: Mapped[int] = mapped_column(Integer, index=True)  # Unix-время последнего изменения
+
 class User(Base):
     """
     Модель для таблицы пользователей.
@@ -141,8 +294,12 @@ class User(Base):
 
 async def async_main():
     """
-    Главная асинхронная функция для создания таблиц в базе данных.
+    Главная асинхронная функция для создания таблиц в основной базе данных
+    и в базе каталога.
     """
     
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+    async with catalog_engine.begin() as conn:
+        await conn.run_sync(CatalogBase.metadata.create_all)
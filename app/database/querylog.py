@@ -0,0 +1,159 @@
+"""
+querylog.py
+
+Учёт SQL-запросов к основной базе и базе каталога.
+
+Обработчики событий движков SQLAlchemy (before/after_cursor_execute) замеряют каждый запрос:
+- число запросов и время выполнения попадают в метрики (app/utils/metrics.py);
+- внутри query_scope (обработка одного обновления, загрузка каталога) запросы считаются
+  отдельно, и по завершении видно, сколько запросов и времени потратил этот код;
+- запросы дольше SLOW_QUERY_MS миллисекунд пишутся в журнал медленных запросов вместе
+  с параметрами и планом выполнения (EXPLAIN QUERY PLAN);
+- если за одно обновление выполнено больше QUERY_BUDGET запросов, пишется предупреждение
+  о возможной проблеме N+1 с самыми частыми запросами.
+"""
+
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database.models import catalog_engine, engine
+from app.utils.metrics import registry
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG_FILE = os.getenv('SLOW_QUERY_LOG_FILE')  # по умолчанию медленные запросы пишутся в общий лог
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', '1') == '1'
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 20))  # запросов на одно обновление
+
+slow_query_log = logging.getLogger('slow_queries')
+if SLOW_QUERY_LOG_FILE:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG_FILE, encoding='utf-8')
+    _handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+    slow_query_log.addHandler(_handler)
+    slow_query_log.propagate = False
+
+DB_STATEMENTS = registry.counter("bot_db_statements_total", "Выполненных SQL-запросов", ("database",))
+DB_STATEMENT_DURATION = registry.histogram(
+    "bot_db_statement_duration_seconds", "Длительность SQL-запросов", ("database",))
+SLOW_QUERIES = registry.counter("bot_db_slow_statements_total", "SQL-запросов дольше SLOW_QUERY_MS", ("database",))
+SCOPE_STATEMENTS = registry.histogram(
+    "bot_db_statements_per_scope", "SQL-запросов за одно обновление или загрузку каталога", ("scope",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000, 5000))
+BUDGET_EXCEEDED = registry.counter(
+    "bot_db_query_budget_exceeded_total", "Обновлений, выполнивших больше QUERY_BUDGET запросов", ("scope",))
+
+_MAX_PARAMS_LENGTH = 500
+
+
+@dataclass
+class QueryStats:
+    """
+    Запросы, выполненные внутри одного query_scope.
+    """
+
+    name: str
+    count: int = 0
+    duration: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+
+
+current_scope: ContextVar[QueryStats | None] = ContextVar('current_scope', default=None)
+
+
+@contextmanager
+def query_scope(name: str, budget: int | None = QUERY_BUDGET):
+    """
+    Считает запросы, выполненные внутри блока with (включая задачи, созданные в нём).
+
+    :param name: Имя области для логов и метрик (имя обработчика, 'populate_database_from_parsing').
+    :param budget: Сколько запросов допустимо; при превышении пишется предупреждение N+1.
+        None - не проверять (загрузка каталога).
+    :return: QueryStats, заполняемый по мере выполнения запросов.
+    """
+
+    stats = QueryStats(name)
+    token = current_scope.set(stats)
+    try:
+        yield stats
+    finally:
+        current_scope.reset(token)
+        SCOPE_STATEMENTS.observe(stats.count, name)
+        if budget is not None and stats.count > budget:
+            BUDGET_EXCEEDED.inc(name)
+            repeated = "; ".join(f"{count}x {_shorten(statement, 120)}"
+                                 for statement, count in stats.statements.most_common(3))
+            logging.warning(f"Possible N+1 in {name}: {stats.count} queries "
+                            f"({round(stats.duration * 1000, 1)} ms, budget {budget}). Most frequent: {repeated}")
+
+
+def _shorten(value, limit: int = _MAX_PARAMS_LENGTH) -> str:
+    text = " ".join(str(value).split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _explain(cursor, statement: str, parameters) -> str:
+    """
+    План выполнения запроса (только SQLite и только SELECT).
+    """
+
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return " | ".join(str(row[-1]) for row in cursor.fetchall())
+    except Exception as e:
+        return f"не удалось получить план: {e}"
+
+
+def instrument_engine(async_engine: AsyncEngine, database: str):
+    """
+    Подключает учёт запросов к движку.
+
+    :param async_engine: Асинхронный движок SQLAlchemy.
+    :param database: Имя базы в логах и метриках ('main' или 'catalog').
+    """
+
+    sync_engine = async_engine.sync_engine
+    explain_supported = sync_engine.dialect.name == 'sqlite'
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start
+
+        DB_STATEMENTS.inc(database)
+        DB_STATEMENT_DURATION.observe(elapsed, database)
+        stats = current_scope.get()
+        if stats is not None:
+            stats.count += 1
+            stats.duration += elapsed
+            stats.statements[statement] += 1
+
+        if elapsed * 1000 < SLOW_QUERY_MS:
+            return
+        SLOW_QUERIES.inc(database)
+        message = (f"{database} {round(elapsed * 1000, 1)} ms"
+                   f"{f' [{stats.name}]' if stats is not None else ''}: {_shorten(statement, 2000)}"
+                   f" | params: {_shorten(parameters)}")
+        if (SLOW_QUERY_EXPLAIN and explain_supported and not executemany
+                and statement.lstrip().upper().startswith("SELECT")):
+            explain_cursor = conn.connection.cursor()
+            try:
+                message += f" | plan: {_explain(explain_cursor, statement, parameters)}"
+            finally:
+                explain_cursor.close()
+        slow_query_log.warning(message)
+
+
+instrument_engine(engine, 'main')
+instrument_engine(catalog_engine, 'catalog')
@@ -1,11 +1,16 @@
+import asyncio
 import logging
 from datetime import datetime
 from sqlalchemy import or_, select, text
-from app.database.models import (async_session, Tag, Brand, Vape_Tage, Vape,
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.database.models import (async_session, catalog_session, Tag, Brand, Vape_Tage, Vape,
                                  Vaporizer, VaporizerBrand, VaporizerResistance,
-                                 User)
-from app.utils.parsing import (vapes_db, tags_db, vapes_tags_db, brands_db,
-                               vaporizers_db, vaporizers_brand_db, resistances_db)
+                                 User, VapeFirstSeen)
+from app.database.rows import VapeRow, BrandRow, TagRow
+from app.database.catalog import build_catalog, get_catalog, set_catalog
+from app.database.querylog import query_scope
+from app.utils.parsing import parse_catalog
+from app.utils.metrics import DB_QUERY_DURATION, SHEETS_FETCH_DURATION, timed
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
 
@@ -23,291 +28,592 @@ availability_condition_to_order = or_(
     Vape.availability_20 == 1, Vape.availability_45_50_60 == 1 
 )
 
+# Колонки, которые выбираются для VapeRow (порядок совпадает с полями кортежа)
+vape_columns = (Vape.id, Vape.name, Vape.brand_id, Vape.price,
+                Vape.availability_45_50_60, Vape.availability_20)
+
 
 async def populate_database_from_parsing():
     """
     Заполняет базу данных данными из парсинга, удаляя предыдущие записи.
+    Google Таблицы читаются в отдельном потоке, поэтому обработка обновлений в это время не блокируется.
     Ошибки при добавлении отдельных записей логируются, остальные продолжают добавляться.
+
+    :return: True, если каталог обновлён, False - если загрузка завершилась ошибкой.
     """
 
     try:
+        logging.info(f"Начало загрузки данных из Google Таблиц. Время: {datetime.now()}")
+        with SHEETS_FETCH_DURATION.time():
+            (brands_db, tags_db, vapes_tags_db, vapes_db,
+             vaporizers_db, vaporizers_brand_db, resistances_db) = await asyncio.to_thread(parse_catalog)
+
         logging.info(f"Начало добавления данных в базу данных. Время: {datetime.now()}")
 
-        async with async_session() as session:
-            await session.execute(text('DELETE FROM tags'))
-            await session.execute(text('DELETE FROM brands'))
-            await session.execute(text('DELETE FROM vapes'))
-            await session.execute(text('DELETE FROM vapes_tags'))
-            await session.execute(text('DELETE FROM vaporizers'))
-            await session.execute(text('DELETE FROM vaporizer_brands'))
-            await session.execute(text('DELETE FROM vaporizer_resistances'))
-            await session.commit()
+        # Запросы загрузки считаются отдельно от обработки обновлений (app/database/querylog.py).
+        # В DB_QUERY_DURATION попадает только транзакция записи: чтение таблиц учтено в SHEETS_FETCH_DURATION,
+        # а вся загрузка по расписанию - в JOB_DURATION (populate_database_task).
+        with (query_scope('populate_database_from_parsing', budget=None) as queries,
+              DB_QUERY_DURATION.time('populate_database_from_parsing')):
+            # Удаление и вставка выполняются в одной транзакции базы каталога:
+            # читатели видят старый снимок до коммита, а не пустые таблицы.
+            async with catalog_session() as session:
+                await session.execute(text('DELETE FROM tags'))
+                await session.execute(text('DELETE FROM brands'))
+                await session.execute(text('DELETE FROM vapes'))
+                await session.execute(text('DELETE FROM vapes_tags'))
+                await session.execute(text('DELETE FROM vaporizers'))
+                await session.execute(text('DELETE FROM vaporizer_brands'))
+                await session.execute(text('DELETE FROM vaporizer_resistances'))
+
+                logging.info(f"Старые записи помечены на удаление. Время: {datetime.now()}")
+
+                logging.info(f"Начало добавления новых записей. Время: {datetime.now()}")
+
+                # Добавление тегов
+                for tag in tags_db.values():
+                    try:
+                        session.add(Tag(name=tag))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении тега '{tag}': {e}")
+
+                # Добавление брендов
+                for brand in brands_db.values():
+                    try:
+                        session.add(Brand(name=brand))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении бренда '{brand}': {e}")
+
+                # Добавление вейпов
+                for vape in vapes_db:
+                    try:
+                        if vape[2] is None:
+                            continue
+                        session.add(Vape(id=vape[0],
+                                         name=vape[1],
+                                         brand_id=vape[2],
+                                         brand_line_up=vape[3],
+                                         availability_45_50_60=vape[4],
+                                         availability_20=vape[5],
+                                         price=vape[6]))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении вейпа '{vape}': {e}")
+
+                # Теги к вейпам
+                for vape_tag in vapes_tags_db:
+                    try:
+                        session.add(Vape_Tage(vape_id=vape_tag[0], tag_id=vape_tag[1]))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении vape_tag '{vape_tag}': {e}")
+
+                # Бренды испарителей
+                for brand in vaporizers_brand_db:
+                    try:
+                        session.add(VaporizerBrand(id=brand[0], name=brand[1]))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении бренда испарителя '{brand}': {e}")
+
+                # Сопротивления испарителей
+                for resistance in resistances_db:
+                    try:
+                        session.add(VaporizerResistance(id=resistance[0], value=resistance[1]))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении сопротивления '{resistance}': {e}")
+
+                # Испарители
+                for vaporizer in vaporizers_db:
+                    try:
+                        session.add(Vaporizer(brand_id=vaporizer[0],
+                                              resistance_id=vaporizer[1],
+                                              price=vaporizer[2]))
+                    except Exception as e:
+                        logging.warning(f"Ошибка при добавлении испарителя '{vaporizer}': {e}")
 
-            logging.info(f"Старые записи успешно удалены. Время: {datetime.now()}")
+                await session.commit()
 
-        async with async_session() as session:
-            logging.info(f"Начало добавления новых записей. Время: {datetime.now()}")
-
-            # Добавление тегов
-            for tag in tags_db.values():
-                try:
-                    session.add(Tag(name=tag))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении тега '{tag}': {e}")
-
-            # Добавление брендов
-            for brand in brands_db.values():
-                try:
-                    session.add(Brand(name=brand))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении бренда '{brand}': {e}")
-
-            # Добавление вейпов
-            for vape in vapes_db:
-                try:
-                    if vape[2] is None:
-                        continue
-                    session.add(Vape(name=vape[1],
-                                     brand_id=vape[2],
-                                     brand_line_up=vape[3],
-                                     availability_45_50_60=vape[4],
-                                     availability_20=vape[5],
-                                     price=vape[6]))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении вейпа '{vape}': {e}")
-
-            # Теги к вейпам
-            for vape_tag in vapes_tags_db:
-                try:
-                    session.add(Vape_Tage(vape_id=vape_tag[0], tag_id=vape_tag[1]))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении vape_tag '{vape_tag}': {e}")
-
-            # Бренды испарителей
-            for brand in vaporizers_brand_db:
-                try:
-                    session.add(VaporizerBrand(id=brand[0], name=brand[1]))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении бренда испарителя '{brand}': {e}")
-
-            # Сопротивления испарителей
-            for resistance in resistances_db:
-                try:
-                    session.add(VaporizerResistance(id=resistance[0], value=resistance[1]))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении сопротивления '{resistance}': {e}")
-
-            # Испарители
-            for vaporizer in vaporizers_db:
-                try:
-                    session.add(Vaporizer(brand_id=vaporizer[0],
-                                          resistance_id=vaporizer[1],
-                                          price=vaporizer[2]))
-                except Exception as e:
-                    logging.warning(f"Ошибка при добавлении испарителя '{vaporizer}': {e}")
-
-            await session.commit()
-
-            logging.info(f"Новые данные успешно добавлены в базу данных. Время: {datetime.now()}")
+                logging.info(f"Новые данные успешно добавлены в базу данных. Время: {datetime.now()}")
+        logging.info(f"Запись каталога: {queries.count} SQL-запросов, {round(queries.duration * 1000)} ms")
+
+        known_first_seen = await get_vapes_first_seen()
+        snapshot = build_catalog(vapes_db, tags_db, vapes_tags_db, brands_db,
+                                 previous=get_catalog(), first_seen=known_first_seen)
+        # Новые вейпы сохраняются до рассылки снимка, чтобы процессы-обработчики прочитали то же время
+        await save_vapes_first_seen({key: timestamp for key, timestamp in snapshot.first_seen.items()
+                                     if key not in known_first_seen})
+        set_catalog(snapshot)
+        logging.info(f"Снимок каталога в памяти обновлён. Время: {datetime.now()}")
+        return True
 
     except Exception as e:
         logging.error(f"Произошла ошибка при добавлении данных: {e}")
+        return False
 
 
 
+@timed(DB_QUERY_DURATION)
+async def load_catalog_from_database():
+    """
+    Строит снимок каталога из базы каталога, без обращения к Google Таблицам.
+    Используется процессами-обработчиками (app/core/workers.py): данные в базу
+    загружает процесс приёма обновлений, а каждый обработчик держит свою копию снимка.
+    При запуске так же загружается каталог, сохранённый прошлым запуском, пока свежие
+    данные читаются из таблиц. Подписчики на обновление каталога не уведомляются.
+
+    :return: True, если снимок загружен, False - если база каталога пуста или недоступна.
+    """
+
+    try:
+        async with catalog_session() as session:
+            vapes_result = await session.execute(select(
+                Vape.id, Vape.name, Vape.brand_id, Vape.brand_line_up,
+                Vape.availability_45_50_60, Vape.availability_20, Vape.price,
+            ))
+            tags_result = await session.execute(select(Tag.id, Tag.name))
+            brands_result = await session.execute(select(Brand.id, Brand.name))
+            vapes_tags_result = await session.execute(select(Vape_Tage.vape_id, Vape_Tage.tag_id))
+
+            vapes = [list(row) for row in vapes_result.all()]
+            tags = dict(tags_result.all())
+            brands = dict(brands_result.all())
+            vapes_tags = [list(row) for row in vapes_tags_result.all()]
+
+        if not vapes:
+            return False
+        set_catalog(build_catalog(vapes, tags, vapes_tags, brands, previous=get_catalog(),
+                                  first_seen=await get_vapes_first_seen()), notify=False)
+        logging.info(f"Снимок каталога загружен из базы: {len(vapes)} вейпов")
+        return True
+
+    except Exception as e:
+        logging.error(f"Ошибка при загрузке каталога из базы: {e}")
+        return False
+
+@timed(DB_QUERY_DURATION)
+async def get_vapes_first_seen() -> dict[str, float]:
+    """
+    Получает время первого появления вейпов в каталоге из основной базы.
+    :return: Словарь {ключ вейпа: Unix-время}, пустой при ошибке.
+    """
+    try:
+        async with async_session() as session:
+            result = await session.execute(select(VapeFirstSeen.key, VapeFirstSeen.first_seen))
+            return dict(result.all())
+    except Exception as e:
+        logging.error(f"Error in get_vapes_first_seen: {e}")
+        return {}
+
+@timed(DB_QUERY_DURATION)
+async def save_vapes_first_seen(first_seen: dict[str, float]):
+    """
+    Сохраняет время первого появления новых вейпов. Уже записанное время не перезаписывается.
+    :param first_seen: Словарь {ключ вейпа: Unix-время}
+    """
+    if not first_seen:
+        return
+    try:
+        stmt = sqlite_insert(VapeFirstSeen).on_conflict_do_nothing(index_elements=[VapeFirstSeen.key])
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(stmt, [{"key": key, "first_seen": timestamp}
+                                             for key, timestamp in first_seen.items()])
+    except Exception as e:
+        logging.error(f"Error in save_vapes_first_seen: {e}")
+
+@timed(DB_QUERY_DURATION)
 async def get_brands(search_in: str):
     """
     Получение списка брендов, имеющихся в наличии или под заказ.
 
     :param search_in: Указывает, где искать бренды ('on_hand' - в наличии, 'to_order' - под заказ).
     :type search_in: str
-    :return: Список объектов Brand, удовлетворяющих условиям наличия.
-    :rtype: list[Brand]
+    :return: Список брендов, удовлетворяющих условиям наличия.
+    :rtype: list[BrandRow]
     """
     
     try:
-        async with async_session() as session:
+        async with catalog_session() as session:
             if search_in == 'on_hand':
                 availability_condition = availability_condition_on_hand
             elif search_in == 'to_order':
                 availability_condition = availability_condition_to_order
             result = await session.execute(
-                select(Brand).join(Vape).where(availability_condition).distinct()
+                select(Brand.id, Brand.name).join(Vape).where(availability_condition).distinct()
             )
-            return result.scalars().all()
+            return [BrandRow._make(row) for row in result.all()]
     except Exception as e:
         logging.error(f"Error in get_brands: {e}")
         return []
 
-async def get_vapes_by_brand(brand_id, search_in: str):
+@timed(DB_QUERY_DURATION)
+async def get_vapes_by_brand(brand_id, search_in: str, sort: str | None = None):
     """
     Получение списка вейпов по ID бренда.
 
+    Если снимок каталога загружен, список берётся из предвычисленного порядка сортировки,
+    иначе выполняется запрос к базе каталога.
+
     :param brand_id: Идентификатор бренда.
     :type brand_id: int
     :param search_in: Указывает, где искать вейпы ('on_hand' - в наличии, 'to_order' - под заказ).
     :type search_in: str
-    :return: Список объектов Vape, относящихся к указанному бренду и удовлетворяющих условиям наличия.
-    :rtype: list[Vape]
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - порядок каталога.
+    :type sort: str | None
+    :return: Список вейпов, относящихся к указанному бренду и удовлетворяющих условиям наличия.
+    :rtype: list[VapeRow]
     """
     
     try:
-        async with async_session() as session:
+        catalog = get_catalog()
+        if catalog is not None:
+            return catalog.listing('brand', int(brand_id), search_in, sort)
+
+        async with catalog_session() as session:
             if search_in == 'on_hand':
                 availability_condition = availability_condition_on_hand
             elif search_in == 'to_order':
                 availability_condition = availability_condition_to_order
             result = await session.execute(
-                select(Vape).where(Vape.brand_id == brand_id, availability_condition)
+                select(*vape_columns).where(Vape.brand_id == brand_id, availability_condition)
             )
-            return result.scalars().all()
+            return [VapeRow._make(row) for row in result.all()]
     except Exception as e:
         logging.error(f"Error in get_vapes_by_brand: {e}")
         return []
 
+@timed(DB_QUERY_DURATION)
 async def get_all_tags_with_vapes(search_in: str):
     """
     Получение всех тегов, связанных с вейпами, в зависимости от наличия.
 
     :param search_in: Указывает, где искать теги ('on_hand' - в наличии, 'to_order' - под заказ).
     :type search_in: str
-    :return: Список объектов Tag, которые связаны с хотя бы одним вейпом в заданной категории наличия.
-    :rtype: list[Tag]
+    :return: Список тегов, которые связаны с хотя бы одним вейпом в заданной категории наличия.
+    :rtype: list[TagRow]
     """
     
     try:
-        async with async_session() as session:
+        async with catalog_session() as session:
             if search_in == 'on_hand':
                 availability_condition = availability_condition_on_hand
             elif search_in == 'to_order':
                 availability_condition = availability_condition_to_order
                 
             result = await session.execute(
-                select(Tag)
+                select(Tag.id, Tag.name)
                 .join(Vape_Tage)
                 .join(Vape)
                 .where(availability_condition)
                 .distinct()
             )
-            return result.scalars().all()
+            return [TagRow._make(row) for row in result.all()]
     except Exception as e:
         logging.error(f"Error in get_all_tags_with_vapes: {e}")
         return []
 
-async def get_vapes_by_tag(tag_id: int, search_in: str):
+@timed(DB_QUERY_DURATION)
+async def get_vapes_by_tag(tag_id: int, search_in: str, sort: str | None = None):
     """
     Поиск вейпов по ID тега.
 
+    Если снимок каталога загружен, список берётся из предвычисленного порядка сортировки,
+    иначе выполняется запрос к базе каталога.
+
     :param tag_id: Идентификатор тега.
     :type tag_id: int
     :param search_in: Указывает, где искать вейпы ('on_hand' - в наличии, 'to_order' - под заказ).
     :type search_in: str
-    :return: Список объектов Vape, соответствующих заданному тегу и условиям наличия.
-    :rtype: list[Vape]
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - порядок каталога.
+    :type sort: str | None
+    :return: Список вейпов, соответствующих заданному тегу и условиям наличия.
+    :rtype: list[VapeRow]
     """
     
     try:
-        async with async_session() as session:
+        catalog = get_catalog()
+        if catalog is not None:
+            return catalog.listing('tag', tag_id, search_in, sort)
+
+        async with catalog_session() as session:
             if search_in == 'on_hand':
                 availability_condition = availability_condition_on_hand
             elif search_in == 'to_order':
                 availability_condition = availability_condition_to_order
             
             result = await session.execute(
-                select(Vape)
+                select(*vape_columns)
                 .join(Vape_Tage)
                 .where(Vape_Tage.tag_id == tag_id, availability_condition)
             )
-            return result.scalars().all()
+            return [VapeRow._make(row) for row in result.all()]
     except Exception as e:
         logging.error(f"Error in get_vapes_by_tag: {e}")
         return []
 
-async def get_vapes_by_flavor(flavor: str, search_in: str):
+@timed(DB_QUERY_DURATION)
+async def get_vapes_by_flavor(flavor: str, search_in: str, sort: str | None = None):
     """
     Поиск вейпов по вкусу (независимо от регистра).
 
+    Если снимок каталога загружен, поиск выполняется по нему с предвычисленным порядком
+    сортировки, иначе выполняется запрос к базе каталога.
+
     :param flavor: Вкус, который нужно найти (поиск осуществляется по первым 4 символам).
     :type flavor: str
     :param search_in: Указывает, где искать вейпы ('on_hand' - в наличии, 'to_order' - под заказ).
     :type search_in: str
-    :return: Список объектов Vape, содержащих указанный вкус в названии и удовлетворяющих условиям наличия.
-    :rtype: list[Vape]
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - порядок каталога.
+    :type sort: str | None
+    :return: Список вейпов, содержащих указанный вкус в названии и удовлетворяющих условиям наличия.
+    :rtype: list[VapeRow]
     """
     
     try:
-        async with async_session() as session:
+        catalog = get_catalog()
+        if catalog is not None:
+            return catalog.search_by_flavor(flavor, search_in, sort)
+
+        async with catalog_session() as session:
             if search_in == 'on_hand':
                 availability_condition = availability_condition_on_hand
             elif search_in == 'to_order':
                 availability_condition = availability_condition_to_order
             
             result = await session.execute(
-                select(Vape)
+                select(*vape_columns)
                 .where(
                     or_(Vape.name.ilike(f"%{flavor.lower()[:4]}%"), availability_condition),
                     Vape.name.ilike(f"%{flavor.capitalize()[:4]}%"), availability_condition)
                 )
-            return result.scalars().all()
+            return [VapeRow._make(row) for row in result.all()]
     except Exception as e:
         logging.error(f"Error in get_vapes_by_flavor: {e}")
         return []
 
 
+@timed(DB_QUERY_DURATION)
+async def get_sold_out_vapes_by_flavor(flavor: str, search_in: str, sort: str | None = None):
+    """
+    Вейпы со вкусом в названии, которых сейчас нет в наличии (по снимку каталога в памяти).
+    Показываются после найденных, чтобы на них можно было подписаться.
+
+    :param flavor: Вкус, который нужно найти (поиск осуществляется по первым 4 символам).
+    :param search_in: Категория поиска ('on_hand' - в наличии, 'to_order' - под заказ).
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - порядок каталога.
+    :return: Список вейпов.
+    :rtype: list[VapeRow]
+    """
+
+    try:
+        catalog = get_catalog()
+        if catalog is None:
+            return []
+        return catalog.sold_out_by_flavor(flavor, search_in, sort)
+    except Exception as e:
+        logging.error(f"Error in get_sold_out_vapes_by_flavor: {e}")
+        return []
 
-async def is_exists(user_id) -> bool:
+@timed(DB_QUERY_DURATION)
+async def get_vapes_by_tags(search_in: str, all_mask: int = 0, any_mask: int = 0, none_mask: int = 0,
+                            sort: str | None = None):
     """
-    Проверяет, существует ли пользователь в базе данных.
-    :param user_id: ID пользователя
-    :return: True, если пользователь существует, иначе False
+    Поиск вейпов по комбинации тегов (И / ИЛИ / НЕ) по снимку каталога в памяти.
+
+    Маски — битовые наборы тегов, где бит (tag_id - 1) соответствует тегу.
+
+    :param search_in: Указывает, где искать вейпы ('on_hand' - в наличии, 'to_order' - под заказ).
+    :param all_mask: Теги, которые должны присутствовать все.
+    :param any_mask: Теги, из которых должен присутствовать хотя бы один.
+    :param none_mask: Теги, которые должны отсутствовать.
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - порядок каталога.
+    :return: Список вейпов, удовлетворяющих условиям.
+    :rtype: list[VapeRow]
     """
+
     try:
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.id == user_id))
-            user = result.scalar_one_or_none()
-            return user is not None
+        catalog = get_catalog()
+        if catalog is None:
+            return []
+        return catalog.search_by_tags(search_in, all_mask, any_mask, none_mask, sort=sort)
     except Exception as e:
-        logging.error(f"Error in is_exists: {e}")
-        return False
+        logging.error(f"Error in get_vapes_by_tags: {e}")
+        return []
+
+@timed(DB_QUERY_DURATION)
+async def get_similar_vapes(vape_id: int, search_in: str, sort: str | None = None):
+    """
+    Похожие вейпы по снимку каталога в памяти: соседи по тегам и бренду,
+    вычисленные при загрузке каталога.
 
-async def add_user(user_id: int, username: str):
+    :param vape_id: Идентификатор вейпа.
+    :param search_in: Указывает, где искать вейпы ('on_hand' - в наличии, 'to_order' - под заказ).
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - сначала самые похожие.
+    :return: Список похожих вейпов.
+    :rtype: list[VapeRow]
+    """
+
+    try:
+        catalog = get_catalog()
+        if catalog is None:
+            return []
+        return catalog.search_similar(vape_id, search_in, sort)
+    except Exception as e:
+        logging.error(f"Error in get_similar_vapes: {e}")
+        return []
+
+async def get_vape_id_by_token(token: str) -> int | None:
     """
-    Добавляет нового пользователя в базу данных.
-    :param user_id: ID пользователя
-    :param username: Имя пользователя
+    ID вейпа в текущем снимке каталога по токену стабильного ключа из кнопки
+    (см. key_token в app/database/catalog.py).
+
+    :param token: Токен ключа вейпа.
+    :return: ID вейпа или None, если вейпа больше нет в каталоге.
     """
+
+    catalog = get_catalog()
+    return catalog.vape_id_by_token(token) if catalog else None
+
+@timed(DB_QUERY_DURATION)
+async def count_vapes_by_tags(search_in: str, all_mask: int = 0, any_mask: int = 0, none_mask: int = 0) -> int:
+    """
+    Количество вейпов, подходящих под комбинацию тегов (см. get_vapes_by_tags).
+    """
+
     try:
-        async with async_session() as session:
-            session.add(User(id=user_id, username=username))
-            await session.commit()
+        catalog = get_catalog()
+        if catalog is None:
+            return 0
+        return catalog.count_by_tags(search_in, all_mask, any_mask, none_mask)
     except Exception as e:
-        logging.error(f"Error in add_user: {e}")
+        logging.error(f"Error in count_vapes_by_tags: {e}")
+        return 0
 
-async def get_users():
+@timed(DB_QUERY_DURATION)
+async def get_vapes_by_filters(search_in: str, sort: str | None = None, **filters):
     """
-    Получает список всех пользователей.
-    :return: Список пользователей
+    Поиск вейпов по комбинации фильтров (цена, крепость, бренд, тег) по колоночному
+    снимку каталога в памяти.
+
+    :param search_in: Указывает, где искать вейпы ('on_hand' - в наличии, 'to_order' - под заказ).
+    :param sort: Код сортировки ('a', 'd', 'n', 'r', 'p') или None - порядок каталога.
+    :param filters: price_min, price_max, strength, brand_id, tag_id (см. CatalogSnapshot.filter_mask).
+    :return: Список вейпов, удовлетворяющих условиям.
+    :rtype: list[VapeRow]
     """
+
     try:
-        async with async_session() as session:
-            result = await session.execute(select(User))
-            return result.scalars().all()
+        catalog = get_catalog()
+        if catalog is None:
+            return []
+        return catalog.search_by_filters(search_in, sort=sort, **filters)
     except Exception as e:
-        logging.error(f"Error in get_users: {e}")
+        logging.error(f"Error in get_vapes_by_filters: {e}")
         return []
 
-async def increment_command_count(user_id: int):
+@timed(DB_QUERY_DURATION)
+async def count_vapes_by_filters(search_in: str, **filters) -> int:
+    """
+    Количество вейпов, подходящих под комбинацию фильтров (см. get_vapes_by_filters).
+    """
+
+    try:
+        catalog = get_catalog()
+        if catalog is None:
+            return 0
+        return catalog.count_by_filters(search_in, **filters)
+    except Exception as e:
+        logging.error(f"Error in count_vapes_by_filters: {e}")
+        return 0
+
+@timed(DB_QUERY_DURATION)
+async def get_price_steps(search_in: str) -> list[int]:
     """
-    Увеличивает счетчик команд пользователя.
-    :param user_id: ID пользователя
+    Границы ценовых диапазонов для кнопок фильтра по цене.
+    """
+
+    try:
+        catalog = get_catalog()
+        if catalog is None:
+            return []
+        return catalog.price_steps(search_in)
+    except Exception as e:
+        logging.error(f"Error in get_price_steps: {e}")
+        return []
+
+@timed(DB_QUERY_DURATION)
+async def get_brand_name(brand_id: int) -> str | None:
+    """
+    Название бренда по ID (по снимку каталога).
+    """
+
+    catalog = get_catalog()
+    return catalog.brand_names.get(brand_id) if catalog else None
+
+@timed(DB_QUERY_DURATION)
+async def get_tag_name(tag_id: int) -> str | None:
+    """
+    Название тега по ID (по снимку каталога).
+    """
+
+    catalog = get_catalog()
+    return catalog.tag_names.get(tag_id) if catalog else None
+
+@timed(DB_QUERY_DURATION)
+async def get_tags_in_stock(search_in: str):
+    """
+    Теги, у которых есть вейпы в заданной категории наличия (по снимку каталога).
+
+    :rtype: list[TagRow]
+    """
+
+    try:
+        catalog = get_catalog()
+        if catalog is None:
+            return []
+        return catalog.tags_in_stock(search_in)
+    except Exception as e:
+        logging.error(f"Error in get_tags_in_stock: {e}")
+        return []
+
+
+@timed(DB_QUERY_DURATION)
+async def get_user_ids() -> set[int]:
+    """
+    Получает идентификаторы всех пользователей (для кеша известных пользователей).
+    :return: Множество ID пользователей
     """
     try:
         async with async_session() as session:
-            result = await session.execute(select(User).where(User.id == user_id))
-            user = result.scalar_one_or_none()
-            
-            if user:
-                user.command_count += 1
-                await session.commit()
+            result = await session.execute(select(User.id))
+            return set(result.scalars().all())
     except Exception as e:
-        logging.error(f"Error in increment_command_count: {e}")
+        logging.error(f"Error in get_user_ids: {e}")
+        return set()
+
+@timed(DB_QUERY_DURATION)
+async def upsert_users_activity(rows: list[dict]):
+    """
+    Записывает накопленную активность пользователей одним запросом INSERT ... ON CONFLICT:
+    новые пользователи добавляются, у существующих увеличивается счётчик команд
+    и обновляются last_seen и username.
+    :param rows: Список словарей с ключами id, username, first_seen, last_seen, command_count
+    :return: True, если активность записана (или записывать нечего), False - при ошибке.
+    """
+    if not rows:
+        return True
+    try:
+        stmt = sqlite_insert(User)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.id],
+            set_={
+                "username": stmt.excluded.username,
+                "last_seen": stmt.excluded.last_seen,
+                "command_count": User.command_count + stmt.excluded.command_count,
+            },
+        )
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(stmt, rows)
+        return True
+    except Exception as e:
+        logging.error(f"Error in upsert_users_activity: {e}")
+        return False
@@ -0,0 +1,41 @@
+"""
+rows.py
+
+Лёгкие неизменяемые строки результатов запросов. Вместо полноценных ORM-объектов
+(с identity map и инструментированными атрибутами) запросы выбирают только нужные
+колонки и возвращают эти кортежи.
+"""
+
+from typing import NamedTuple
+
+
+class VapeRow(NamedTuple):
+    """
+    Вейп в выдаче: всё, что нужно для отображения в списке.
+    """
+
+    id: int
+    name: str
+    brand_id: int
+    price: float
+    availability_45_50_60: int | None
+    availability_20: int | None
+
+
+class BrandRow(NamedTuple):
+    """
+    Бренд в клавиатуре выбора бренда.
+    """
+
+    id: int
+    name: str
+
+
+class TagRow(NamedTuple):
+    """
+    Тег в клавиатуре выбора тега.
+    """
+
+    id: int
+    name: str
+
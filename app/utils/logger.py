@@ -1,33 +1,243 @@
+import asyncio
+import json
 import logging
+import os
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import func, insert, select
+
 from app.database.models import async_session
 from app.database.models import UserActionLog
+from app.utils.retention import (fold_logs, get_rollup_watermark, increment_daily_counters,
+                                 set_rollup_watermark)
 
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.basicConfig(level=logging.INFO)
 
+# Идентификатор для системных событий (задачи планировщика, ошибки запуска),
+# у которых нет пользователя: колонка user_id не допускает NULL.
+SYSTEM_USER_ID = 0
+
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', 500))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv('LOG_FLUSH_INTERVAL_MS', 1000))
+
+# Метка остановки в очереди логов: фоновая задача записывает текущую пачку и завершается
+_STOP = object()
+
+
+class UserActionLogSink:
+    """
+    Буферизированная запись логов действий пользователей.
+
+    Записи складываются в ограниченную очередь без ожидания базы данных, а фоновая задача
+    сбрасывает их пачками (одним executemany в одной транзакции) каждые flush_interval_ms
+    миллисекунд или при накоплении batch_size записей. Если очередь переполнена, запись
+    отбрасывается и увеличивается счётчик dropped.
+    """
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval_ms: int = LOG_FLUSH_INTERVAL_MS):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.dropped = 0
+        self.written = 0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def put(self, record: dict) -> bool:
+        """
+        Добавляет запись в очередь без ожидания.
+
+        :return: True, если запись принята, False - если очередь переполнена.
+        """
+
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logging.warning(f"Очередь логов переполнена, отброшено записей: {self.dropped}")
+            return False
+
+    def start(self):
+        """
+        Запускает фоновую задачу сброса логов.
+        """
+
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливает фоновую задачу и сбрасывает оставшиеся в очереди записи.
+
+        Задача не отменяется: в очередь ставится метка остановки, и задача сначала записывает
+        пачку, которую уже собрала, а затем завершается. Только после этого дописывается
+        остаток очереди, поэтому ни собранная пачка, ни начатая транзакция не теряются.
+        """
+
+        if self._task is not None:
+            if not self._task.done():
+                await self.queue.put(_STOP)
+            try:
+                await self._task
+            except Exception as e:
+                logging.error(f"Ошибка в фоновой записи логов: {e}")
+            self._task = None
+
+        while not self.queue.empty():
+            await self.write_batch(self._drain())
+
+    def _drain(self) -> list[dict]:
+        """
+        Забирает из очереди до batch_size записей без ожидания.
+        """
+
+        batch = []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            record = self.queue.get_nowait()
+            if record is not _STOP:
+                batch.append(record)
+        return batch
+
+    async def _run(self):
+        """
+        Цикл сброса: ждёт первую запись, затем добирает пачку до batch_size
+        или до истечения flush_interval и записывает её. Получив метку остановки,
+        записывает собранную пачку и завершается.
+        """
+
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            record = await self.queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+
+            await self.write_batch(batch)
+
+    async def write_batch(self, batch: list[dict]):
+        """
+        Записывает пачку логов одним executemany и в той же транзакции увеличивает
+        дневные счётчики активности (user_action_daily), сдвигая отметку свёртки.
+        Если до пачки в таблице есть ещё не свёрнутые логи, они сначала досворачиваются.
+        """
+
+        if not batch:
+            return
+
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    watermark = await get_rollup_watermark(session)
+                    previous_max_id = await session.scalar(select(func.max(UserActionLog.id))) or 0
+                    if previous_max_id > watermark:
+                        await fold_logs(session, watermark, previous_max_id)
+
+                    await session.execute(insert(UserActionLog), batch)
+                    await increment_daily_counters(session, batch)
+
+                    max_id = await session.scalar(select(func.max(UserActionLog.id))) or 0
+                    await set_rollup_watermark(session, max_id)
+            self.written += len(batch)
+        except Exception as e:
+            logging.error(f"Ошибка при записи пачки логов ({len(batch)} шт.). Ошибка: {e}")
+
+
+log_sink = UserActionLogSink()
+
+# Подписчики на структурированные события (log_event): вызываются сразу, в памяти,
+# и не должны обращаться к базе данных.
+_event_listeners: list[Callable[[int | None, str, dict], None]] = []
+
+
+def add_event_listener(listener: Callable[[int | None, str, dict], None]):
+    """
+    Подписывает функцию listener(user_id, action_type, fields) на структурированные события.
+    """
+
+    _event_listeners.append(listener)
+
+
+def set_event_listeners(listeners: list[Callable[[int | None, str, dict], None]]):
+    """
+    Заменяет всех подписчиков на структурированные события. Используется процессами-обработчиками
+    (app/core/workers.py), которые передают события процессу приёма вместо собственного учёта.
+    """
+
+    _event_listeners[:] = listeners
+
+
+def notify_event_listeners(user_id: int | None, action_type: str, fields: dict):
+    """
+    Передаёт структурированное событие подписчикам (add_event_listener).
+    """
+
+    for listener in _event_listeners:
+        try:
+            listener(user_id, action_type, fields)
+        except Exception as e:
+            logging.error(f"Ошибка в обработчике события {action_type}: {e}")
+
+
 async def log_user_action(user_id: int, action_type: str, action_details: str):
     """
     Функция для записи действий пользователей в лог. Это полезно для отслеживания
     активности пользователей в приложении, таких как команды или ошибки.
 
-    :param user_id: Идентификатор пользователя, чей action логируется.
+    Если фоновый сброс логов запущен (log_sink.start()), запись только ставится в очередь
+    и не ждёт базу данных. Иначе (например, до запуска бота) запись выполняется сразу.
+
+    :param user_id: Идентификатор пользователя, чей action логируется (None - системное событие).
     :param action_type: Тип действия (например, "search", "error").
     :param action_details: Подробности действия, описание события.
     """
-    
-    try:
-        async with async_session() as session:
-            async with session.begin():
-                log_entry = UserActionLog(
-                    user_id=user_id,
-                    action_type=action_type,
-                    action_details=action_details,
-                )
-                session.add(log_entry)
-        
-            await session.commit()
-        
-        logging.info(f"Запись действия для пользователя {user_id} успешно сохранена. Тип: {action_type}, Детали: {action_details}")
-        
-    except Exception as e:
-        logging.error(f"Ошибка при записи действия пользователя {user_id}. Ошибка: {e}")
+
+    record = {
+        "user_id": SYSTEM_USER_ID if user_id is None else user_id,
+        "action_type": action_type,
+        "action_details": action_details,
+        "timestamp": datetime.utcnow(),
+    }
+
+    if log_sink.running:
+        log_sink.put(record)
+    else:
+        await log_sink.write_batch([record])
+
+
+async def log_event(user_id: int | None, action_type: str, **fields):
+    """
+    Записывает структурированное событие: поля сохраняются в action_details в виде JSON,
+    а подписчики (add_event_listener) получают их без разбора текста логов.
+
+    :param user_id: Идентификатор пользователя (None - системное событие).
+    :param action_type: Тип действия (например, "search_flavor_result").
+    :param fields: Поля события (например, query, search_in, results).
+    """
+
+    notify_event_listeners(user_id, action_type, fields)
+
+    await log_user_action(user_id, action_type, json.dumps(fields, ensure_ascii=False, default=str))
@@ -0,0 +1,235 @@
+"""
+metrics.py
+
+Метрики производительности в текстовом формате Prometheus.
+
+Гистограммы длительности обработчиков, запросов к базе, чтения Google Таблиц, запросов
+к Bot API и задач планировщика, счётчики ошибок и значения, которые модули уже считают сами
+(очередь отправки, пропущенные обновления), собираются в реестре registry. Если задан
+METRICS_PORT, они отдаются по http://METRICS_HOST:METRICS_PORT/metrics (по умолчанию
+только локально). Квантили p50 / p99 считаются на стороне Prometheus по корзинам гистограмм
+(histogram_quantile).
+
+Всё хранится в памяти процесса: в режиме BOT_WORKERS у каждого процесса-обработчика
+свой порт (METRICS_PORT + 1 + номер процесса).
+"""
+
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # 0 - не запускать HTTP-сервер метрик
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Границы корзин гистограмм длительности, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Счётчик, который только растёт (например, число ошибок обработчика).
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.label_names, labels)} {value}" for labels, value in self.values.items()]
+
+
+class Histogram:
+    """
+    Гистограмма длительностей: накопленные количества по корзинам, сумма и число наблюдений.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Замеряет длительность блока with.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                bucket_labels = _labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Значение, которое вычисляется при каждом чтении метрик (длина очереди, счётчики модулей).
+    """
+
+    def __init__(self, name: str, help: str, kind: str, callback: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.callback()}"]
+
+
+class Registry:
+    """
+    Реестр метрик процесса.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram | CallbackMetric] = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, kind: str, callback: Callable[[], float]) -> CallbackMetric:
+        """
+        Регистрирует значение, которое уже считает другой модуль (kind - 'counter' или 'gauge').
+        """
+
+        return self._register(CallbackMetric(name, help, kind, callback))
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus.
+        """
+
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                body = metric.render()
+            except Exception as e:
+                logging.error(f"Ошибка при чтении метрики {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(body)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_DURATION = registry.histogram(
+    "bot_handler_duration_seconds", "Длительность обработчиков обновлений", ("handler",))
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках обновлений", ("handler",))
+DB_QUERY_DURATION = registry.histogram(
+    "bot_db_query_duration_seconds", "Длительность функций app/database/requests.py", ("query",))
+SHEETS_FETCH_DURATION = registry.histogram(
+    "bot_sheets_fetch_duration_seconds", "Длительность чтения каталога из Google Таблиц")
+BOT_API_DURATION = registry.histogram(
+    "bot_api_request_duration_seconds", "Длительность запросов к Bot API", ("method",))
+BOT_API_QUEUE_LATENCY = registry.histogram(
+    "bot_api_queue_latency_seconds", "Время от постановки сообщения в очередь отправки до ответа Bot API")
+JOB_DURATION = registry.histogram(
+    "bot_job_duration_seconds", "Длительность задач планировщика", ("job",))
+
+
+def timed(histogram: Histogram, label: str | None = None):
+    """
+    Декоратор асинхронной функции: записывает её длительность в histogram
+    с меткой label (по умолчанию - имя функции).
+    """
+
+    def decorator(func):
+        name = label or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    return decorator
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> web.AppRunner | None:
+    """
+    Запускает HTTP-сервер с метриками на /metrics.
+
+    :return: AppRunner для остановки (runner.cleanup()) или None, если порт не задан или занят.
+    """
+
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logging.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logging.info(f"Metrics are served on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.core.core import bot
+from app.core.sender import PRIORITY_BULK, send_priority
+from app.database.catalog import CatalogChange, CatalogSnapshot, add_catalog_listener, get_catalog
+from app.database.models import async_session, Subscription
+from app.utils.texts import SUBSCRIPTION_NOTIFICATION_TEXT
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+NOTIFICATION_MAX_LINES = int(os.getenv('NOTIFICATION_MAX_LINES', 20))
+
+
+def subscription_target(kind: str, token: str) -> str | None:
+    """
+    Стабильный ключ цели подписки по токену из кнопки (см. key_token в app/database/catalog.py).
+
+    :param kind: 'vape', 'brand' или 'tag'.
+    :param token: Токен ключа вейпа, названия бренда или тега.
+    :return: Ключ или None, если цели нет в текущем каталоге.
+    """
+
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    return catalog.target_by_token(kind, token)
+
+
+def subscription_title(kind: str, target: str) -> str:
+    """
+    Название цели подписки для пользователя.
+    """
+
+    if kind == "vape":
+        brand, _, name = target.partition("|")
+        return f"💨 {name.capitalize()} ({brand})"
+    if kind == "brand":
+        return f"🏷 {target}"
+    return f"📑 {target}"
+
+
+class SubscriptionIndex:
+    """
+    Подписки пользователей на вейпы, бренды и теги.
+
+    В памяти хранится обратный индекс {(вид, ключ цели): {user_id, ...}}, поэтому рассылка
+    по изменениям каталога стоит O(изменённые вейпы x (1 + теги)) поиска в словаре
+    и не зависит от числа пользователей и товаров. Изменения подписок сразу пишутся в базу.
+    """
+
+    def __init__(self):
+        self.index: dict[tuple[str, str], set[int]] = {}
+        # Подписки меняются в других процессах (режим BOT_WORKERS): перед рассылкой индекс перечитывается
+        self.reload_before_fan_out = False
+
+    async def load(self):
+        """
+        Загружает подписки из базы данных.
+        """
+
+        try:
+            async with async_session() as session:
+                result = await session.execute(select(Subscription.user_id, Subscription.kind, Subscription.target))
+                rows = result.all()
+            self.index = {}
+            for user_id, kind, target in rows:
+                self.index.setdefault((kind, target), set()).add(user_id)
+            logging.info(f"Loaded {len(rows)} subscriptions.")
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке подписок: {e}")
+
+    async def toggle(self, user_id: int, kind: str, target: str) -> bool:
+        """
+        Подписывает пользователя на цель или отменяет существующую подписку.
+
+        :return: True, если подписка оформлена, False - если отменена.
+        """
+
+        subscribers = self.index.setdefault((kind, target), set())
+        subscribed = user_id not in subscribers
+        async with async_session() as session:
+            async with session.begin():
+                if subscribed:
+                    await session.execute(
+                        sqlite_insert(Subscription)
+                        .values(user_id=user_id, kind=kind, target=target)
+                        .on_conflict_do_nothing()
+                    )
+                else:
+                    await session.execute(delete(Subscription).where(
+                        Subscription.user_id == user_id, Subscription.kind == kind, Subscription.target == target
+                    ))
+
+        if subscribed:
+            subscribers.add(user_id)
+        else:
+            subscribers.discard(user_id)
+        return subscribed
+
+    async def remove(self, user_id: int, subscription_id: int):
+        """
+        Удаляет подписку пользователя по её ID (из списка /subscriptions).
+        """
+
+        async with async_session() as session:
+            async with session.begin():
+                subscription = await session.scalar(select(Subscription).where(
+                    Subscription.id == subscription_id, Subscription.user_id == user_id
+                ))
+                if subscription is None:
+                    return
+                self.index.get((subscription.kind, subscription.target), set()).discard(user_id)
+                await session.delete(subscription)
+
+    async def get_user_subscriptions(self, user_id: int) -> list[tuple[int, str, str]]:
+        """
+        Подписки пользователя: список (id, вид, ключ цели).
+        """
+
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(Subscription.id, Subscription.kind, Subscription.target)
+                    .where(Subscription.user_id == user_id)
+                    .order_by(Subscription.id)
+                )
+                return [tuple(row) for row in result.all()]
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке подписок пользователя {user_id}: {e}")
+            return []
+
+    def subscribers(self, change: CatalogChange) -> set[int]:
+        """
+        Пользователи, подписанные на вейп из изменения, его бренд или один из его тегов.
+        """
+
+        users = set()
+        targets = [("vape", change.key), ("brand", change.brand_name.upper())]
+        targets += [("tag", tag_name) for tag_name in change.tag_names]
+        for target in targets:
+            users |= self.index.get(target, set())
+        return users
+
+    def fan_out(self, changes: list[CatalogChange]) -> dict[int, list[CatalogChange]]:
+        """
+        Группирует изменения по подписанным пользователям.
+        """
+
+        per_user: dict[int, list[CatalogChange]] = {}
+        for change in changes:
+            for user_id in self.subscribers(change):
+                per_user.setdefault(user_id, []).append(change)
+        return per_user
+
+
+subscriptions = SubscriptionIndex()
+
+
+def format_change(change: CatalogChange) -> str:
+    """
+    Строка уведомления об одном изменении.
+    """
+
+    vape = change.vape
+    if change.restocked:
+        return f"✅ {vape.name} ({change.brand_name}) снова в наличии — {change.new_price} руб."
+    return f"💰 {vape.name} ({change.brand_name}): {change.old_price} → {change.new_price} руб."
+
+
+async def notify_subscribers(changes: list[CatalogChange]):
+    """
+    Находит подписчиков изменений (при необходимости перечитав подписки) и рассылает уведомления.
+    """
+
+    if subscriptions.reload_before_fan_out:
+        await subscriptions.load()
+    per_user = subscriptions.fan_out(changes)
+    logging.info(f"Изменений в каталоге: {len(changes)}, пользователей к уведомлению: {len(per_user)}")
+    if per_user:
+        await send_notifications(per_user)
+
+
+async def send_notifications(per_user: dict[int, list[CatalogChange]]):
+    """
+    Отправляет каждому пользователю одно сообщение со всеми изменениями по его подпискам.
+    Сообщения идут через очередь отправки с низким приоритетом, поэтому не мешают ответам
+    на действия пользователей и не превышают ограничения Telegram.
+    """
+
+    send_priority.set(PRIORITY_BULK)
+
+    async def notify(user_id: int, changes: list[CatalogChange]):
+        lines = [format_change(change) for change in changes[:NOTIFICATION_MAX_LINES]]
+        if len(changes) > NOTIFICATION_MAX_LINES:
+            lines.append(f"… и ещё {len(changes) - NOTIFICATION_MAX_LINES}")
+        try:
+            await bot.send_message(user_id, SUBSCRIPTION_NOTIFICATION_TEXT.format(changes="\n".join(lines)))
+            return True
+        except Exception as e:
+            logging.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+            return False
+
+    results = await asyncio.gather(*(notify(user_id, changes) for user_id, changes in per_user.items()))
+    logging.info(f"Отправлено уведомлений о подписках: {sum(results)} из {len(results)}")
+
+
+_notification_tasks: set[asyncio.Task] = set()
+
+
+def on_catalog_updated(previous: CatalogSnapshot | None, current: CatalogSnapshot):
+    """
+    Подписчик на замену снимка каталога: сравнивает снимки и ставит уведомления в очередь.
+    Первый снимок после запуска не с чем сравнить, поэтому уведомлений по нему нет.
+    """
+
+    if previous is None or not (subscriptions.index or subscriptions.reload_before_fan_out):
+        return
+
+    changes = current.diff(previous)
+    if not changes:
+        return
+
+    task = asyncio.create_task(notify_subscribers(changes))
+    _notification_tasks.add(task)
+    task.add_done_callback(_notification_tasks.discard)
+
+
+add_catalog_listener(on_catalog_updated)
@@ -0,0 +1,223 @@
+import logging
+import math
+import os
+import time
+from typing import Callable
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.catalog import get_catalog
+from app.database.models import async_session, MaintenanceState, PopularityScore
+from app.utils.logger import add_event_listener
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+POPULARITY_HALF_LIFE_HOURS = float(os.getenv('POPULARITY_HALF_LIFE_HOURS', 72))
+# Доля популярности бренда и тегов в оценке вейпа: упорядочивает вейпы, которые ещё не показывали
+POPULARITY_CONTEXT_WEIGHT = 0.1
+
+SAVED_AT_KEY = 'popularity_saved_at'
+
+# События просмотра списков: тип события -> поле с ID бренда или тега
+LISTING_EVENTS = {
+    "view_vapes_by_brand": "brand_id",
+    "view_vapes_by_tag": "tag_id",
+}
+
+
+class DecayedScores:
+    """
+    Оценки с экспоненциальным затуханием: вклад события уменьшается вдвое каждые half_life секунд.
+
+    Вместо того чтобы уменьшать все оценки со временем, новые события добавляются с весом
+    exp(rate * (t - origin)), а при чтении результат умножается на exp(-rate * (now - origin)).
+    Порядок ключей от общего множителя не зависит, поэтому добавление события — O(1).
+    """
+
+    # При таком показателе экспоненты все значения приводятся к текущему моменту
+    MAX_EXPONENT = 50.0
+    # Оценки ниже этого порога при приведении удаляются
+    MIN_SCORE = 1e-3
+
+    def __init__(self, half_life: float):
+        self.rate = math.log(2) / half_life
+        self.origin = time.time()
+        self.values: dict[str, float] = {}
+
+    def add(self, key: str, weight: float = 1.0, now: float | None = None):
+        now = time.time() if now is None else now
+        exponent = self.rate * (now - self.origin)
+        if exponent > self.MAX_EXPONENT:
+            self.rebase(now)
+            exponent = 0.0
+        self.values[key] = self.values.get(key, 0.0) + weight * math.exp(exponent)
+
+    def rebase(self, now: float):
+        """
+        Приводит все значения к моменту now и отбрасывает затухшие оценки.
+        """
+
+        factor = math.exp(-self.rate * (now - self.origin))
+        self.values = {key: value * factor for key, value in self.values.items() if value * factor >= self.MIN_SCORE}
+        self.origin = now
+
+    def scores(self, now: float | None = None) -> dict[str, float]:
+        """
+        Текущие оценки всех ключей.
+        """
+
+        now = time.time() if now is None else now
+        factor = math.exp(-self.rate * (now - self.origin))
+        return {key: value * factor for key, value in self.values.items()}
+
+    def load(self, scores: dict[str, float], age: float, now: float | None = None):
+        """
+        Загружает оценки, сохранённые age секунд назад, с учётом прошедшего затухания.
+        """
+
+        now = time.time() if now is None else now
+        factor = math.exp(self.rate * (now - self.origin - age))
+        for key, score in scores.items():
+            self.values[key] = self.values.get(key, 0.0) + score * factor
+
+
+class PopularityTracker:
+    """
+    Популярность вейпов, брендов и тегов по событиям просмотра списков, пагинации
+    и запросам похожих вейпов.
+
+    Оценки обновляются в памяти подписчиком на события логгера; порядок "популярные сначала"
+    пересчитывается в фоне (refresh) и сохраняется в снимке каталога, поэтому запросы списков
+    не агрегируют логи. Ключи стабильны между обновлениями каталога: для вейпа — бренд и вкус,
+    для бренда и тега — название.
+    """
+
+    KINDS = ("vape", "brand", "tag")
+
+    def __init__(self, half_life_hours: float = POPULARITY_HALF_LIFE_HOURS):
+        self.scores = {kind: DecayedScores(half_life_hours * 3600) for kind in self.KINDS}
+        # Получают оценки вейпов после каждого пересчёта (рассылка процессам-обработчикам)
+        self.refresh_listeners: list[Callable[[dict[str, float]], None]] = []
+
+    def on_event(self, user_id: int | None, action_type: str, fields: dict):
+        """
+        Подписчик на события логгера: учитывает открытые списки и показанные вейпы.
+        """
+
+        catalog = get_catalog()
+        if catalog is None:
+            return
+
+        if action_type in LISTING_EVENTS:
+            context, context_id = action_type.rsplit("_", 1)[1], fields.get(LISTING_EVENTS[action_type])
+        elif action_type == "pagination":
+            context, context_id = fields.get("context"), fields.get("context_id")
+        elif action_type == "view_similar_vapes":
+            context, context_id = "vape", fields.get("vape_id")
+        else:
+            return
+
+        if context == "brand" and context_id in catalog.brand_names:
+            self.scores["brand"].add(catalog.brand_names[context_id].upper())
+        elif context == "tag" and context_id in catalog.tag_names:
+            self.scores["tag"].add(catalog.tag_names[context_id])
+        elif context == "vape" and context_id in catalog.index_by_id:
+            self.scores["vape"].add(catalog.keys[catalog.index_by_id[context_id]])
+
+        for vape_id in fields.get("vape_ids", ()):
+            index = catalog.index_by_id.get(vape_id)
+            if index is not None:
+                self.scores["vape"].add(catalog.keys[index])
+
+    def vape_scores(self, catalog) -> dict[str, float]:
+        """
+        Итоговые оценки вейпов каталога: собственная популярность плюс доля популярности
+        бренда и тегов.
+        """
+
+        vape_scores = self.scores["vape"].scores()
+        brand_scores = self.scores["brand"].scores()
+        tag_scores = self.scores["tag"].scores()
+
+        context = np.array(
+            [brand_scores.get(catalog.brand_names.get(vape.brand_id, '').upper(), 0.0) for vape in catalog.vapes],
+            dtype=np.float64,
+        )
+        for tag in catalog.tags:
+            score = tag_scores.get(tag.name)
+            if score:
+                context += score * ((catalog.tag_bits & np.uint64(1 << (tag.id - 1))) != 0)
+
+        return {
+            key: vape_scores.get(key, 0.0) + POPULARITY_CONTEXT_WEIGHT * float(context[index])
+            for index, key in enumerate(catalog.keys)
+        }
+
+    def refresh(self):
+        """
+        Пересчитывает порядок "популярные сначала" в текущем снимке каталога.
+        """
+
+        catalog = get_catalog()
+        if catalog is None:
+            return
+        scores = self.vape_scores(catalog)
+        catalog.set_popularity(scores)
+        for listener in self.refresh_listeners:
+            try:
+                listener(scores)
+            except Exception as e:
+                logging.error(f"Ошибка в обработчике пересчёта популярности: {e}")
+
+    async def load(self):
+        """
+        Загружает сохранённые оценки из базы данных с учётом затухания за время простоя.
+        """
+
+        try:
+            async with async_session() as session:
+                saved_at = await session.scalar(
+                    select(MaintenanceState.value).where(MaintenanceState.key == SAVED_AT_KEY)
+                )
+                result = await session.execute(select(PopularityScore.kind, PopularityScore.key, PopularityScore.score))
+                rows = result.all()
+
+            age = max(0.0, time.time() - saved_at) if saved_at else 0.0
+            for kind in self.KINDS:
+                self.scores[kind].load({key: score for row_kind, key, score in rows if row_kind == kind}, age)
+            logging.info(f"Загружены оценки популярности: {len(rows)} шт.")
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке оценок популярности: {e}")
+
+    async def save(self):
+        """
+        Сохраняет текущие оценки в базу данных (таблица перезаписывается целиком).
+        """
+
+        now = time.time()
+        for decayed in self.scores.values():
+            decayed.rebase(now)
+        rows = [
+            {"kind": kind, "key": key, "score": score}
+            for kind, decayed in self.scores.items()
+            for key, score in decayed.values.items()
+        ]
+
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    await session.execute(delete(PopularityScore))
+                    if rows:
+                        await session.execute(insert(PopularityScore), rows)
+                    state = sqlite_insert(MaintenanceState).values(key=SAVED_AT_KEY, value=int(now))
+                    await session.execute(state.on_conflict_do_update(
+                        index_elements=["key"], set_={"value": state.excluded.value}
+                    ))
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении оценок популярности: {e}")
+
+
+popularity = PopularityTracker()
+add_event_listener(popularity.on_event)
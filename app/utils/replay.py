@@ -0,0 +1,141 @@
+"""
+replay.py
+
+Локальная проверка режима webhook без Telegram.
+
+- FakeSession: сессия Bot API, которая ничего не отправляет, а запоминает исходящие
+  вызовы и возвращает правдоподобные ответы. Включается переменной окружения BOT_FAKE_API=1
+  (см. app/core/core.py).
+- Воспроизведение записанных обновлений (WEBHOOK_RECORD_FILE) POST-запросами на вебхук:
+
+    python -m app.utils.replay updates.jsonl --url http://localhost:8080/webhook --secret <WEBHOOK_SECRET>
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import typing
+from datetime import datetime, timezone
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, User
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API без сети: каждый вызов записывается в requests (имя метода и параметры),
+    а в ответ возвращается True, сообщение или пользователь в зависимости от типа результата метода.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests: list[tuple[str, dict]] = []
+        self._message_id = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        params = method.model_dump(warnings=False, exclude_none=True)
+        self.requests.append((method.__api_method__, params))
+        logging.info(f"Fake Bot API call: {method.__api_method__} {params}")
+        return self._fake_result(bot, method, params)
+
+    def _fake_result(self, bot: Bot, method: TelegramMethod, params: dict):
+        returning = method.__returning__
+        types = typing.get_args(returning) or (returning,)
+
+        if Message in types:
+            self._message_id += 1
+            message = {
+                "message_id": params.get("message_id", self._message_id),
+                "date": datetime.now(timezone.utc),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "text": params.get("text"),
+            }
+            if method.__api_method__ == "sendDocument":
+                message["document"] = {"file_id": f"fake-file-{self._message_id}",
+                                       "file_unique_id": f"fake-{self._message_id}"}
+            return Message.model_validate(message, context={"bot": bot})
+        if User in types:
+            return User(id=bot.id, is_bot=True, first_name="FakeBot", username="fake_bot")
+        if bool in types:
+            return True
+        return None
+
+    async def stream_content(self, url: str, headers: dict | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+async def replay_updates(path: str, url: str, secret: str | None = None, concurrency: int = 1,
+                         delay: float = 0.0) -> dict:
+    """
+    Отправляет записанные обновления (по одному JSON на строку) POST-запросами на вебхук.
+
+    :param path: Файл с обновлениями.
+    :param url: Адрес вебхука.
+    :param secret: Секретный токен вебхука (WEBHOOK_SECRET).
+    :param concurrency: Сколько запросов отправлять одновременно.
+    :param delay: Пауза между запросами в секундах.
+    :return: Словарь со статистикой: количество запросов, ошибки, время ответа.
+    """
+
+    from aiohttp import ClientSession
+
+    with open(path, encoding='utf-8') as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def post(session: ClientSession, update: dict):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started)
+            if delay:
+                await asyncio.sleep(delay)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    def percentile(share: float) -> float:
+        if not latencies:
+            return 0
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * share))] * 1000, 1)
+
+    latencies.sort()
+    return {
+        "updates": len(updates),
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений Telegram на вебхук.")
+    parser.add_argument("path", help="Файл с обновлениями (JSON Lines)")
+    parser.add_argument("--url", default="http://localhost:8080/webhook", help="Адрес вебхука")
+    parser.add_argument("--secret", default=None, help="Секретный токен вебхука")
+    parser.add_argument("--concurrency", type=int, default=1, help="Одновременных запросов")
+    parser.add_argument("--delay", type=float, default=0.0, help="Пауза между запросами, с")
+    args = parser.parse_args()
+
+    print(asyncio.run(replay_updates(args.path, args.url, args.secret, args.concurrency, args.delay)))
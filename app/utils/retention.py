@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database.models import async_session, engine, MaintenanceState, UserActionDaily, UserActionLog
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', 90))
+LOG_PURGE_BATCH_SIZE = int(os.getenv('LOG_PURGE_BATCH_SIZE', 1000))
+LOG_INCREMENTAL_VACUUM_PAGES = int(os.getenv('LOG_INCREMENTAL_VACUUM_PAGES', 0))
+
+ROLLUP_WATERMARK_KEY = 'user_action_logs_rollup_id'
+
+
+async def get_rollup_watermark(session) -> int:
+    """
+    ID последнего лога, уже учтённого в дневных агрегатах.
+    """
+
+    return await session.scalar(
+        select(MaintenanceState.value).where(MaintenanceState.key == ROLLUP_WATERMARK_KEY)
+    ) or 0
+
+
+async def set_rollup_watermark(session, value: int):
+    """
+    Сохраняет ID последнего лога, учтённого в дневных агрегатах.
+    """
+
+    state = sqlite_insert(MaintenanceState).values(key=ROLLUP_WATERMARK_KEY, value=value)
+    await session.execute(state.on_conflict_do_update(
+        index_elements=["key"], set_={"value": state.excluded.value}
+    ))
+
+
+async def fold_logs(session, first_id: int, last_id: int):
+    """
+    Добавляет в дневные агрегаты логи с ID в диапазоне (first_id, last_id].
+    """
+
+    day = func.date(UserActionLog.timestamp)
+    new_logs = (
+        select(day, UserActionLog.user_id, UserActionLog.action_type, func.count())
+        .where(UserActionLog.id > first_id, UserActionLog.id <= last_id)
+        .group_by(day, UserActionLog.user_id, UserActionLog.action_type)
+    )
+    stmt = sqlite_insert(UserActionDaily).from_select(
+        ["day", "user_id", "action_type", "count"], new_logs
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "user_id", "action_type"],
+        set_={"count": UserActionDaily.count + stmt.excluded.count},
+    )
+    await session.execute(stmt)
+
+
+async def increment_daily_counters(session, records: list[dict]):
+    """
+    Увеличивает дневные агрегаты на пачку только что записанных логов
+    (одним INSERT ... ON CONFLICT на все пары день-пользователь-действие пачки).
+
+    :param records: Записи логов с ключами user_id, action_type, timestamp.
+    """
+
+    counts = Counter((record["timestamp"].date(), record["user_id"], record["action_type"]) for record in records)
+    if not counts:
+        return
+
+    stmt = sqlite_insert(UserActionDaily)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "user_id", "action_type"],
+        set_={"count": UserActionDaily.count + stmt.excluded.count},
+    )
+    await session.execute(stmt, [
+        {"day": day, "user_id": user_id, "action_type": action_type, "count": count}
+        for (day, user_id, action_type), count in counts.items()
+    ])
+
+
+async def rollup_user_action_logs() -> int:
+    """
+    Сворачивает новые сырые логи действий в дневные агрегаты (user_action_daily).
+
+    Обычно агрегаты обновляются сразу при записи логов (см. UserActionLogSink.write_batch),
+    и задача находит только логи, записанные в обход буфера (например, старыми версиями бота).
+
+    Обрабатываются только логи с ID больше сохранённой отметки, поэтому повторный запуск
+    ничего не посчитает дважды. Агрегаты и отметка обновляются в одной транзакции.
+
+    :return: Количество свёрнутых логов.
+    """
+
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                watermark = await get_rollup_watermark(session)
+                max_id = await session.scalar(select(func.max(UserActionLog.id))) or 0
+                if max_id <= watermark:
+                    return 0
+
+                await fold_logs(session, watermark, max_id)
+                await set_rollup_watermark(session, max_id)
+
+        logging.info(f"Свёрнуты логи действий с ID {watermark + 1}..{max_id}.")
+        return max_id - watermark
+
+    except Exception as e:
+        logging.error(f"Ошибка при свёртке логов действий: {e}")
+        return 0
+
+
+async def purge_user_action_logs(retention_days: int = LOG_RETENTION_DAYS,
+                                 batch_size: int = LOG_PURGE_BATCH_SIZE) -> int:
+    """
+    Удаляет сырые логи старше срока хранения небольшими пачками, каждая в своей транзакции,
+    чтобы не держать блокировку базы и не мешать записи пользовательских данных.
+    Удаляются только логи, уже свёрнутые в дневные агрегаты.
+
+    :param retention_days: Срок хранения сырых логов в днях.
+    :param batch_size: Размер пачки удаления.
+    :return: Количество удалённых логов.
+    """
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+
+    try:
+        async with async_session() as session:
+            watermark = await get_rollup_watermark(session)
+
+        while True:
+            batch = (
+                select(UserActionLog.id)
+                .where(UserActionLog.id <= watermark, UserActionLog.timestamp < cutoff)
+                .order_by(UserActionLog.id)
+                .limit(batch_size)
+            )
+            async with async_session() as session:
+                async with session.begin():
+                    result = await session.execute(
+                        delete(UserActionLog).where(UserActionLog.id.in_(batch.scalar_subquery()))
+                    )
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                break
+            await asyncio.sleep(0)  # Даём выполниться другим задачам между пачками
+
+        logging.info(f"Удалено логов действий старше {retention_days} дн.: {deleted}")
+
+    except Exception as e:
+        logging.error(f"Ошибка при удалении старых логов действий: {e}")
+
+    return deleted
+
+
+async def incremental_vacuum(pages: int = LOG_INCREMENTAL_VACUUM_PAGES):
+    """
+    Возвращает операционной системе до pages свободных страниц базы данных.
+    Работает только для SQLite с auto_vacuum=INCREMENTAL (задаётся при создании базы).
+
+    :param pages: Количество страниц; 0 - не выполнять.
+    """
+
+    if pages <= 0 or engine.url.get_backend_name() != 'sqlite':
+        return
+
+    try:
+        async with engine.connect() as conn:
+            auto_vacuum = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+            if auto_vacuum != 2:
+                logging.info("Инкрементальный VACUUM недоступен: база создана без auto_vacuum=INCREMENTAL.")
+                return
+            result = await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(pages)})")
+            if result.returns_rows:
+                result.all()  # PRAGMA освобождает по одной странице на каждую прочитанную строку
+            await conn.commit()
+    except Exception as e:
+        logging.error(f"Ошибка при инкрементальном VACUUM: {e}")
@@ -1,13 +1,21 @@
 import asyncio
+import os
 import schedule
 import logging
 from app.database.requests import populate_database_from_parsing
 from app.utils.logger import log_user_action
 from app.utils.statistics import export_users_to_excel
+from app.utils.retention import rollup_user_action_logs, purge_user_action_logs, incremental_vacuum
+from app.utils.search_stats import search_stats
+from app.utils.popularity import popularity
+from app.utils.metrics import JOB_DURATION, timed
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
 
+POPULARITY_REFRESH_MINUTES = int(os.getenv('POPULARITY_REFRESH_MINUTES', 15))
 
+
+@timed(JOB_DURATION)
 async def populate_database_task():
     """
     Функция для выполнения задачи по заполнению базы данных из данных парсинга.
@@ -29,6 +37,7 @@ async def populate_database_task():
         logging.error(f"Error in populate database task: {str(e)}")
         await log_user_action(None, "task_error", f"Error in populate database task: {str(e)}")
 
+@timed(JOB_DURATION)
 async def export_statistic_task():
     """
     Функция для выполнения задачи экспорта статистики пользователей в Excel.
@@ -50,9 +59,60 @@ async def export_statistic_task():
         logging.error(f"Error in user statistics export: {str(e)}")
         await log_user_action(None, "task_error", f"Error in user statistics export: {str(e)}")
 
+@timed(JOB_DURATION)
+async def user_action_logs_retention_task():
+    """
+    Функция для обслуживания таблицы логов действий: свёртка новых логов в дневные
+    агрегаты, удаление сырых логов старше срока хранения и инкрементальный VACUUM.
+    Логирует начало и завершение задачи, а также ошибки, если они возникли.
+
+    :return: None
+    """
+    
+    try:
+        logging.info("User action logs retention task started")
+        await log_user_action(None, "task_start", "User action logs retention task started")
+
+        rolled_up = await rollup_user_action_logs()
+        purged = await purge_user_action_logs()
+        await incremental_vacuum()
+
+        logging.info(f"User action logs retention task completed: rolled up {rolled_up}, purged {purged}")
+        await log_user_action(None, "task_end", f"User action logs retention task completed: rolled up {rolled_up}, purged {purged}")
+    except Exception as e:
+        logging.error(f"Error in user action logs retention task: {str(e)}")
+        await log_user_action(None, "task_error", f"Error in user action logs retention task: {str(e)}")
+
+@timed(JOB_DURATION)
+async def save_search_stats_task():
+    """
+    Функция для периодического сохранения статистики поисковых запросов в базу данных.
+    """
+    
+    try:
+        await search_stats.save()
+    except Exception as e:
+        logging.error(f"Error in save search stats task: {str(e)}")
+
+@timed(JOB_DURATION)
+async def refresh_popularity_task():
+    """
+    Функция для пересчёта порядка "популярные сначала" в снимке каталога
+    и сохранения оценок популярности в базу данных.
+    """
+    
+    try:
+        popularity.refresh()
+        await popularity.save()
+    except Exception as e:
+        logging.error(f"Error in refresh popularity task: {str(e)}")
+
 schedule.every().hour.at(':00').do(lambda: asyncio.create_task(populate_database_task()))  
 schedule.every().hour.at(':30').do(lambda: asyncio.create_task(populate_database_task())) 
 schedule.every().monday.at("00:00").do(lambda: asyncio.create_task(export_statistic_task())) 
+schedule.every().day.at("03:15").do(lambda: asyncio.create_task(user_action_logs_retention_task()))
+schedule.every(10).minutes.do(lambda: asyncio.create_task(save_search_stats_task()))
+schedule.every(POPULARITY_REFRESH_MINUTES).minutes.do(lambda: asyncio.create_task(refresh_popularity_task()))
 
 async def scheduler():
     """
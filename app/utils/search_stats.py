@@ -0,0 +1,146 @@
+import logging
+import os
+
+from sqlalchemy import delete, insert, select
+
+from app.database.models import async_session, SearchQueryStat
+from app.utils.logger import add_event_listener
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
+
+SEARCH_STATS_CAPACITY = int(os.getenv('SEARCH_STATS_CAPACITY', 500))
+SEARCH_QUERY_MAX_LENGTH = 100
+
+SEARCH_EVENT = "search_flavor_result"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Приводит поисковый запрос к единому виду: нижний регистр, "ё" -> "е",
+    одиночные пробелы, не длиннее SEARCH_QUERY_MAX_LENGTH символов.
+    """
+
+    return " ".join(query.lower().replace("ё", "е").split())[:SEARCH_QUERY_MAX_LENGTH]
+
+
+class SpaceSaving:
+    """
+    Счётчик самых частых элементов потока по алгоритму Space-Saving.
+
+    Хранит не больше capacity счётчиков. Новый элемент при заполненной таблице вытесняет
+    элемент с минимальным счётчиком и наследует его значение как погрешность, поэтому
+    оценка частоты завышена не больше чем на error, а любой элемент с частотой выше
+    N / capacity гарантированно присутствует в таблице.
+    """
+
+    def __init__(self, capacity: int = SEARCH_STATS_CAPACITY):
+        self.capacity = capacity
+        self.counters: dict[str, list[int]] = {}  # {элемент: [оценка частоты, погрешность]}
+
+    def add(self, item: str, weight: int = 1):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+            return
+
+        # Линейный поиск минимума выполняется только для новых элементов при заполненной таблице
+        victim = min(self.counters, key=lambda key: self.counters[key][0])
+        floor = self.counters.pop(victim)[0]
+        self.counters[item] = [floor + weight, floor]
+
+    def top(self, n: int) -> list[tuple[str, int, int]]:
+        """
+        n самых частых элементов: список (элемент, оценка частоты, погрешность).
+        """
+
+        ranked = sorted(self.counters.items(), key=lambda pair: pair[1][0], reverse=True)
+        return [(item, count, error) for item, (count, error) in ranked[:n]]
+
+
+class SearchStats:
+    """
+    Популярные поисковые запросы и популярные запросы без результатов.
+
+    Обновляется из структурированных событий поиска (log_event) в памяти,
+    периодически сохраняется в таблицу search_query_stats и загружается при запуске.
+    """
+
+    KINDS = ("queries", "zero_results")
+
+    def __init__(self, capacity: int = SEARCH_STATS_CAPACITY):
+        self.sketches = {kind: SpaceSaving(capacity) for kind in self.KINDS}
+        self.dirty = False
+
+    def on_event(self, user_id: int | None, action_type: str, fields: dict):
+        """
+        Подписчик на события логгера: учитывает события поиска по вкусу.
+        """
+
+        if action_type != SEARCH_EVENT or not fields.get("query"):
+            return
+
+        self.sketches["queries"].add(fields["query"])
+        if fields.get("results") == 0:
+            self.sketches["zero_results"].add(fields["query"])
+        self.dirty = True
+
+    def top_queries(self, n: int = 10) -> list[tuple[str, int, int]]:
+        return self.sketches["queries"].top(n)
+
+    def top_zero_results(self, n: int = 10) -> list[tuple[str, int, int]]:
+        return self.sketches["zero_results"].top(n)
+
+    async def load(self):
+        """
+        Загружает сохранённые счётчики из базы данных вместо текущих. Процессы-обработчики
+        так периодически перечитывают статистику, которую ведёт процесс приёма.
+        """
+
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(SearchQueryStat.kind, SearchQueryStat.query, SearchQueryStat.count, SearchQueryStat.error)
+                )
+                counters = {kind: {} for kind in self.KINDS}
+                for kind, query, count, error in result.all():
+                    if kind in counters:
+                        counters[kind][query] = [count, error]
+            for kind, sketch in self.sketches.items():
+                sketch.counters = counters[kind]
+            logging.info(f"Загружена статистика поиска: {len(self.sketches['queries'].counters)} запросов.")
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке статистики поиска: {e}")
+
+    async def save(self):
+        """
+        Сохраняет счётчики в базу данных, если они изменились с прошлого сохранения.
+        Таблица небольшая (не больше capacity строк на вид), поэтому перезаписывается целиком.
+        """
+
+        if not self.dirty:
+            return
+
+        rows = [
+            {"kind": kind, "query": query, "count": count, "error": error}
+            for kind, sketch in self.sketches.items()
+            for query, (count, error) in sketch.counters.items()
+        ]
+        self.dirty = False
+
+        try:
+            async with async_session() as session:
+                async with session.begin():
+                    await session.execute(delete(SearchQueryStat))
+                    if rows:
+                        await session.execute(insert(SearchQueryStat), rows)
+        except Exception as e:
+            self.dirty = True
+            logging.error(f"Ошибка при сохранении статистики поиска: {e}")
+
+
+search_stats = SearchStats()
+add_event_listener(search_stats.on_event)
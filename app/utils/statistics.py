@@ -1,50 +1,267 @@
-import pandas as pd
+import asyncio
 import calendar
+import csv
 import logging
-from datetime import datetime
-from sqlalchemy import select
-from app.database.models import async_session, User
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import case, distinct, func, select
+from app.database.models import async_session, User, UserActionDaily
+from app.utils.logger import SYSTEM_USER_ID
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
 
+STATISTICS_EXPORT_FORMAT = os.getenv('STATISTICS_EXPORT_FORMAT', 'xlsx')
+EXPORT_CHUNK_SIZE = 1000
 
-async def export_users_to_excel():
+EXPORT_COLUMNS = ["user_id", "first_seen", "last_seen", "command_count", "week_events", "week_active_days"]
+
+WEEK_DAYS = 7
+MONTH_DAYS = 30
+
+# Последний экспорт: отпечаток данных и имя файла, чтобы не пересоздавать неизменившийся файл
+_last_export: dict[str, tuple] = {}
+# file_id документов, уже загруженных в Telegram: {имя файла: file_id}
+_telegram_file_ids: dict[str, str] = {}
+
+
+class XlsxExportWriter:
+    """
+    Потоковая запись в Excel через write-only книгу openpyxl: строки не держатся в памяти.
+    """
+
+    def __init__(self, file_name: str):
+        from openpyxl import Workbook
+
+        self.file_name = file_name
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(EXPORT_COLUMNS)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.sheet.append(list(row))
+
+    def close(self):
+        self.workbook.save(self.file_name)
+
+
+class CsvExportWriter:
+    """
+    Потоковая запись в CSV.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.file = open(file_name, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """
+    Потоковая запись в Parquet по одной группе строк на пачку. Требует пакет pyarrow.
+    """
+
+    def __init__(self, file_name: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.file_name = file_name
+        self.schema = pa.schema([
+            ("user_id", pa.int64()),
+            ("first_seen", pa.timestamp("us")),
+            ("last_seen", pa.timestamp("us")),
+            ("command_count", pa.int64()),
+            ("week_events", pa.int64()),
+            ("week_active_days", pa.int64()),
+        ])
+        self.writer = pq.ParquetWriter(file_name, self.schema)
+
+    def write_rows(self, rows):
+        columns = list(zip(*rows)) if rows else [[] for _ in EXPORT_COLUMNS]
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    "xlsx": XlsxExportWriter,
+    "csv": CsvExportWriter,
+    "parquet": ParquetExportWriter,
+}
+
+
+def _window_start(days: int):
+    """
+    Первый день окна из days последних дней, включая сегодняшний (по UTC, как и дневные агрегаты).
     """
-    Функция для экспорта статистики пользователей в Excel файл. Она извлекает данные 
-    о пользователях (ID, первое и последнее посещение, количество команд) из базы данных 
+
+    return datetime.utcnow().date() - timedelta(days=days - 1)
+
+
+async def _users_fingerprint(session, week_start) -> tuple:
+    """
+    Отпечаток данных экспорта: меняется при появлении пользователя, его активности
+    или сдвиге недельного окна.
+    """
+
+    users = await session.execute(
+        select(func.count(User.id), func.max(User.last_seen), func.sum(User.command_count))
+    )
+    week_events = await session.scalar(
+        select(func.sum(UserActionDaily.count)).where(UserActionDaily.day >= week_start)
+    )
+    return (week_start, week_events) + tuple(users.one())
+
+
+async def get_activity_summary() -> dict:
+    """
+    Сводка активности пользователей по дневным агрегатам user_action_daily:
+    DAU / WAU / MAU (уникальные пользователи за день, 7 и 30 дней), количество действий
+    за те же окна, новые пользователи за неделю и общее число пользователей.
+
+    Все значения — суммы по диапазону дней в небольшой таблице агрегатов,
+    без сканирования сырых логов.
+
+    :return: Словарь со сводкой или None, если произошла ошибка.
+    """
+
+    try:
+        today = _window_start(1)
+        week_start = _window_start(WEEK_DAYS)
+        month_start = _window_start(MONTH_DAYS)
+
+        def users_since(start):
+            return func.count(distinct(case((UserActionDaily.day >= start, UserActionDaily.user_id))))
+
+        def events_since(start):
+            return func.coalesce(func.sum(case((UserActionDaily.day >= start, UserActionDaily.count), else_=0)), 0)
+
+        async with async_session() as session:
+            activity = (await session.execute(
+                select(users_since(today), users_since(week_start), users_since(month_start),
+                       events_since(today), events_since(week_start), events_since(month_start))
+                .where(UserActionDaily.day >= month_start, UserActionDaily.user_id != SYSTEM_USER_ID)
+            )).one()
+
+            total_users, new_users_week = (await session.execute(
+                select(func.count(User.id),
+                       func.count(case((User.first_seen >= datetime.combine(week_start, datetime.min.time()), User.id))))
+            )).one()
+
+        dau, wau, mau, events_day, events_week, events_month = activity
+        return {
+            "dau": dau, "wau": wau, "mau": mau,
+            "events_day": events_day, "events_week": events_week, "events_month": events_month,
+            "new_users_week": new_users_week, "total_users": total_users,
+            "stickiness": round(dau / mau * 100) if mau else 0,
+        }
+
+    except Exception as e:
+        logging.error(f"Ошибка при подсчёте сводки активности: {e}")
+        return None
+
+
+async def export_users_to_excel(export_format: str = STATISTICS_EXPORT_FORMAT):
+    """
+    Функция для экспорта статистики пользователей в файл (Excel, CSV или Parquet). Она извлекает данные
+    о пользователях (ID, первое и последнее посещение, общее количество команд, а также
+    количество действий и активных дней за последние 7 дней из дневных агрегатов) из базы данных
     и сохраняет их в файл с названием, включающим текущую дату и день недели.
 
+    Строки читаются из базы пачками и записываются в файл в отдельном потоке, поэтому экспорт
+    не блокирует цикл событий. Если данные не изменились с прошлого экспорта и файл на месте,
+    возвращается прежний файл.
+
+    :param export_format: Формат файла: 'xlsx', 'csv' или 'parquet'.
     :return: str - имя файла, в который были сохранены данные, или None, если данных нет
              или произошла ошибка.
     """
-    
+
     try:
+        writer_class = EXPORT_WRITERS[export_format]
+
+        week_start = _window_start(WEEK_DAYS)
+
         async with async_session() as session:
-            result = await session.execute(select(User.id, User.first_seen, User.last_seen, User.command_count))
-            users = result.all()
+            fingerprint = await _users_fingerprint(session, week_start)
+
+            if not fingerprint[2]:
+                logging.info("Нет данных для экспорта.")
+                return None
 
-        if not users:
-            logging.info("Нет данных для экспорта.")
-            return None
+            previous = _last_export.get(export_format)
+            if previous and previous[0] == fingerprint and os.path.exists(previous[1]):
+                logging.info(f"Данные не изменились, используется файл {previous[1]}.")
+                return previous[1]
 
-        df = pd.DataFrame(users, columns=["user_id", "first_seen", "last_seen", "command_count"])
+            now = datetime.now()
+            month_name = calendar.month_name[now.month]
+            day = calendar.day_name[now.weekday()]
+            year = now.year
 
-        now = datetime.now()
-        month_name = calendar.month_name[now.month]  
-        day = calendar.day_name[now.weekday()]  
-        year = now.year
+            file_name = f"Статистика посещения пользователями за неделю на {day} {month_name} {year}.{export_format}"
 
-        file_name = f"Статистика посещения пользователями за неделю на {day} {month_name} {year}.xlsx"
+            try:
+                writer = await asyncio.to_thread(writer_class, file_name)
+                try:
+                    week_activity = (
+                        select(UserActionDaily.user_id,
+                               func.sum(UserActionDaily.count).label("events"),
+                               func.count(distinct(UserActionDaily.day)).label("active_days"))
+                        .where(UserActionDaily.day >= week_start)
+                        .group_by(UserActionDaily.user_id)
+                        .subquery()
+                    )
+                    result = await session.stream(
+                        select(User.id, User.first_seen, User.last_seen, User.command_count,
+                               func.coalesce(week_activity.c.events, 0),
+                               func.coalesce(week_activity.c.active_days, 0))
+                        .outerjoin(week_activity, week_activity.c.user_id == User.id)
+                        .order_by(User.id)
+                        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+                    )
+                    async for rows in result.partitions(EXPORT_CHUNK_SIZE):
+                        await asyncio.to_thread(writer.write_rows, [tuple(row) for row in rows])
+                finally:
+                    await asyncio.to_thread(writer.close)
+                logging.info(f"Файл {file_name} успешно сохранён.")
+            except Exception as e:
+                logging.error(f"Ошибка при сохранении файла: {e}")
+                return None
 
-        try:
-            df.to_excel(file_name, index=False)
-            logging.info(f"Файл {file_name} успешно сохранён.")
-        except Exception as e:
-            logging.error(f"Ошибка при сохранении файла: {e}")
-            return None
+        _last_export[export_format] = (fingerprint, file_name)
+        _telegram_file_ids.pop(file_name, None)  # Файл перезаписан, старый file_id неактуален
 
         return file_name
 
     except Exception as e:
         logging.error(f"Произошла ошибка при экспорте данных: {e}")
         return None
+
+
+def get_cached_file_id(file_name: str) -> str | None:
+    """
+    file_id ранее загруженного в Telegram файла экспорта, если файл с тех пор не менялся.
+    """
+
+    return _telegram_file_ids.get(file_name)
+
+
+def remember_file_id(file_name: str, file_id: str):
+    """
+    Запоминает file_id загруженного в Telegram файла экспорта для повторной отправки без загрузки.
+    """
+
+    _telegram_file_ids[file_name] = file_id
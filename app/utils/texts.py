@@ -8,11 +8,21 @@ texts.py
 - WELCOME_TEXT: Приветственное сообщение, объясняющее функционал бота.
 - SEARCH_MENU_TEXT: Текст меню поиска, объясняющий доступные критерии поиска.
 - SEARCH_BY_TAG_TEXT: Текст приглашения для выбора тега.
+- MULTI_TAG_SEARCH_TEXT: Инструкция для поиска по нескольким тегам.
+- FILTERS_TEXT: Инструкция для фильтров по цене и крепости.
 - NO_VAPES_FOUND_TEXT: Сообщение об отсутствии найденных товаров.
+- NO_SIMILAR_VAPES_TEXT: Сообщение об отсутствии похожих товаров.
+- SEARCH_EXPIRED_TEXT: Сообщение об устаревших результатах поиска по вкусу.
+- CATALOG_LOADING_TEXT: Ответ, пока каталог загружается после запуска бота.
 - WRITE_TO_MANAGER_TEXT: Инструкция по обращению к менеджеру.
 - VAPES_CATEGORY_TEXT: Текст приглашения к выбору бренда.
 - VAPES_PRODUCT_SELECTION_TEXT: Текст для выбора способа заказа жидкости.
 - CANCEL_BUTTON_TEXT: Текст кнопки возврата в главное меню.
+- STATISTICS_SUMMARY_TEXT: Шаблон сводки активности пользователей для /statistics.
+- SEARCH_STATS_TEXT: Шаблон популярных поисковых запросов для /search_stats.
+- SUBSCRIPTION_NOTIFICATION_TEXT: Шаблон уведомления об изменениях по подпискам.
+- SUBSCRIPTIONS_TEXT: Заголовок списка подписок пользователя.
+- NO_SUBSCRIPTIONS_TEXT: Сообщение об отсутствии подписок.
 """
 
 EMOJIS = {
@@ -33,6 +43,8 @@ EMOJIS = {
     "manager": "✉️",
     "pagination_back": "⬅️",
     "pagination_forward": "➡️",
+    "similar": "🔁",
+    "subscribe": "🔔",
     "menu": "🏠",
 }
 
@@ -53,7 +65,13 @@ SEARCH_MENU_TEXT = '''Выберите критерии поиска
 - название - введите часть вкуса для поиска
 - бред - выберите из списка (напр. Podonki)'''
 SEARCH_BY_TAG_TEXT = 'Выберите тег:'
+MULTI_TAG_SEARCH_TEXT = '''Выберите несколько тегов. Нажатие на тег меняет условие по кругу:
+✅ — обязательно, ➕ — хотя бы один из отмеченных, 🚫 — исключить.'''
+FILTERS_TEXT = '''Настройте фильтры по цене и крепости. Повторное нажатие на выбранный вариант снимает ограничение.'''
 NO_VAPES_FOUND_TEXT = "Не удалость найти жидкости с данным вхождением"
+NO_SIMILAR_VAPES_TEXT = "Похожих жидкостей в этой категории не нашлось"
+SEARCH_EXPIRED_TEXT = "Результаты поиска устарели. Пожалуйста, повторите поиск по названию."
+CATALOG_LOADING_TEXT = "⏳ Каталог загружается, попробуйте через минуту."
 WRITE_TO_MANAGER_TEXT = '''
 ✉️ У вас есть вопрос, нужна помощь либо хотите что-то заказать? Напишите нашему менеджеру прямо сюда! 📩 @VapeSupport_BGTUBot с радостью поможет вам. Не стесняйтесь обращаться, мы всегда на связи! 😊
 '''
@@ -65,3 +83,28 @@ VAPES_PRODUCT_SELECTION_TEXT = '''
 Выберите заказать жидкость или выбрать из имеющегося:
 '''
 CANCEL_BUTTON_TEXT = '🏠 Главное меню'
+STATISTICS_SUMMARY_TEXT = '''📊 Активность пользователей
+
+👥 Уникальные пользователи:
+- за сегодня (DAU): {dau}
+- за 7 дней (WAU): {wau}
+- за 30 дней (MAU): {mau}
+- DAU / MAU: {stickiness}%
+
+📈 Действий:
+- за сегодня: {events_day}
+- за 7 дней: {events_week}
+- за 30 дней: {events_month}
+
+🆕 Новых пользователей за 7 дней: {new_users_week}
+👤 Всего пользователей: {total_users}'''
+SEARCH_STATS_TEXT = '''🔎 Популярные запросы по вкусу:
+{top_queries}
+
+🚫 Популярные запросы без результатов:
+{top_zero_results}'''
+SUBSCRIPTION_NOTIFICATION_TEXT = '''🔔 Изменения по вашим подпискам:
+
+{changes}'''
+SUBSCRIPTIONS_TEXT = '''🔔 Ваши подписки на наличие и цену. Нажмите на подписку, чтобы отменить её:'''
+NO_SUBSCRIPTIONS_TEXT = '''У вас нет подписок. Подписаться на бренд, тег или вкус можно кнопкой 🔔 под списком жидкостей.'''
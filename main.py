@@ -2,13 +2,35 @@ import asyncio
 import logging
 from app.core.core import bot, dp
 from app.core.handlers import router
+from app.core.middlewares import HandlerMetricsMiddleware, ThrottlingMiddleware, UserTrackingMiddleware, user_tracker
+from app.core.readiness import CatalogReadinessMiddleware, readiness
+from app.core.webhook import BOT_MODE, run_webhook
+from app.core.sender import SENDER_GLOBAL_RATE, outbound_sender
+from app.core.storage import SQLiteStorage
+from app.core.workers import BOT_WORKERS, ShardingMiddleware, WorkerPool
+from app.database.catalog import add_catalog_listener
 from app.database.models import async_main
 from app.utils.schedule import scheduler
-from app.utils.logger import log_user_action
-from app.database.requests import populate_database_from_parsing
+from app.utils.logger import log_user_action, log_sink
+from app.utils.search_stats import search_stats
+from app.utils.popularity import popularity
+from app.utils.notifications import subscriptions
+from app.utils.metrics import start_metrics_server
+from app.database.requests import load_catalog_from_database, populate_database_from_parsing
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",)
 
 
+async def warm_up_catalog():
+    """
+    Загружает свежий каталог из Google Таблиц в фоне, пока бот уже принимает обновления.
+    """
+
+    await populate_database_from_parsing()
+    popularity.refresh()  # Порядок "популярные сначала" для только что загруженного каталога
+    if readiness.catalog_ready:
+        readiness.mark("catalog")
+
+
 async def main():
     """
     Главная асинхронная функция для инициализации бота, подключения роутеров,
@@ -16,27 +38,106 @@ async def main():
     
     При старте выполняются следующие операции:
     - Инициализация базы данных (async_main)
-    - Подключение роутеров
-    - Запуск планировщика (scheduler)
-    - Старт polling для получения обновлений от бота
+    - Запуск буферизированной записи логов (log_sink) и состояний FSM (dp.storage)
+    - Запуск очереди исходящих сообщений с ограничением частоты (outbound_sender)
+    - Загрузка известных пользователей и запуск учёта активности (user_tracker)
+    - Загрузка статистики поисковых запросов (search_stats), оценок популярности (popularity)
+      и подписок (subscriptions)
+    - Запуск сервера метрик (METRICS_PORT)
+    - Подключение роутеров и middleware
+    - Загрузка снимка каталога, сохранённого прошлым запуском, из базы каталога
+    - Запуск планировщика (scheduler) и фоновой загрузки каталога из Google Таблиц (warm_up_catalog)
+    - Старт polling или сервера вебхука (BOT_MODE=webhook) для получения обновлений от бота
+
+    Обновления принимаются сразу, не дожидаясь Google Таблиц; пока каталога нет совсем
+    (первый запуск), CatalogReadinessMiddleware отвечает, что каталог загружается.
+
+    Если задан BOT_WORKERS, этот процесс только принимает обновления, загружает каталог
+    и ведёт статистику поиска и популярность по событиям обработчиков, а обработку выполняют
+    процессы-обработчики (app/core/workers.py), которые сами учитывают пользователей
+    и хранят состояния FSM.
+
+    При остановке накопленная активность пользователей, состояния FSM и оставшиеся
+    в очереди логи записываются в базу данных.
     """
     
+    pool = None
+    metrics_server = None
     try:
         await async_main()  # Инициализация базы данных
         logging.info("Database initialized successfully.") 
+
+        metrics_server = await start_metrics_server()  # /metrics для Prometheus, если задан METRICS_PORT
+
+        log_sink.start()  # Фоновая пакетная запись логов действий
+
+        if BOT_WORKERS > 0:
+            # Лимит Bot API общий для бота: делится поровну между этим процессом (уведомления) и обработчиками
+            outbound_sender.global_rate = SENDER_GLOBAL_RATE / (BOT_WORKERS + 1)
+        bot.session.middleware(outbound_sender)
+        outbound_sender.start()  # Очередь исходящих сообщений с ограничением частоты
+
+        await search_stats.load()  # Популярные поисковые запросы, сохранённые до перезапуска
+        await popularity.load()  # Оценки популярности вейпов, брендов и тегов
+
+        if BOT_WORKERS > 0:
+            pool = WorkerPool(BOT_WORKERS)
+            pool.start()  # Процессы-обработчики обновлений
+            # Обработчики перечитывают каталог и получают порядок "популярные сначала" от этого процесса
+            add_catalog_listener(lambda previous, current: pool.broadcast_catalog(current.popularity))
+            popularity.refresh_listeners.append(pool.broadcast_popularity)
+            subscriptions.reload_before_fan_out = True  # Подписки меняют процессы-обработчики
+            dp.update.outer_middleware(ShardingMiddleware(pool))
+        else:
+            if isinstance(dp.storage, SQLiteStorage):
+                dp.storage.start()  # Отложенная запись состояний FSM
+
+            await user_tracker.load_known_users()
+            user_tracker.start()  # Периодическая запись счётчиков команд пользователей
+
+            await subscriptions.load()  # Подписки на наличие и цену
         
+            dp.update.outer_middleware(ThrottlingMiddleware())  # Лимит частоты и склейка повторных нажатий
+            dp.message.outer_middleware(UserTrackingMiddleware())
+            dp.callback_query.outer_middleware(UserTrackingMiddleware())
+            router.message.middleware(HandlerMetricsMiddleware())
+            router.callback_query.middleware(HandlerMetricsMiddleware())
+            router.inline_query.middleware(HandlerMetricsMiddleware())
+            router.message.middleware(CatalogReadinessMiddleware())
+            router.callback_query.middleware(CatalogReadinessMiddleware())
         dp.include_router(router)  # Подключение роутера с обработчиками
+
+        if await load_catalog_from_database():  # Каталог прошлого запуска, пока читаются таблицы
+            popularity.refresh()
+            readiness.mark("catalog")
         
         asyncio.create_task(scheduler())  # Запуск планировщика асинхронных задач
-        
-        logging.info("Bot is starting polling.")
-        await populate_database_from_parsing()
-        await dp.start_polling(bot)  # Запуск polling для получения обновлений от бота
+        asyncio.create_task(warm_up_catalog())  # Свежие данные из Google Таблиц в фоне
+
+        readiness.mark("serving")
+        if BOT_MODE == 'webhook':
+            logging.info("Bot is starting in webhook mode.")
+            await run_webhook(bot, dp)  # Приём обновлений через вебхук
+        else:
+            logging.info("Bot is starting polling.")
+            await dp.start_polling(bot)  # Запуск polling для получения обновлений от бота
 
     except Exception as e:
         await log_user_action(None, "bot_error", f"Error during bot startup: {str(e)}")
         logging.error(f"Error during bot startup: {str(e)}")  
 
+    finally:
+        if pool is not None:
+            await pool.stop()  # Процессы-обработчики дорабатывают принятые обновления
+        await outbound_sender.stop()  # Отправка оставшихся в очереди сообщений
+        await user_tracker.stop()  # Сброс накопленной активности пользователей
+        await search_stats.save()  # Сохранение статистики поиска
+        await popularity.save()  # Сохранение оценок популярности
+        await dp.storage.close()  # Запись оставшихся состояний FSM
+        await log_sink.stop()  # Сброс оставшихся логов
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+
 if __name__ == "__main__":
     """
     Основной блок запуска бота. При завершении работы бота через KeyboardInterrupt
@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+# Базы создаются во временном каталоге до импорта app.database.models
+_database_dir = tempfile.mkdtemp(prefix="glimmer_tests_")
+os.environ.setdefault("SQLALCHEMY_URL", f"sqlite+aiosqlite:///{os.path.join(_database_dir, 'db.sqlite3')}")
+os.environ.setdefault("CATALOG_SQLALCHEMY_URL", f"sqlite+aiosqlite:///{os.path.join(_database_dir, 'catalog.sqlite3')}")
+
+import pytest_asyncio
+from sqlalchemy import delete
+
+from app.database.models import FsmRecord, async_main, async_session, catalog_engine, engine
+
+
+@pytest_asyncio.fixture
+async def database():
+    """
+    Основная база с созданными таблицами; состояния FSM очищаются после теста.
+    """
+
+    await async_main()
+    yield
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(delete(FsmRecord))
+    # Соединения привязаны к циклу событий теста
+    await engine.dispose()
+    await catalog_engine.dispose()
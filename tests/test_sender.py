@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+
+from app.core.sender import OutboundSender, TokenBucket
+
+
+def test_token_bucket_spends_burst_then_waits_for_refill():
+    bucket = TokenBucket(rate=2, capacity=2, now=0.0)
+
+    assert bucket.wait_time(0.0) == 0
+    bucket.take(0.0)
+    bucket.take(0.0)
+    assert bucket.wait_time(0.0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.25) == pytest.approx(0.25)
+    assert bucket.wait_time(0.5) == 0
+
+
+def test_token_bucket_does_not_accumulate_over_capacity():
+    bucket = TokenBucket(rate=2, capacity=2, now=0.0)
+
+    assert bucket.idle(100.0)
+    for _ in range(2):
+        bucket.take(100.0)
+    assert bucket.wait_time(100.0) == pytest.approx(0.5)
+
+
+def test_token_bucket_block_waits_for_retry_after():
+    bucket = TokenBucket(rate=2, capacity=2, now=0.0)
+
+    bucket.block(until=3.0)
+    assert bucket.wait_time(1.0) == pytest.approx(2.0)
+    assert not bucket.idle(2.0)
+    assert bucket.wait_time(3.0) == 0
+
+
+class FakeApi:
+    """
+    Вместо запросов к Bot API запоминает отправленные методы.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, bot, method):
+        self.sent.append(method)
+        return len(self.sent)
+
+
+@pytest.fixture
+def bot():
+    return Bot(token="42:TEST")
+
+
+@pytest.mark.asyncio
+async def test_pending_edits_of_one_message_are_coalesced(bot):
+    api = FakeApi()
+    sender = OutboundSender(global_rate=100, chat_rate=100, chat_burst=1)
+    sender.start()
+    try:
+        results = await asyncio.gather(*(
+            sender(api, bot, EditMessageText(chat_id=7, message_id=5, text=text)) for text in ("a", "b", "c")
+        ))
+    finally:
+        await sender.stop()
+
+    assert [method.text for method in api.sent] == ["c"]
+    assert results == [1, 1, 1]
+    assert sender.metrics["coalesced"] == 2
+    assert not sender.pending_edits
+
+
+@pytest.mark.asyncio
+async def test_edits_of_different_messages_and_sends_are_not_coalesced(bot):
+    api = FakeApi()
+    sender = OutboundSender(global_rate=100, chat_rate=100, chat_burst=5)
+    sender.start()
+    try:
+        await asyncio.gather(
+            sender(api, bot, EditMessageText(chat_id=7, message_id=5, text="a")),
+            sender(api, bot, EditMessageText(chat_id=7, message_id=6, text="b")),
+            sender(api, bot, SendMessage(chat_id=7, text="c")),
+            sender(api, bot, SendMessage(chat_id=7, text="d")),
+        )
+    finally:
+        await sender.stop()
+
+    assert sorted(method.text for method in api.sent) == ["a", "b", "c", "d"]
+    assert sender.metrics["coalesced"] == 0
+
+
+@pytest.mark.asyncio
+async def test_chat_limit_delays_only_its_chat(bot):
+    api = FakeApi()
+    sender = OutboundSender(global_rate=100, chat_rate=5, chat_burst=1)
+    sender.start()
+    try:
+        await asyncio.gather(
+            sender(api, bot, SendMessage(chat_id=7, text="first")),
+            sender(api, bot, SendMessage(chat_id=7, text="second")),
+            sender(api, bot, SendMessage(chat_id=8, text="other chat")),
+        )
+    finally:
+        await sender.stop()
+
+    # Второе сообщение в чат 7 ждёт пополнения лимита чата, а чат 8 его не ждёт
+    assert [method.text for method in api.sent] == ["first", "other chat", "second"]
+
+
+class FloodedApi(FakeApi):
+    """
+    Первый запрос ждёт сигнала и получает 429 с нулевым retry_after, остальные отправляются.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.first_started = asyncio.Event()
+        self.release_first = asyncio.Event()
+        self.calls = 0
+
+    async def __call__(self, bot, method):
+        self.calls += 1
+        if self.calls == 1:
+            self.first_started.set()
+            await self.release_first.wait()
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        return await super().__call__(bot, method)
+
+
+@pytest.mark.asyncio
+async def test_retried_edit_does_not_overwrite_a_newer_edit(bot):
+    api = FloodedApi()
+    sender = OutboundSender(global_rate=100, chat_rate=100, chat_burst=5)
+    sender.start()
+    try:
+        older = asyncio.create_task(sender(api, bot, EditMessageText(chat_id=7, message_id=5, text="old")))
+        await api.first_started.wait()
+        newer = asyncio.create_task(sender(api, bot, EditMessageText(chat_id=7, message_id=5, text="new")))
+        await asyncio.sleep(0.05)
+        api.release_first.set()
+        results = await asyncio.gather(older, newer)
+    finally:
+        await sender.stop()
+
+    # Новая правка ушла, пока старая получала 429, поэтому старая не повторяется
+    assert [method.text for method in api.sent] == ["new"]
+    assert results == [1, 1]
+    assert not sender.latest_edits
+
+
+@pytest.mark.asyncio
+async def test_retried_edit_absorbs_edits_queued_before_the_retry(bot):
+    api = FloodedApi()
+    sender = OutboundSender(global_rate=100, chat_rate=100, chat_burst=5)
+    sender.start()
+    try:
+        older = asyncio.create_task(sender(api, bot, EditMessageText(chat_id=7, message_id=5, text="old")))
+        await api.first_started.wait()
+        api.release_first.set()
+        await asyncio.sleep(0)
+        results = await asyncio.gather(older)
+    finally:
+        await sender.stop()
+
+    assert [method.text for method in api.sent] == ["old"]
+    assert results == [1]
+    assert sender.metrics["retried"] == 1
+    assert not sender.pending_edits and not sender.latest_edits
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+import app.core.storage as storage_module
+from app.core.storage import SQLiteStorage
+from app.database.models import FsmRecord, async_session
+
+KEY = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+
+async def stored_record(storage: SQLiteStorage, key: StorageKey = KEY) -> FsmRecord | None:
+    async with async_session() as session:
+        return await session.scalar(select(FsmRecord).where(FsmRecord.key == storage.key_builder.build(key)))
+
+
+@pytest.mark.asyncio
+async def test_changes_are_written_behind(database):
+    storage = SQLiteStorage(flush_interval=0.05)
+
+    await storage.set_state(KEY, "SearchState:waiting_for_flavor")
+    await storage.set_data(KEY, {"search_in": "on_hand"})
+
+    # Обработчик не ждёт базу: до записи изменения есть только в кэше
+    assert await storage.get_state(KEY) == "SearchState:waiting_for_flavor"
+    assert await stored_record(storage) is None
+
+    storage.start()
+    await asyncio.sleep(0.2)
+    record = await stored_record(storage)
+    assert record.state == "SearchState:waiting_for_flavor"
+    assert record.data == '{"search_in": "on_hand"}'
+    assert not storage.dirty
+
+    # Очищенный диалог удаляется из базы при закрытии хранилища
+    await storage.set_state(KEY, None)
+    await storage.set_data(KEY, {})
+    await storage.close()
+    assert await stored_record(storage) is None
+
+
+@pytest.mark.asyncio
+async def test_state_survives_restart(database):
+    storage = SQLiteStorage()
+    await storage.set_state(KEY, "SearchState:waiting_for_flavor")
+    await storage.close()
+
+    restarted = SQLiteStorage()
+    assert await restarted.get_state(KEY) == "SearchState:waiting_for_flavor"
+    assert restarted.metrics["loaded"] == 1
+
+
+@pytest.mark.asyncio
+async def test_abandoned_dialog_expires(database):
+    storage = SQLiteStorage(ttl=60)
+    await storage.set_state(KEY, "SearchState:waiting_for_flavor")
+    await storage.set_data(KEY, {"search_in": "to_order"})
+    await storage.flush()
+
+    record_key = storage.key_builder.build(KEY)
+    storage.entries[record_key].updated_at = time.time() - 120
+
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {}
+    assert storage.metrics["expired"] == 1
+    assert record_key in storage.dirty
+
+    await storage.flush()
+    assert await stored_record(storage) is None
+
+
+@pytest.mark.asyncio
+async def test_expired_record_in_database_is_ignored(database):
+    async with async_session() as session:
+        async with session.begin():
+            session.add(FsmRecord(key=SQLiteStorage().key_builder.build(KEY), state="SearchState:waiting_for_flavor",
+                                  data='{"search_in": "on_hand"}', updated_at=int(time.time()) - 120))
+
+    storage = SQLiteStorage(ttl=60)
+    assert await storage.get_state(KEY) is None
+    assert await storage.get_data(KEY) == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_changes(database, monkeypatch):
+    storage = SQLiteStorage()
+    await storage.set_state(KEY, "SearchState:waiting_for_flavor")
+    record_key = storage.key_builder.build(KEY)
+
+    def unavailable():
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(storage_module, "async_session", unavailable)
+    await storage.flush()
+    assert storage.dirty == {record_key}
+    assert storage.metrics["written"] == 0
+
+    monkeypatch.undo()
+    await storage.flush()
+    assert not storage.dirty
+    assert (await stored_record(storage)).state == "SearchState:waiting_for_flavor"